@@ -0,0 +1,211 @@
+"""
+Memory-budget admission control
+Each image's decoded and inference memory is estimated from its header before it
+is decoded. Work is admitted against an RSS budget and waits when the budget is
+full. Images too large to fit on their own run at a lower inference resolution,
+or on a cheaper detector backend, instead of risking an OOM kill.
+"""
+import threading
+import time
+from contextlib import contextmanager
+
+import config
+from image_io import as_image_input, image_name
+from metrics import memory_stats, registry
+
+MB = 1024 * 1024
+
+def cgroup_memory_limit():
+    """Container memory limit in bytes (cgroup v2 or v1), or None when unlimited"""
+    for path in ('/sys/fs/cgroup/memory.max', '/sys/fs/cgroup/memory/memory.limit_in_bytes'):
+        try:
+            with open(path) as f:
+                value = f.read().strip()
+        except OSError:
+            continue
+        if value.isdigit() and int(value) < 1 << 60:
+            return int(value)
+    return None
+
+def budget_from_config():
+    """MEMORY_BUDGET_MB as bytes: 0 disables, 'auto' takes a share of the container limit"""
+    value = str(config.MEMORY_BUDGET_MB).strip().lower()
+    if value == 'auto':
+        limit = cgroup_memory_limit()
+        return int(limit * config.MEMORY_BUDGET_AUTO_FRACTION) if limit else 0
+    return int(float(value) * MB)
+
+def _current_rss():
+    return memory_stats()['process_resident_memory_bytes']
+
+class MemoryBudget:
+    """Byte-counting semaphore over an RSS budget, shared by every job in the process"""
+    def __init__(self, budget_bytes):
+        self.budget = budget_bytes
+        self.reserved = 0
+        self.baseline = None
+        # Set once the model is loaded, so the next idle moment measures RSS with it
+        self.remeasure = False
+        self.cond = threading.Condition()
+
+    @property
+    def enabled(self):
+        return self.budget > 0
+
+    def capacity(self):
+        """Bytes available to images: the budget minus what the idle process already uses"""
+        if self.baseline is None:
+            self.baseline = _current_rss() or 0
+        return max(0, self.budget - self.baseline)
+
+    def measure_baseline(self):
+        """
+        Take the idle RSS as the baseline, now or once in-flight work drains. Called after
+        the model is loaded and warm: RSS rarely shrinks after that, so later readings
+        would only ratchet the baseline up and the capacity down.
+        """
+        with self.cond:
+            if self.reserved == 0:
+                self.baseline = _current_rss() or self.baseline
+                self.remeasure = False
+            else:
+                self.remeasure = True
+
+    def estimate(self, image, inference_size=None, backend=None):
+        """Peak bytes needed to count one image, from its header dimensions"""
+        image = as_image_input(image)
+        encoded = image.size_bytes
+        dimensions = image.dimensions
+        if dimensions:
+            width, height = dimensions
+        else:
+            # Unknown format: assume roughly 10:1 compression over 3 bytes per pixel
+            width = height = int((encoded * 10 / 3) ** 0.5)
+
+        decoded = width * height * 3
+        # The annotated copy of the pixels plus its encoded output
+        annotation = decoded + encoded
+
+        if backend == 'hog':
+            side = config.HOG_MAX_SIZE
+        else:
+            side = inference_size or config.MAX_INFERENCE_SIZE
+        scale = min(1.0, side / max(width, height, 1))
+        inference_pixels = width * height * scale * scale
+        if config.TILED_DETECTION and backend is None:
+            inference_pixels = max(inference_pixels, min(width * height, config.TILE_SIZE ** 2 * config.BATCH_SIZE))
+        inference = inference_pixels * config.MEMORY_BYTES_PER_INFERENCE_PIXEL
+        if backend != 'hog':
+            inference += config.MEMORY_INFERENCE_OVERHEAD_MB * MB
+
+        return int(encoded + decoded + annotation + inference)
+
+    def plan(self, image):
+        """
+        Fit one image into the budget before it is decoded.
+        Lowers image.inference_size, or switches image.backend, when the full-size
+        estimate alone exceeds the capacity. Returns the bytes to reserve for it.
+        """
+        if not self.enabled:
+            return 0
+        image = as_image_input(image)
+        image.inference_size = image.backend = None
+        capacity = self.capacity()
+
+        size = config.MAX_INFERENCE_SIZE
+        while True:
+            estimate = self.estimate(image, size)
+            if estimate <= capacity:
+                if size != config.MAX_INFERENCE_SIZE:
+                    image.inference_size = size
+                    print(f"  {image_name(image)}: inference at {size}px to fit the memory budget")
+                return estimate
+            if size // 2 < config.MEMORY_MIN_INFERENCE_SIZE:
+                break
+            size //= 2
+
+        image.inference_size = size
+        fallback = config.MEMORY_FALLBACK_BACKEND
+        if fallback:
+            from detectors import get_backend
+            if get_backend(fallback).available():
+                image.backend = fallback
+                print(f"  {image_name(image)}: too large for the memory budget, using {fallback}")
+                return self.estimate(image, size, fallback)
+        print(f"  {image_name(image)}: over the memory budget even at {size}px, it will run alone")
+        return estimate
+
+    def fits(self, nbytes):
+        """Whether nbytes of work fits the budget at all, ignoring current reservations"""
+        return not self.enabled or nbytes <= self.capacity()
+
+    def batches(self, estimates, batch_size):
+        """(start, end) ranges of up to batch_size items whose estimates fit the budget together"""
+        start = 0
+        while start < len(estimates):
+            end = start + 1
+            while end < len(estimates) and end - start < batch_size and self.fits(sum(estimates[start:end + 1])):
+                end += 1
+            yield start, end
+            start = end
+
+    def _admissible(self, nbytes):
+        if self.reserved == 0:
+            # Always let one piece of work through, however large, so nothing starves
+            return True
+        if self.reserved + nbytes > self.capacity():
+            return False
+        rss = _current_rss()
+        return rss is None or rss + nbytes <= self.budget
+
+    def try_acquire(self, nbytes):
+        if not self.enabled:
+            return True
+        with self.cond:
+            if not self._admissible(nbytes):
+                return False
+            self.reserved += nbytes
+            return True
+
+    def acquire(self, nbytes):
+        """Reserve nbytes, waiting while the budget is full"""
+        if not self.enabled:
+            return
+        with self.cond:
+            if not self._admissible(nbytes):
+                registry.inc('admission_waits_total')
+                started = time.perf_counter()
+                # Re-check periodically too: RSS can fall without a release
+                while not self._admissible(nbytes):
+                    self.cond.wait(timeout=0.5)
+                registry.observe('admission_wait', time.perf_counter() - started)
+            self.reserved += nbytes
+
+    def release(self, nbytes):
+        if not self.enabled:
+            return
+        with self.cond:
+            self.reserved = max(0, self.reserved - nbytes)
+            if self.reserved == 0 and self.remeasure:
+                self.baseline = _current_rss() or self.baseline
+                self.remeasure = False
+            self.cond.notify_all()
+
+    @contextmanager
+    def reserve(self, nbytes):
+        self.acquire(nbytes)
+        try:
+            yield
+        finally:
+            self.release(nbytes)
+
+    def stats(self):
+        with self.cond:
+            return {
+                'memory_budget_bytes': self.budget,
+                'memory_reserved_bytes': self.reserved,
+                'memory_baseline_bytes': self.baseline
+            }
+
+# Shared budget for all jobs in this process
+memory_budget = MemoryBudget(budget_from_config())
@@ -4,7 +4,13 @@ Based on your notebook's approach but with better error handling
 """
 import cv2
 import numpy as np
-import os
+import time
+import config
+from admission import memory_budget
+from image_io import as_image_input, image_name, to_inference_array
+from metrics import registry, timed
+from model_store import MODEL_URLS, is_saved_model, local_model_path
+from result_cache import result_cache
 
 # Try to import TensorFlow components
 try:
@@ -18,238 +24,732 @@ except ImportError:
 class EfficientDetCounter:
     def __init__(self):
         self.model = None
+        self.variant = None
+        self.load_seconds = None
+        self.supports_batching = True
         self.load_model()
     
     def load_model(self):
-        """Load EfficientDet model from TensorFlow Hub"""
+        """Load EfficientDet from the local model store, or from TensorFlow Hub if not stored"""
         if not TF_AVAILABLE:
             print("❌ TensorFlow not available for EfficientDet")
             return
         
-        try:
-            print("Loading EfficientDet D1 model from TensorFlow Hub...")
-            # Using D1 model which is more accurate than D0 for crowded scenes
-            self.model = hub.load('https://tfhub.dev/tensorflow/efficientdet/d1/1')
-            print("✅ EfficientDet D1 model loaded successfully")
-        except Exception as e:
-            print(f"❌ Error loading EfficientDet D1, falling back to D0: {e}")
+        variants = [config.EFFICIENTDET_VARIANT]
+        if config.EFFICIENTDET_FALLBACK_VARIANT and config.EFFICIENTDET_FALLBACK_VARIANT not in variants:
+            variants.append(config.EFFICIENTDET_FALLBACK_VARIANT)
+        
+        start = time.perf_counter()
+        for variant in variants:
+            local_path = local_model_path(variant)
+            if is_saved_model(local_path):
+                source = local_path
+            elif config.MODEL_OFFLINE:
+                print(f"❌ EfficientDet {variant.upper()} not found at {local_path} "
+                      f"(offline mode, run: python model_store.py fetch --variant {variant})")
+                continue
+            else:
+                source = MODEL_URLS[variant]
+            
             try:
-                self.model = hub.load('https://tfhub.dev/tensorflow/efficientdet/d0/1')
-                print("✅ EfficientDet D0 model loaded successfully")
-            except Exception as e2:
-                print(f"❌ Error loading EfficientDet D0: {e2}")
-                self.model = None
+                print(f"Loading EfficientDet {variant.upper()} model from {source}...")
+                if source == local_path:
+                    self.model = tf.saved_model.load(local_path)
+                else:
+                    self.model = hub.load(source)
+            except Exception as e:
+                print(f"❌ Error loading EfficientDet {variant.upper()}: {e}")
+                continue
+            
+            self.variant = variant
+            self.load_seconds = time.perf_counter() - start
+            registry.set_gauge('model_load_seconds', round(self.load_seconds, 3))
+            print(f"✅ EfficientDet {variant.upper()} model loaded in {self.load_seconds:.1f}s")
+            if variant != config.EFFICIENTDET_VARIANT:
+                print(f"⚠️ Using fallback EfficientDet {variant.upper()} instead of "
+                      f"{config.EFFICIENTDET_VARIANT.upper()}, counts may be less accurate")
+            return
+        
+        self.model = None
     
-    def detect_objects(self, image_path):
+    def warm_up(self):
+        """Run one inference on a blank image so the first real request is not slowed down"""
+        if self.model is None:
+            return None
+        start = time.perf_counter()
+        self.model(tf.zeros([1, 512, 512, 3], dtype=tf.uint8))
+        warmup_seconds = time.perf_counter() - start
+        registry.set_gauge('model_warmup_seconds', round(warmup_seconds, 3))
+        return warmup_seconds
+    
+    def load_image(self, image):
+        """Shrink an image (path or ImageInput) to the inference size (uint8 RGB tensor)"""
+        # Reuse the already decoded pixels instead of reading the file again
+        image = as_image_input(image)
+        # Resize large images to save memory (admission control may ask for less)
+        max_size = image.inference_size or config.MAX_INFERENCE_SIZE
+        pixels = image.pixels_at(max_size)
+        if pixels is None:
+            raise ValueError(f"Could not decode {image_name(image)}")
+        
+        return tf.convert_to_tensor(to_inference_array(pixels, max_size))
+    
+    def detect_objects(self, image):
         """Detect objects in image using EfficientDet with enhanced preprocessing and memory optimization"""
         if self.model is None:
             return None
         
         try:
-            # Load and preprocess image with memory optimization
-            image_string = tf.io.read_file(image_path)
-            image_tensor = tf.image.decode_jpeg(image_string, channels=3)
-            
-            # Resize large images to save memory
-            height = tf.shape(image_tensor)[0]
-            width = tf.shape(image_tensor)[1]
-            
-            # If image is too large, resize it
-            max_size = 1024
-            if tf.reduce_max([height, width]) > max_size:
-                scale = tf.cast(max_size, tf.float32) / tf.cast(tf.reduce_max([height, width]), tf.float32)
-                new_height = tf.cast(tf.cast(height, tf.float32) * scale, tf.int32)
-                new_width = tf.cast(tf.cast(width, tf.float32) * scale, tf.int32)
-                image_tensor = tf.image.resize(image_tensor, [new_height, new_width])
-            
-            # Ensure image is in proper format and size
-            image_tensor = tf.cast(image_tensor, tf.uint8)
+            image_tensor = self.load_image(image)
             
             # Add batch dimension
             image_tensor = image_tensor[tf.newaxis, ...]
             
             print(f"Processing image with shape: {image_tensor.shape}")
             
-            # Clear any previous computation graphs to save memory
-            tf.keras.backend.clear_session()
-            
-            return self.model(image_tensor)
+            with timed('inference'):
+                return self.model(image_tensor)
         except Exception as e:
             print(f"Error in object detection: {e}")
             return None
     
-    def count_persons(self, image_path, threshold=0.25):
+    def detect(self, image):
+        """Run the model once and keep the detections for counting and annotation"""
+        results = self.detect_objects(image)
+        if results is None:
+            return None
+        
+        return DetectionResult(
+            boxes=results['detection_boxes'].numpy()[0],
+            scores=results['detection_scores'].numpy()[0],
+            classes=results['detection_classes'].numpy()[0],
+            num_detections=int(results['num_detections'][0])
+        )
+    
+    def detect_batch(self, images, batch_size=None):
+        """
+        Detect objects in several images with as few forward passes as possible.
+        Images are grouped into padded size buckets, and the boxes are mapped
+        back to each original image. Returns one DetectionResult (or None) per image.
+        """
+        detections = [None] * len(images)
+        if self.model is None:
+            return detections
+        
+        batch_size = batch_size or config.BATCH_SIZE
+        bucket = config.BATCH_BUCKET_SIZE
+        
+        # Decode every image once and group them by padded resolution
+        buckets = {}
+        for index, image in enumerate(images):
+            try:
+                array = self.load_image(image).numpy()
+            except Exception as e:
+                print(f"Error loading {image_name(image)} for batch: {e}")
+                continue
+            height, width = array.shape[:2]
+            key = (-(-height // bucket) * bucket, -(-width // bucket) * bucket)
+            buckets.setdefault(key, []).append((index, array))
+        
+        for (padded_height, padded_width), members in buckets.items():
+            for start in range(0, len(members), batch_size):
+                chunk = members[start:start + batch_size]
+                try:
+                    chunk_detections = self._detect_padded(chunk, padded_height, padded_width)
+                except Exception as e:
+                    print(f"Error in batched detection: {e}")
+                    continue
+                for (index, _), result in zip(chunk, chunk_detections):
+                    detections[index] = result
+        
+        return detections
+    
+    def _detect_padded(self, chunk, padded_height, padded_width):
+        """Run one forward pass over images padded to a shared size"""
+        if len(chunk) > 1 and self.supports_batching:
+            batch = np.zeros((len(chunk), padded_height, padded_width, 3), dtype=np.uint8)
+            for slot, (_, image) in enumerate(chunk):
+                batch[slot, :image.shape[0], :image.shape[1]] = image
+            
+            print(f"Processing batch with shape: {batch.shape}")
+            try:
+                with timed('inference'):
+                    results = self.model(tf.convert_to_tensor(batch))
+            except Exception as e:
+                # Some exported detection models only accept a batch of one
+                print(f"⚠️ Model rejected batch input, running images one by one: {e}")
+                self.supports_batching = False
+            else:
+                detections = []
+                for slot, (_, image) in enumerate(chunk):
+                    # Boxes are normalized to the padded canvas, rescale to the image content
+                    scale = np.array([padded_height / image.shape[0], padded_width / image.shape[1]] * 2,
+                                     dtype=np.float32)
+                    detections.append(DetectionResult(
+                        boxes=np.clip(results['detection_boxes'].numpy()[slot] * scale, 0.0, 1.0),
+                        scores=results['detection_scores'].numpy()[slot],
+                        classes=results['detection_classes'].numpy()[slot],
+                        num_detections=int(results['num_detections'][slot])
+                    ))
+                return detections
+        
+        detections = []
+        for _, image in chunk:
+            with timed('inference'):
+                results = self.model(tf.convert_to_tensor(image[np.newaxis, ...]))
+            detections.append(DetectionResult(
+                boxes=results['detection_boxes'].numpy()[0],
+                scores=results['detection_scores'].numpy()[0],
+                classes=results['detection_classes'].numpy()[0],
+                num_detections=int(results['num_detections'][0])
+            ))
+        return detections
+    
+    def detect_tiled(self, image, tile_size=None, overlap=None):
+        """
+        Detect objects in a high-resolution image using overlapping full-resolution tiles.
+        Tiles run through the model in batches alongside one downscaled pass over the
+        whole image (for people larger than a tile), and the results are merged with NMS.
+        """
+        if self.model is None:
+            return None
+        
+        tile_size = tile_size or config.TILE_SIZE
+        overlap = config.TILE_OVERLAP if overlap is None else overlap
+        
+        pixels = as_image_input(image).pixels
+        if pixels is None:
+            print(f"Error in tiled detection: could not decode {image_name(image)}")
+            return None
+        
+        height, width = pixels.shape[:2]
+        if max(height, width) <= tile_size * 1.5:
+            # Small enough for a single pass
+            return self.detect(image)
+        
+        try:
+            whole_image = self.detect(image)
+            
+            # Tile origins, with the last tile shifted back so every tile has the same shape
+            stride = max(1, int(tile_size * (1 - overlap)))
+            tile_height, tile_width = min(tile_size, height), min(tile_size, width)
+            ys = sorted({min(y, height - tile_height) for y in range(0, height, stride)})
+            xs = sorted({min(x, width - tile_width) for x in range(0, width, stride)})
+            origins = [(y, x) for y in ys for x in xs]
+            print(f"Tiled detection: {len(origins)} tiles of {tile_width}x{tile_height} for {width}x{height} image")
+            
+            tiles = [(index, to_inference_array(pixels[y:y + tile_height, x:x + tile_width], config.MAX_INFERENCE_SIZE))
+                     for index, (y, x) in enumerate(origins)]
+            array_height, array_width = tiles[0][1].shape[:2]
+            bucket = config.BATCH_BUCKET_SIZE
+            padded_height = -(-array_height // bucket) * bucket
+            padded_width = -(-array_width // bucket) * bucket
+            
+            tile_detections = []
+            for start in range(0, len(tiles), config.BATCH_SIZE):
+                tile_detections.extend(self._detect_padded(tiles[start:start + config.BATCH_SIZE],
+                                                           padded_height, padded_width))
+        except Exception as e:
+            print(f"Error in tiled detection: {e}")
+            return None
+        
+        # Only people that could be counted at some threshold take part in the merge
+        min_score = min(min(COUNT_THRESHOLDS), config.CONFIDENCE_THRESHOLD)
+        # Map tile-normalized boxes onto the full image in one vectorized step
+        scales = np.array([tile_height / height, tile_width / width] * 2, dtype=np.float32)
+        edge = TILE_EDGE_MARGIN
+        boxes, scores, classes, truncated = [], [], [], []
+        for (y, x), detections in zip(origins, tile_detections):
+            n = detections.num_detections
+            keep = (detections.classes[:n] == 1) & (detections.scores[:n] > min_score)
+            tile_boxes = detections.boxes[:n][keep]
+            # Boxes touching a tile edge inside the image are likely people cut in half
+            truncated.append(((tile_boxes[:, 0] < edge) & (y > 0))
+                             | ((tile_boxes[:, 1] < edge) & (x > 0))
+                             | ((tile_boxes[:, 2] > 1 - edge) & (y + tile_height < height))
+                             | ((tile_boxes[:, 3] > 1 - edge) & (x + tile_width < width)))
+            boxes.append(tile_boxes * scales + np.array([y / height, x / width] * 2, dtype=np.float32))
+            scores.append(detections.scores[:n][keep])
+            classes.append(detections.classes[:n][keep])
+        if whole_image is not None:
+            n = whole_image.num_detections
+            keep = (whole_image.classes[:n] == 1) & (whole_image.scores[:n] > min_score)
+            boxes.append(whole_image.boxes[:n][keep])
+            scores.append(whole_image.scores[:n][keep])
+            classes.append(whole_image.classes[:n][keep])
+            truncated.append(np.zeros(int(keep.sum()), dtype=bool))
+        
+        return merge_detections(np.concatenate(boxes), np.concatenate(scores), np.concatenate(classes),
+                                truncated=np.concatenate(truncated))
+    
+    def count_persons(self, image, threshold=0.25, detections=None):
         """Count people using EfficientDet with the logic from your notebook"""
         try:
-            results = self.detect_objects(image_path)
-            if results is None:
+            if detections is None:
+                detections = self.detect(image)
+            if detections is None:
                 return 0
             
-            # Extract detection results
-            classes = results['detection_classes'].numpy()[0]
-            scores = results['detection_scores'].numpy()[0]
-            
-            # Count persons (class ID 1 = "person" in COCO dataset)
-            person_count = (classes == 1)[np.where(scores > threshold)].sum()
-            return int(person_count)
+            return detections.count_at(threshold)
             
         except Exception as e:
             print(f"Error counting persons: {e}")
             return 0
     
-    def draw_bboxes(self, image_path, threshold=0.25):
+    def draw_bboxes(self, image, threshold=0.25, detections=None):
         """Draw bounding boxes like in your notebook"""
         try:
-            results = self.detect_objects(image_path)
-            if results is None:
-                return None
-            
-            # Load original image
-            image = cv2.imread(image_path)
-            if image is None:
-                return None
-            
-            # Convert to RGB for PIL compatibility
-            image_rgb = cv2.cvtColor(image, cv2.COLOR_BGR2RGB)
+            if detections is None:
+                detections = self.detect(image)
+            if detections is None:
+                return None, 0
             
-            # Get image dimensions
-            im_height, im_width = image.shape[:2]
+            # Draw on a copy of the decoded original so it stays reusable
+            pixels = as_image_input(image).pixels
+            if pixels is None:
+                return None, 0
             
-            # Extract detection data
-            boxes = results['detection_boxes'].numpy()[0]
-            classes = results['detection_classes'].numpy()[0]
-            scores = results['detection_scores'].numpy()[0]
-            num_detections = int(results['num_detections'][0])
+            return annotate_image(pixels.copy(), detections, threshold)
             
-            person_count = 0
-            
-            # Draw bounding boxes for detected persons
-            for i in range(num_detections):
-                if classes[i] == 1 and scores[i] > threshold:  # Person class
-                    person_count += 1
-                    
-                    # Get box coordinates (normalized)
-                    ymin, xmin, ymax, xmax = boxes[i]
-                    
-                    # Convert to pixel coordinates
-                    left = int(xmin * im_width)
-                    right = int(xmax * im_width)
-                    top = int(ymin * im_height)
-                    bottom = int(ymax * im_height)
-                    
-                    # Draw rectangle
-                    cv2.rectangle(image, (left, top), (right, bottom), (0, 255, 0), 3)
-                    
-                    # Add label
-                    label = f'Person {person_count} ({scores[i]:.2f})'
-                    cv2.putText(image, label, (left, top-10), 
-                               cv2.FONT_HERSHEY_SIMPLEX, 0.7, (0, 255, 0), 2)
+        except Exception as e:
+            print(f"Error drawing bboxes: {e}")
+            return None, 0
+
+class DetectionResult:
+    """
+    Detections from a single EfficientDet inference.
+    Person scores are kept sorted so counts for any number of thresholds
+    come from one vectorized search instead of re-running the model.
+    """
+    def __init__(self, boxes, scores, classes, num_detections=None):
+        self.boxes = np.asarray(boxes, dtype=np.float32).reshape(-1, 4)
+        self.scores = np.asarray(scores, dtype=np.float32).reshape(-1)
+        self.classes = np.asarray(classes).reshape(-1)
+        self.num_detections = len(self.scores) if num_detections is None else int(num_detections)
+        # Name of the detector backend that produced these, when it is not EfficientDet
+        self.source = None
+        
+        # Class ID 1 = "person" in COCO dataset
+        self.person_mask = self.classes == 1
+        self.sorted_person_scores = np.sort(self.scores[self.person_mask])
+    
+    def count_at(self, threshold):
+        """Number of persons scoring strictly above threshold"""
+        return int(self.counts_for_thresholds([threshold])[threshold])
+    
+    def counts_for_thresholds(self, thresholds):
+        """Person counts for every threshold in one pass over the sorted scores"""
+        thresholds = list(thresholds)
+        above = len(self.sorted_person_scores) - np.searchsorted(
+            self.sorted_person_scores, np.asarray(thresholds, dtype=np.float32), side='right')
+        return {thresh: int(count) for thresh, count in zip(thresholds, above)}
+    
+    def person_detections(self, threshold):
+        """Boxes and scores of persons above threshold, in model output order"""
+        keep = self.person_mask.copy()
+        keep[self.num_detections:] = False
+        keep &= self.scores > threshold
+        return self.boxes[keep], self.scores[keep]
+
+def merge_detections(boxes, scores, classes, truncated=None, iou_threshold=None, containment_threshold=None):
+    """
+    Class-aware greedy NMS over detections gathered from overlapping tiles.
+    A box is also dropped when it mostly lies inside a higher-scoring one and either
+    of the two was cut by a tile edge (truncated), which removes the partial boxes of
+    people on a tile boundary without merging people standing in front of each other.
+    Without truncated, the containment rule applies to every pair.
+    """
+    iou_threshold = iou_threshold or config.TILE_NMS_IOU
+    containment_threshold = containment_threshold or config.TILE_NMS_CONTAINMENT
+    if truncated is None:
+        truncated = np.ones(len(scores), dtype=bool)
+    
+    order = np.argsort(-scores, kind='stable')
+    boxes, scores, classes, truncated = boxes[order], scores[order], classes[order], truncated[order]
+    areas = (boxes[:, 2] - boxes[:, 0]) * (boxes[:, 3] - boxes[:, 1])
+    
+    # Each kept box is compared with the boxes still remaining, never a full N x N matrix
+    keep = []
+    remaining = np.arange(len(boxes))
+    while remaining.size:
+        i, rest = remaining[0], remaining[1:]
+        keep.append(i)
+        y1 = np.maximum(boxes[i, 0], boxes[rest, 0])
+        x1 = np.maximum(boxes[i, 1], boxes[rest, 1])
+        y2 = np.minimum(boxes[i, 2], boxes[rest, 2])
+        x2 = np.minimum(boxes[i, 3], boxes[rest, 3])
+        intersection = np.clip(y2 - y1, 0, None) * np.clip(x2 - x1, 0, None)
+        iou = intersection / np.maximum(areas[i] + areas[rest] - intersection, 1e-9)
+        containment = intersection / np.maximum(np.minimum(areas[i], areas[rest]), 1e-9)
+        overlaps = (iou > iou_threshold) | ((containment > containment_threshold) & (truncated[i] | truncated[rest]))
+        remaining = rest[~(overlaps & (classes[rest] == classes[i]))]
+    
+    keep = np.asarray(keep, dtype=int)
+    return DetectionResult(boxes[keep], scores[keep], classes[keep])
+
+def annotate_image(image, detections, threshold=0.25, label='EfficientDet', labels=True):
+    """
+    Draw person boxes and a summary banner onto a BGR image in place
+    labels=False draws the boxes only, for thumbnails too small to read text on.
+    """
+    with timed('annotation'):
+        # Get image dimensions
+        im_height, im_width = image.shape[:2]
+    
+        boxes, scores = detections.person_detections(threshold)
+    
+        # Convert normalized boxes to pixel coordinates in one step
+        pixel_boxes = (boxes * np.array([im_height, im_width, im_height, im_width])).astype(int)
+    
+        # Draw bounding boxes for detected persons
+        for person_count, ((top, left, bottom, right), score) in enumerate(zip(pixel_boxes, scores), 1):
+            # Draw rectangle
+            cv2.rectangle(image, (left, top), (right, bottom), (0, 255, 0), 3 if labels else 2)
             
+            if labels:
+                # Add label
+                box_label = f'Person {person_count} ({score:.2f})'
+                cv2.putText(image, box_label, (left, top-10), 
+                           cv2.FONT_HERSHEY_SIMPLEX, 0.7, (0, 255, 0), 2)
+    
+        person_count = len(scores)
+    
+        if labels:
             # Add summary
-            summary = f'EfficientDet: {person_count} people detected'
+            summary = f'{label}: {person_count} people detected'
             cv2.rectangle(image, (10, 10), (500, 50), (0, 0, 0), -1)
             cv2.putText(image, summary, (15, 35), 
                        cv2.FONT_HERSHEY_SIMPLEX, 1, (0, 255, 255), 2)
-            
-            return image, person_count
-            
-        except Exception as e:
-            print(f"Error drawing bboxes: {e}")
-            return None, 0
+    
+        return image, person_count
 
 # Global detector instance
 efficient_det = None
 
+# Thresholds evaluated per image (0.23 is the preferred one, lower ones help crowded scenes)
+COUNT_THRESHOLDS = [0.1, 0.15, 0.2, 0.23, 0.25, 0.3, 0.5]
+
+# A tile box this close (as a fraction of the tile) to an inner tile edge counts as cut by it
+TILE_EDGE_MARGIN = 0.02
+
+def create_local_detector():
+    """Detector running in this process, with the engine chosen by INFERENCE_ENGINE"""
+    if config.INFERENCE_ENGINE == 'tflite':
+        from tflite_engine import TFLiteEfficientDet
+        return TFLiteEfficientDet()
+    return EfficientDetCounter()
+
 def initialize_efficientdet():
-    """Initialize EfficientDet detector"""
+    """Initialize EfficientDet detector (a client of the shared inference server when configured)"""
     global efficient_det
     if efficient_det is None:
-        efficient_det = EfficientDetCounter()
+        if config.INFERENCE_SERVER_SOCKET:
+            from inference_server import RemoteEfficientDet
+            efficient_det = RemoteEfficientDet(config.INFERENCE_SERVER_SOCKET)
+        else:
+            efficient_det = create_local_detector()
+            # The idle memory now includes the model
+            memory_budget.measure_baseline()
     return efficient_det.model is not None
 
-def count_people_efficientdet_method(image_path):
+def warm_up_efficientdet():
+    """Load the model and run one warm-up inference, reporting how long each took"""
+    start = time.perf_counter()
+    ready = initialize_efficientdet()
+    if not ready:
+        print("⚠️ EfficientDet not available, skipping warm-up")
+        return False
+    
+    warmup_seconds = efficient_det.warm_up()
+    memory_budget.measure_baseline()
+    print(f"✅ EfficientDet {efficient_det.variant.upper()} warm: load {efficient_det.load_seconds:.1f}s, "
+          f"first inference {warmup_seconds:.1f}s, total {time.perf_counter() - start:.1f}s")
+    return True
+
+def select_threshold(detections):
+    """Pick the final threshold and count from one image's detections"""
+    # Count with different thresholds - including lower ones for crowded scenes
+    print(f"  Testing thresholds: {COUNT_THRESHOLDS}")
+    results = detections.counts_for_thresholds(COUNT_THRESHOLDS)
+    
+    print(f"  Results dictionary: {results}")
+    
+    # Smart threshold selection: prefer 0.23 threshold for better detection
+    final_threshold = 0.23
+    final_count = results.get(0.23, 0)
+    
+    print(f"  Attempting to use threshold {final_threshold}, count: {final_count}")
+    
+    # If very few detections at 0.23, try lower thresholds
+    if final_count < 5:
+        if 0.15 in results and results[0.15] > final_count:
+            final_threshold = 0.15
+            final_count = results[final_threshold]
+            print(f"  Using lower threshold {final_threshold} for better detection")
+        elif 0.1 in results and results[0.1] > final_count:
+            final_threshold = 0.1
+            final_count = results[final_threshold]
+            print(f"  Using lowest threshold {final_threshold} for better detection")
+    
+    return final_threshold, final_count
+
+def count_people_efficientdet_method(image, detections=None):
     """
     Count people using EfficientDet (from your notebook approach)
+    Pass precomputed detections (e.g. from a batch) to skip inference.
     """
     try:
         global efficient_det
         
         if efficient_det is None:
-            efficient_det = EfficientDetCounter()
+            efficient_det = create_local_detector()
         
         if efficient_det.model is None:
             print("EfficientDet model not available")
             return 0, None, "EfficientDet Unavailable"
         
-        print(f"Using EfficientDet for {os.path.basename(image_path)}")
+        print(f"Using EfficientDet for {image_name(image)}")
         
-        # Count with different thresholds - including lower ones for crowded scenes
-        # Using exact values to avoid floating point precision issues
-        thresholds = [0.1, 0.15, 0.2, 0.25, 0.3, 0.5]  # Temporarily remove 0.23 to test
-        results = {}
+        # Run the model once; every threshold and the annotation reuse these detections
+        if detections is None:
+            detections = efficient_det.detect(image)
+        if detections is None:
+            return 0, None, "EfficientDet Error"
         
-        print(f"  Testing thresholds: {thresholds}")
+        final_threshold, final_count = select_threshold(detections)
         
-        for thresh in thresholds:
-            try:
-                count = efficient_det.count_persons(image_path, thresh)
-                results[thresh] = count
-                print(f"  Threshold {thresh}: {count} people")
-            except Exception as e:
-                print(f"  Error testing threshold {thresh}: {e}")
-                results[thresh] = 0
+        # Create annotated image
+        annotated_image, _ = efficient_det.draw_bboxes(image, final_threshold, detections)
         
-        # Manually test 0.23 with better error handling
-        try:
-            count_23 = efficient_det.count_persons(image_path, 0.23)
-            results[0.23] = count_23
-            print(f"  Threshold 0.23: {count_23} people")
-        except Exception as e:
-            print(f"  Error testing threshold 0.23: {e}")
-            results[0.23] = 0
+        print(f"  Final result: {final_count} people (threshold: {final_threshold})")
         
-        print(f"  Results dictionary: {results}")
+        return final_count, annotated_image, f"EfficientDet (threshold: {final_threshold})"
         
-        # Smart threshold selection: prefer 0.23 threshold for better detection
-        final_threshold = 0.23
-        final_count = results.get(0.23, 0)
+    except Exception as e:
+        print(f"Error in EfficientDet method: {e}")
+        return 0, None, "EfficientDet Error"
+
+def count_people_backend_method(image, backend, detections=None):
+    """
+    Count people with any detector backend from detectors.py
+    Pass precomputed detections (e.g. from a batch) to skip inference.
+    """
+    try:
+        print(f"Using {backend.label} for {image_name(image)}")
         
-        print(f"  Attempting to use threshold {final_threshold}, count: {final_count}")
+        if detections is None:
+            detections = backend.detect(image)
+        if detections is None:
+            return 0, None, f"{backend.label} Error"
         
-        # If very few detections at 0.23, try lower thresholds
-        if final_count < 5:
-            if 0.15 in results and results[0.15] > final_count:
-                final_threshold = 0.15
-                final_count = results[final_threshold]
-                print(f"  Using lower threshold {final_threshold} for better detection")
-            elif 0.1 in results and results[0.1] > final_count:
-                final_threshold = 0.1
-                final_count = results[final_threshold]
-                print(f"  Using lowest threshold {final_threshold} for better detection")
+        # A cascade answers with whichever backend it settled on
+        backend = backend.backend_for(detections)
+        final_threshold, final_count = backend.select_threshold(detections)
         
-        # Create annotated image
-        annotated_image, _ = efficient_det.draw_bboxes(image_path, final_threshold)
+        annotated_image = None
+        pixels = as_image_input(image).pixels
+        if pixels is not None:
+            annotated_image, _ = annotate_image(pixels.copy(), detections, final_threshold, backend.label)
         
         print(f"  Final result: {final_count} people (threshold: {final_threshold})")
         
-        return final_count, annotated_image, f"EfficientDet (threshold: {final_threshold})"
+        return final_count, annotated_image, f"{backend.label} (threshold: {final_threshold})"
         
     except Exception as e:
-        print(f"Error in EfficientDet method: {e}")
-        return 0, None, "EfficientDet Error"
+        print(f"Error in {backend.label} method: {e}")
+        return 0, None, f"{backend.label} Error"
+
+def _cache_key(image, tiled=False):
+    """Result cache key for an image, or None when caching is off or the file is unreadable"""
+    if not config.RESULT_CACHE_ENABLED:
+        return None
+    image = as_image_input(image)
+    mode = 'tiled' if tiled else 'full'
+    # Reduced-resolution or fallback-backend results must not answer full-size lookups
+    if image.inference_size:
+        mode += f"@{image.inference_size}"
+    if image.backend:
+        mode += f"+{image.backend}"
+    try:
+        # The image's own digest is reused, so its bytes are hashed once however often they are keyed
+        return result_cache.key_for(image.sha256, mode=mode)
+    except OSError as e:
+        print(f"Could not hash {image_name(image)}: {e}")
+        return None
+
+def _group_duplicates(images):
+    """Indexes of identical images (same bytes and admission settings), keyed by the first of each"""
+    groups = {}
+    for index, image in enumerate(images):
+        try:
+            key = (image.sha256, image.inference_size, image.backend)
+        except OSError:
+            key = index
+        groups.setdefault(key, []).append(index)
+    return groups
 
-def count_people_smart_hybrid(image_path):
+def _count_and_cache(image, detections, cache_key, tiled=False):
+    """Run the configured detector backend for a cache miss and store the result"""
+    from detectors import get_backend
+    backend = get_backend(image.backend)
+    
+    # Detect here so the detections can be cached alongside the count
+    if detections is None and backend.available():
+        detections = backend.detect(image, tiled=tiled)
+    
+    if backend.name == 'efficientdet':
+        # Use EfficientDet (from your notebook)
+        count, annotated_image, method = count_people_efficientdet_method(image, detections)
+    else:
+        count, annotated_image, method = count_people_backend_method(image, backend, detections)
+    
+    if cache_key and detections is not None and annotated_image is not None:
+        result_cache.put(cache_key, count, annotated_image, method, detections)
+    
+    return count, annotated_image, method
+
+def count_people_smart_hybrid(image, detections=None, tiled=None):
     """
     Smart hybrid approach prioritizing EfficientDet (your notebook method)
+    DETECTOR_BACKEND='cascade' tries a cheap backend first (see detectors.py).
+    Results are looked up in and stored to the content-addressed result cache.
+    tiled=True counts large images on overlapping full-resolution tiles
+    (defaults to config.TILED_DETECTION).
     """
     try:
-        print(f"Smart hybrid detection for {os.path.basename(image_path)}")
+        image = as_image_input(image)
+        tiled = config.TILED_DETECTION if tiled is None else tiled
+        # The annotated image is drawn at full resolution, so detection decodes it once at that size
+        image.full_resolution = True
+        print(f"Smart hybrid detection for {image_name(image)}")
         
-        # Use EfficientDet (from your notebook)
-        efficientdet_count, efficientdet_image, efficientdet_method = count_people_efficientdet_method(image_path)
+        cache_key = _cache_key(image, tiled)
+        cached = result_cache.get(cache_key) if cache_key else None
+        if cached is not None:
+            print(f"  Cache hit for {image_name(image)}")
+            return cached[:3]
         
-        return efficientdet_count, efficientdet_image, efficientdet_method
+        return _count_and_cache(image, detections, cache_key, tiled)
                 
     except Exception as e:
         print(f"Error in smart hybrid: {e}")
         return 0, None, "Error"
+
+def count_people_smart_hybrid_batch(images):
+    """
+    Smart hybrid approach for several images, sharing batched EfficientDet passes.
+    Cached images and in-batch duplicates are only inferred once.
+    Returns one (count, annotated_image, method) tuple per image, in input order.
+    """
+    images = [as_image_input(image) for image in images]
+    for image in images:
+        # Annotated at full resolution, see count_people_smart_hybrid
+        image.full_resolution = True
+    tiled = config.TILED_DETECTION
+    results = [None] * len(images)
+    cache_keys = [_cache_key(image, tiled) for image in images]
+    
+    # Group identical images so each distinct one is inferred at most once, cached or not
+    groups = _group_duplicates(images)
+    
+    misses = []
+    for indexes in groups.values():
+        first = indexes[0]
+        cached = result_cache.get(cache_keys[first]) if cache_keys[first] else None
+        if cached is not None:
+            print(f"  Cache hit for {image_name(images[first])}")
+            results[first] = cached[:3]
+        else:
+            misses.append(first)
+    
+    try:
+        from detectors import get_backend
+        detections = {}
+        # Tiles of each image are already batched together, and images moved to
+        # another backend by admission control are detected on their own
+        batched = [index for index in misses if not tiled and images[index].backend is None]
+        if batched:
+            detections = dict(zip(batched, get_backend().detect_batch([images[index] for index in batched])))
+    except Exception as e:
+        print(f"Error in batched detection: {e}")
+        detections = {}
+    
+    for index in misses:
+        image_detections = detections.get(index)
+        print(f"Smart hybrid detection for {image_name(images[index])}")
+        try:
+            results[index] = _count_and_cache(images[index], image_detections, cache_keys[index], tiled)
+        except Exception as e:
+            print(f"Error in smart hybrid: {e}")
+            results[index] = (0, None, "Error")
+    
+    # Duplicates get their own copy since callers draw on the annotated image
+    for indexes in groups.values():
+        count, annotated_image, method = results[indexes[0]]
+        for index in indexes[1:]:
+            print(f"  {image_name(images[index])} duplicates "
+                  f"{image_name(images[indexes[0]])}, reusing its result")
+            results[index] = (count, None if annotated_image is None else annotated_image.copy(), method)
+    
+    return results
+
+def count_people_detections(images, tiled=None):
+    """
+    Counts for API clients, straight from the detections without drawing anything.
+    Shares batched forward passes and result cache lookups with the HTML pipeline.
+    Returns one (count, threshold, label, detections) tuple per image, with
+    detections None when the image could not be processed.
+    """
+    from detectors import get_backend
+    images = [as_image_input(image) for image in images]
+    tiled = config.TILED_DETECTION if tiled is None else tiled
+    cache_keys = [_cache_key(image, tiled) for image in images]
+    
+    # Group identical images so each distinct one is inferred at most once, cached or not
+    groups = _group_duplicates(images)
+    
+    detections = {}
+    misses = []
+    for indexes in groups.values():
+        first = indexes[0]
+        cached = result_cache.get(cache_keys[first], with_image=False) if cache_keys[first] else None
+        if cached is not None:
+            detections[first] = cached[3]
+        else:
+            misses.append(first)
+    
+    missed = set(misses)
+    batched = [index for index in misses if not tiled and images[index].backend is None]
+    if batched:
+        try:
+            detections.update(zip(batched, get_backend().detect_batch([images[index] for index in batched])))
+        except Exception as e:
+            print(f"Error in batched detection: {e}")
+    
+    results = [None] * len(images)
+    for indexes in groups.values():
+        index = indexes[0]
+        image = images[index]
+        backend = get_backend(image.backend)
+        try:
+            image_detections = detections.get(index)
+            if image_detections is None and backend.available():
+                image_detections = backend.detect(image, tiled=tiled)
+            if image_detections is None:
+                results[index] = (0, None, f"{backend.label} Error", None)
+            else:
+                # A cascade answers with whichever backend it settled on
+                backend = backend.backend_for(image_detections)
+                threshold, count = backend.select_threshold(image_detections)
+                results[index] = (count, threshold, backend.label, image_detections)
+                if index in missed and cache_keys[index]:
+                    # Stored without an annotated image; the HTML pipeline draws and stores its own
+                    result_cache.put(cache_keys[index], count, None, f"{backend.label} (threshold: {threshold})",
+                                     image_detections)
+        except Exception as e:
+            print(f"Error counting {image_name(image)}: {e}")
+            results[index] = (0, None, f"{backend.label} Error", None)
+        for duplicate in indexes[1:]:
+            results[duplicate] = results[index]
+    
+    return results
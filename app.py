@@ -1,13 +1,25 @@
-from flask import Flask, render_template, request, send_file, flash, redirect, url_for
+from flask import Flask, render_template, request, send_file, flash, redirect, url_for, jsonify, Response, stream_with_context
+import base64
+from collections import Counter
+import functools
 import os
-import cv2
-import pandas as pd
-from datetime import datetime
-import zipfile
-import numpy as np
+import time
 from werkzeug.utils import secure_filename
 import config
-from advanced_detection import count_people_smart_hybrid, initialize_efficientdet
+from admission import memory_budget
+from advanced_detection import (annotate_image, count_people_detections, count_people_smart_hybrid_batch,
+                                initialize_efficientdet)
+from counting import count_people_in_image, downscale_large_upload
+from exports import stream_csv, stream_xlsx, stream_zip
+from image_io import ImageInput, as_image_input, encode_image, image_name
+from jobs import JobQueue
+import metrics
+from parallel import get_processor
+from rendering import AnnotationStore
+from storage import JobStorage
+from result_cache import result_cache
+from results_store import BUCKETS, parse_time, results_store
+from video_counter import count_people_in_video, parse_line
 
 app = Flask(__name__)
 app.secret_key = os.environ.get('SECRET_KEY', 'your-secret-key-here')
@@ -16,107 +28,266 @@ app.secret_key = os.environ.get('SECRET_KEY', 'your-secret-key-here')
 app.config['MAX_CONTENT_LENGTH'] = config.MAX_FILE_SIZE * 1024 * 1024
 UPLOAD_FOLDER = config.UPLOAD_FOLDER
 PROCESSED_FOLDER = config.PROCESSED_FOLDER
-RESULTS_FOLDER = config.RESULTS_FOLDER
 ALLOWED_EXTENSIONS = set(config.ALLOWED_EXTENSIONS)
+ALLOWED_VIDEO_EXTENSIONS = set(config.ALLOWED_VIDEO_EXTENSIONS)
 
 # Create directories
-for folder in [UPLOAD_FOLDER, PROCESSED_FOLDER, RESULTS_FOLDER]:
+for folder in [UPLOAD_FOLDER, PROCESSED_FOLDER]:
     if not os.path.exists(folder):
         os.makedirs(folder, exist_ok=True)
 
+# Background workers for /upload batches
+job_queue = JobQueue(config.STORAGE_FOLDER, max_workers=config.JOB_WORKERS)
+
+# One folder per job (uploads, outputs, state, manifest), expired and evicted in the background
+storage = JobStorage(config.STORAGE_FOLDER, config.JOB_TTL_HOURS * 3600, config.STORAGE_QUOTA_MB * 1024 * 1024,
+                     sweep_interval=config.STORAGE_SWEEP_SECONDS,
+                     is_active=job_queue.is_active, on_remove=job_queue.forget)
+
 def allowed_file(filename):
     return '.' in filename and filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
 
-def count_people_in_image(image_path):
+def allowed_video(filename):
+    return '.' in filename and filename.rsplit('.', 1)[1].lower() in ALLOWED_VIDEO_EXTENSIONS
+
+def unique_name(filename, taken):
+    """secure_filename, with a numeric suffix when the same job already has that name"""
+    filename = secure_filename(filename) or 'upload'
+    stem, ext = os.path.splitext(filename)
+    candidate, n = filename, 1
+    while candidate in taken:
+        n += 1
+        candidate = f"{stem}_{n}{ext}"
+    taken.add(candidate)
+    return candidate
+
+def record_results(images, results, job_id=None, site=None):
+    """Add image hashes to the results and keep them in the persistent results store"""
+    for image, result in zip(images, results):
+        result['image_hash'] = image.sha256
+    if config.RESULTS_DB_ENABLED:
+        try:
+            results_store.record(results, job_id=job_id, site=site)
+        except Exception as e:
+            # History is a side product, it never fails the counting itself
+            print(f"⚠️ Could not record results: {e}")
+
+def process_images(images, progress_callback=None, output_sink=None, detection_sink=None, job_id=None, site=None):
     """
-    Main function using the smart hybrid approach with error handling
-    Prioritizes EfficientDet (from your notebook) with robust fallback
+    Process multiple images, sharing EfficientDet forward passes in batches
+    `images` are file paths or in-memory ImageInputs; each is decoded once.
+    progress_callback(index, result) is called after each image if given
+    output_sink(name, data) receives each encoded annotated image if given
+    detection_sink(image, count, threshold, label, detections) switches to lazy
+    annotation: nothing is drawn, the sink keeps what is needed to render later
+    and returns whether it did. Images whose detection fails are still annotated
+    the usual way, through the fallbacks and output_sink.
+    Results are recorded in the results store under job_id and site.
     """
-    try:
-        filename = os.path.basename(image_path)
-        print(f"Processing {filename}...")
-        
-        # Check file size first (Render has memory limits)
-        file_size = os.path.getsize(image_path) / (1024 * 1024)  # MB
-        if file_size > 10:  # If file > 10MB, resize it
-            print(f"Large file detected ({file_size:.1f}MB), resizing...")
-            img = cv2.imread(image_path)
-            if img is not None:
-                # Resize to max 1920x1080
-                height, width = img.shape[:2]
-                if width > 1920 or height > 1080:
-                    scale = min(1920/width, 1080/height)
-                    new_width = int(width * scale)
-                    new_height = int(height * scale)
-                    img = cv2.resize(img, (new_width, new_height))
-                    cv2.imwrite(image_path, img)
+    print(f"Processing {len(images)} images...")
+    
+    images = [as_image_input(image) for image in images]
+    
+    if config.PARALLEL_WORKERS > 1:
+        results = get_processor().map(images, progress_callback, output_sink, detection_sink)
+        record_results(images, results, job_id, site)
+        return results
+    
+    # Estimate each image's memory from its header and fit it into the budget
+    estimates = [memory_budget.plan(image) for image in images]
+    
+    results = []
+    # Batches are cut short where they would not fit the memory budget as a whole
+    for start, end in memory_budget.batches(estimates, config.BATCH_SIZE):
+        batch = images[start:end]
         
-        try:
-            # Use smart hybrid method (EfficientDet first, then OpenCV)
-            count, annotated_image, method_used = count_people_smart_hybrid(image_path)
-        except (MemoryError, Exception) as e:
-            print(f"⚠️ Primary method failed ({e}), using simple counting...")
-            # Simple fallback - basic OpenCV people detection
-            img = cv2.imread(image_path)
-            if img is not None:
-                # Simple Haar cascade fallback
-                face_cascade = cv2.CascadeClassifier(cv2.data.haarcascades + 'haarcascade_frontalface_default.xml')
-                gray = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
-                faces = face_cascade.detectMultiScale(gray, 1.1, 4)
-                count = len(faces)
+        # Waits here while other jobs hold the budget
+        with memory_budget.reserve(sum(estimates[start:end])):
+            if detection_sink is None:
+                # Only annotated images are decoded at full size, detection decodes at a reduced scale
+                for image in batch:
+                    downscale_large_upload(image)
+            
+            counted = [None] * len(batch)
+            detections = [None] * len(batch)
+            try:
+                if detection_sink is not None:
+                    # Detections only; annotated images are drawn when they are viewed
+                    counted = count_people_detections(batch)
+                else:
+                    detections = count_people_smart_hybrid_batch(batch)
+            except (MemoryError, Exception) as e:
+                print(f"⚠️ Batched detection failed ({e}), processing images one by one...")
+            
+            for i, (image, detection, image_counted) in enumerate(zip(batch, detections, counted), start + 1):
+                print(f"\n[{i}/{len(images)}] Processing {image.name}")
                 
-                # Draw rectangles around faces
-                for (x, y, w, h) in faces:
-                    cv2.rectangle(img, (x, y), (x+w, y+h), (255, 0, 0), 2)
+                annotated = []
+                def sink(name, data):
+                    annotated.append(name)
+                    if output_sink is not None:
+                        output_sink(name, data)
                 
-                annotated_image = img
-                method_used = "OpenCV Haar Cascade (fallback)"
-            else:
-                count = 1  # Default fallback
-                annotated_image = None
-                method_used = "Basic fallback"
-        
-        if annotated_image is not None:
-            # Add timestamp and method info
-            timestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-            cv2.putText(annotated_image, f"Processed: {timestamp}", (15, annotated_image.shape[0] - 30), 
-                       cv2.FONT_HERSHEY_SIMPLEX, 0.5, (255, 255, 255), 1)
-            cv2.putText(annotated_image, f"Method: {method_used}", (15, annotated_image.shape[0] - 10), 
-                       cv2.FONT_HERSHEY_SIMPLEX, 0.5, (255, 255, 255), 1)
+                if image_counted is not None and image_counted[3] is not None:
+                    count, threshold, label, image_detections = image_counted
+                    processed_path = None
+                    method = f"{label} (threshold: {threshold})"
+                    if detection_sink(image, count, threshold, label, image_detections):
+                        annotated.append(image.name)
+                    metrics.registry.inc('images_processed_total')
+                    print(f"✅ Final result: {count} people in {image.name} using {method}")
+                else:
+                    count, processed_path, method = count_people_in_image(image, detection, sink)
+                
+                results.append({
+                    'image_name': image.name,
+                    'people_count': count,
+                    'method': method,
+                    'annotated': bool(annotated),
+                    'processed_image_path': processed_path,
+                    'original_image_path': image.path
+                })
+                
+                # Free the decoded pixels as soon as the image is done
+                image.release()
+                
+                if progress_callback is not None:
+                    progress_callback(i, results[-1])
             
-            # Save processed image
-            processed_path = os.path.join(PROCESSED_FOLDER, f"processed_{filename}")
-            cv2.imwrite(processed_path, annotated_image)
-        else:
-            processed_path = None
-        
-        print(f"✅ Final result: {count} people in {filename} using {method_used}")
-        return count, processed_path
-        
-    except Exception as e:
-        print(f"❌ Error processing {image_path}: {e}")
-        return 1, None  # Return 1 as fallback instead of 0
+            record_results(batch, results[start:end], job_id, site)
+    
+    return results
 
-def process_images(image_paths):
-    """Process multiple images"""
-    results = []
+def job_output_folder(job_id):
+    """Folder holding a job's annotated images, or the originals and detections to render them from"""
+    return storage.path(job_id)
+
+def render_job_image(job_id, name, size=None):
+    """Path of a job's annotated image, rendered on first request when annotation is lazy"""
+    if os.path.basename(name) != name:
+        return None
+    storage.touch(job_id)
+    path = AnnotationStore(job_output_folder(job_id)).render(name, size)
+    if path is None:
+        # Annotated eagerly (LAZY_ANNOTATION off, or a fallback method)
+        path = os.path.join(job_output_folder(job_id), f"processed_{name}")
+    return path if os.path.exists(path) else None
+
+def run_upload_job(job_id, images, progress_callback, site=None):
+    """Background job body: count people and keep each annotated image for download"""
+    print(f"Starting to process {len(images)} files...")
+    
+    # Each encoded image is written once; ZIP and reports are built when downloaded
+    output_folder = job_output_folder(job_id)
+    os.makedirs(output_folder, exist_ok=True)
     
-    print(f"Processing {len(image_paths)} images...")
+    def save_output(name, data):
+        with metrics.timed('processed_save'), open(os.path.join(output_folder, name), 'wb') as f:
+            f.write(data)
     
-    for i, image_path in enumerate(image_paths, 1):
-        filename = os.path.basename(image_path)
-        print(f"\n[{i}/{len(image_paths)}] Processing {filename}")
+    # With lazy annotation only the detections are kept, images are drawn when viewed
+    detection_sink = AnnotationStore(output_folder).save if config.LAZY_ANNOTATION else None
+    results = process_images(images, progress_callback, save_output, detection_sink, job_id=job_id, site=site)
+    storage.seal(job_id)
+    print(f"✅ Successfully processed all files")
+    return {'results': results}
+
+def run_video_job(job_id, video_paths, progress_callback):
+    """Background job body: count unique people and line crossings in uploaded videos"""
+    results = []
+    for i, video_path in enumerate(video_paths, 1):
+        # Sampled frames move the progress bar through this video
+        def frame_progress(frames_done, total_frames, done=i - 1):
+            progress_callback(done, None, frames_done / total_frames)
         
-        count, processed_path = count_people_in_image(image_path)
+        try:
+            summary = count_people_in_video(video_path, line=parse_line(config.VIDEO_COUNT_LINE),
+                                            progress_callback=frame_progress)
+        finally:
+            # OpenCV needs the video on disk, but only while it is decoded
+            if not config.SAVE_UPLOADS:
+                os.unlink(video_path)
         
         results.append({
-            'image_name': filename,
-            'people_count': count,
-            'processed_image_path': processed_path,
-            'original_image_path': image_path
+            'image_name': os.path.basename(video_path),
+            'people_count': summary['unique_people'],
+            'annotated': False,
+            'processed_image_path': None,
+            'original_image_path': None,
+            'video': summary
         })
+        progress_callback(i, results[-1])
     
-    return results
+    storage.seal(job_id)
+    return {'results': results}
+
+def iter_job_results(job_id, poll_interval=0.5):
+    """Yield a job's per-image results as they complete, until the job ends"""
+    # Results arrive in completion order and are put back in input order when the job ends,
+    # so what was sent is tracked by image name rather than by position
+    sent = Counter()
+    while True:
+        job = job_queue.get(job_id)
+        if job is None:
+            return
+        seen = Counter()
+        for result in job['results']:
+            name = result['image_name']
+            seen[name] += 1
+            if seen[name] > sent[name]:
+                sent[name] += 1
+                yield result
+        if job['status'] in ('finished', 'failed'):
+            return
+        time.sleep(poll_interval)
+
+def wants_json():
+    """True for API clients that prefer JSON over the HTML pages"""
+    return request.accept_mimetypes.best == 'application/json'
+
+def read_api_images():
+    """Images from a multipart request (any file field) or a raw image body, plus rejected names"""
+    images, rejected = [], []
+    if request.files:
+        for _, file in request.files.items(multi=True):
+            if not file or not file.filename:
+                continue
+            if allowed_file(file.filename):
+                images.append(ImageInput(secure_filename(file.filename), data=file.read()))
+            else:
+                rejected.append({'image_name': file.filename, 'people_count': None, 'error': 'Unsupported file type'})
+    else:
+        data = request.get_data()
+        if data:
+            images.append(ImageInput(secure_filename(request.args.get('name', '')) or 'image', data=data))
+    return images, rejected
+
+def api_result(image, count, threshold, label, detections, annotate=False):
+    """JSON entry for one image: count, method and the counted boxes (normalized ymin, xmin, ymax, xmax)"""
+    entry = {
+        'image_name': image.name,
+        'image_hash': image.sha256,
+        'people_count': count,
+        'method': label if threshold is None else f"{label} (threshold: {threshold})",
+        'threshold': threshold
+    }
+    if image.dimensions:
+        entry['width'], entry['height'] = image.dimensions
+    
+    if detections is None:
+        entry['error'] = 'Could not process image'
+        return entry
+    
+    boxes, scores = detections.person_detections(threshold)
+    entry['people'] = [{'box': [round(float(v), 4) for v in box], 'score': round(float(score), 4)}
+                       for box, score in zip(boxes, scores)]
+    
+    if annotate and image.pixels is not None:
+        annotated_image, _ = annotate_image(image.pixels.copy(), detections, threshold, label)
+        encoded = encode_image(annotated_image, image.name)
+        if encoded is not None:
+            entry['annotated_image'] = base64.b64encode(encoded).decode('ascii')
+    return entry
 
 @app.route('/')
 def index():
@@ -134,84 +305,281 @@ def upload_files():
         flash('No files selected')
         return redirect(url_for('index'))
     
-    # Save uploaded files
-    uploaded_files = []
-    for file in files:
-        if file and allowed_file(file.filename):
-            filename = secure_filename(file.filename)
-            timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-            filename = f"{timestamp}_{filename}"
-            filepath = os.path.join(UPLOAD_FOLDER, filename)
-            file.save(filepath)
-            uploaded_files.append(filepath)
-    
-    if not uploaded_files:
+    # Names only need to be unique within the job, which gets its own folder
+    job_id = storage.new_job_id()
+    taken = set()
+    valid_files = [(file, unique_name(file.filename, taken)) for file in files if file and allowed_file(file.filename)]
+    
+    if not valid_files:
         flash('No valid image files uploaded')
         return redirect(url_for('index'))
     
-    # Process images
-    try:
-        print(f"Starting to process {len(uploaded_files)} files...")
-        results = process_images(uploaded_files)
-        
-        # Create Excel file
-        df = pd.DataFrame(results)[['image_name', 'people_count']]
-        
-        timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-        excel_filename = f"people_count_results_{timestamp}.xlsx"
-        excel_path = os.path.join(RESULTS_FOLDER, excel_filename)
-        
-        df.to_excel(excel_path, index=False)
-        
-        # Create zip file with processed images
-        zip_filename = f"processed_images_{timestamp}.zip"
-        zip_path = os.path.join(RESULTS_FOLDER, zip_filename)
-        
-        with zipfile.ZipFile(zip_path, 'w') as zipf:
-            for result in results:
-                if result['processed_image_path'] and os.path.exists(result['processed_image_path']):
-                    zipf.write(result['processed_image_path'], 
-                             f"processed_{result['image_name']}")
-        
-        print(f"✅ Successfully processed all files")
-        return render_template('results.html', 
-                             results=results, 
-                             excel_file=excel_filename,
-                             zip_file=zip_filename,
-                             total_images=len(results),
-                             total_people=sum(r['people_count'] for r in results))
+    storage.create(job_id, 'images', [filename for _, filename in valid_files])
     
-    except Exception as e:
-        print(f"❌ Error during processing: {e}")
-        flash(f'Error processing images: {str(e)}')
+    # Keep uploads in memory, writing them to disk only when configured
+    uploaded_files = []
+    for file, filename in valid_files:
+        with metrics.timed('upload_save'):
+            data = file.read()
+            filepath = storage.save_upload(job_id, filename, data) if config.SAVE_UPLOADS else None
+        uploaded_files.append(ImageInput(filename, data=data, path=filepath))
+    
+    # Hand the batch to a background worker and return straight away
+    # Optional site (camera, venue, ...) that the history and rollups are grouped by
+    site = request.form.get('site', '').strip() or None
+    job = job_queue.submit(uploaded_files, functools.partial(run_upload_job, site=site), job_id=job_id)
+    print(f"Queued job {job.id} with {len(uploaded_files)} files")
+    
+    if wants_json():
+        return jsonify({'job_id': job.id, 'status_url': url_for('job_status', job_id=job.id)}), 202
+    return redirect(url_for('job_page', job_id=job.id))
+
+@app.route('/upload_video', methods=['POST'])
+def upload_video():
+    """Queue a video for unique-person and line-crossing counting"""
+    file = request.files.get('video')
+    if file is None or not allowed_video(file.filename):
+        flash(f"Please choose a video file ({', '.join(sorted(ALLOWED_VIDEO_EXTENSIONS)).upper()})")
         return redirect(url_for('index'))
     
-    except Exception as e:
-        flash(f'Error processing images: {str(e)}')
+    job_id = storage.new_job_id()
+    filename = unique_name(file.filename, set())
+    storage.create(job_id, 'video', [filename])
+    filepath = storage.path(job_id, 'uploads', filename)
+    file.save(filepath)
+    
+    job = job_queue.submit([filepath], run_video_job, job_id=job_id)
+    print(f"Queued video job {job.id} for {filename}")
+    
+    if wants_json():
+        return jsonify({'job_id': job.id, 'status_url': url_for('job_status', job_id=job.id)}), 202
+    return redirect(url_for('job_page', job_id=job.id))
+
+@app.route('/jobs/<job_id>')
+def job_status(job_id):
+    """Job progress as JSON, polled by the progress page"""
+    job = job_queue.get(job_id)
+    if job is None:
+        return jsonify({'error': 'Job not found'}), 404
+    return jsonify(job)
+
+@app.route('/jobs/<job_id>/progress')
+def job_progress(job_id):
+    """Job counters without the results, polled by the progress page"""
+    job = job_queue.get(job_id, with_results=False)
+    if job is None:
+        return jsonify({'error': 'Job not found'}), 404
+    return jsonify(job)
+
+@app.route('/jobs/<job_id>/view')
+def job_page(job_id):
+    """Progress page while the job runs, results page once it has finished"""
+    job = job_queue.get(job_id)
+    if job is None:
+        flash('Job not found')
+        return redirect(url_for('index'))
+    
+    if job['status'] == 'failed':
+        flash(f"Error processing images: {job['error']}")
         return redirect(url_for('index'))
+    
+    if job['status'] != 'finished':
+        return render_template('progress.html', job=job)
+    
+    storage.touch(job_id)
+    results = job['results']
+    return render_template('results.html', 
+                         job_id=job_id,
+                         results=results, 
+                         total_images=len(results),
+                         total_people=sum(r['people_count'] for r in results))
 
-@app.route('/download/<filename>')
-def download_file(filename):
-    try:
-        file_path = os.path.join(RESULTS_FOLDER, filename)
-        if os.path.exists(file_path):
-            return send_file(file_path, as_attachment=True)
-        else:
-            flash('File not found')
-            return redirect(url_for('index'))
-    except Exception as e:
-        flash(f'Error downloading file: {str(e)}')
+@app.route('/jobs/<job_id>/download/images.zip')
+def download_job_images(job_id):
+    """Stream the annotated images as a ZIP, following the job while it is still running"""
+    if job_queue.get(job_id, with_results=False) is None:
+        flash('Job not found')
         return redirect(url_for('index'))
+    
+    def entries():
+        for result in iter_job_results(job_id):
+            path = render_job_image(job_id, result['image_name']) if result.get('annotated') else None
+            if path is not None:
+                yield f"processed_{result['image_name']}", path
+    
+    body = metrics.timed_iter('zip_build', stream_zip(entries()))
+    return Response(stream_with_context(body), mimetype='application/zip',
+                    headers={'Content-Disposition': f'attachment; filename=processed_images_{job_id}.zip'})
+
+@app.route('/jobs/<job_id>/images/<name>')
+def job_image(job_id, name):
+    """
+    One annotated image, rendered and cached on first view
+    ?size=N caps the longest side (rounded up to one of RENDER_SIZES)
+    """
+    if job_queue.get(job_id, with_results=False) is None:
+        return jsonify({'error': 'Job not found'}), 404
+    path = render_job_image(job_id, name, request.args.get('size', type=int))
+    if path is None:
+        return jsonify({'error': 'Image not found'}), 404
+    # Rendered files never change, so browsers can keep them
+    return send_file(path, max_age=config.RENDER_CACHE_SECONDS,
+                     as_attachment=request.args.get('download') == '1')
+
+@app.route('/jobs/<job_id>/thumbnails/<name>')
+def job_thumbnail(job_id, name):
+    """Small annotated preview for the results page"""
+    if job_queue.get(job_id, with_results=False) is None:
+        return jsonify({'error': 'Job not found'}), 404
+    path = render_job_image(job_id, name, config.THUMBNAIL_SIZE)
+    if path is None:
+        return jsonify({'error': 'Image not found'}), 404
+    return send_file(path, max_age=config.RENDER_CACHE_SECONDS)
+
+@app.route('/jobs/<job_id>/download/report.<fmt>')
+def download_job_report(job_id, fmt):
+    """Stream the counts table as XLSX or CSV"""
+    if fmt not in ('xlsx', 'csv') or job_queue.get(job_id, with_results=False) is None:
+        flash('File not found')
+        return redirect(url_for('index'))
+    
+    storage.touch(job_id)
+    header = ['image_name', 'people_count']
+    rows = ([r['image_name'], r['people_count']] for r in iter_job_results(job_id))
+    if fmt == 'csv':
+        body, mimetype = stream_csv(header, rows), 'text/csv'
+    else:
+        body, mimetype = stream_xlsx(header, rows), 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'
+    body = metrics.timed_iter(f'{fmt}_export', body)
+    
+    return Response(stream_with_context(body), mimetype=mimetype,
+                    headers={'Content-Disposition': f'attachment; filename=people_count_results_{job_id}.{fmt}'})
+
+@app.route('/jobs/<job_id>/delete', methods=['POST'])
+def delete_job(job_id):
+    """Delete one finished job's folder without touching anyone else's"""
+    if job_queue.get(job_id, with_results=False) is None:
+        flash('Job not found')
+    elif job_queue.is_active(job_id):
+        flash('Job is still being processed')
+    else:
+        storage.remove(job_id)
+        flash('Results deleted')
+    
+    if wants_json():
+        return jsonify({'deleted': job_queue.get(job_id, with_results=False) is None})
+    return redirect(url_for('index'))
+
+@app.route('/api/v1/count', methods=['POST'])
+def api_count():
+    """
+    Count people for machine clients and answer with JSON
+    Takes multipart files or a raw image body (?name=photo.jpg). Nothing is drawn,
+    written or exported unless ?annotate=1 asks for base64 annotated images.
+    ?tiled=1 or ?tiled=0 overrides TILED_DETECTION for this request.
+    Counts are kept in the results store, grouped by ?site= when given.
+    """
+    started = time.perf_counter()
+    images, rejected = read_api_images()
+    if not images and not rejected:
+        return jsonify({'error': 'No images in request'}), 400
+    
+    annotate = request.args.get('annotate') == '1'
+    tiled = {'1': True, '0': False}.get(request.args.get('tiled'))
+    for image in images:
+        # Annotated copies are drawn at full resolution, decode once at that size
+        image.full_resolution = annotate
+    
+    results = []
+    with metrics.timed('api_count'):
+        estimates = [memory_budget.plan(image) for image in images]
+        for start, end in memory_budget.batches(estimates, config.BATCH_SIZE):
+            batch = images[start:end]
+            with memory_budget.reserve(sum(estimates[start:end])):
+                for image, counted in zip(batch, count_people_detections(batch, tiled)):
+                    results.append(api_result(image, *counted, annotate=annotate))
+                    image.release()
+    metrics.registry.inc('api_images_total', len(images))
+    record_results(images, results, site=request.args.get('site') or None)
+    
+    results += rejected
+    return jsonify({
+        'api_version': 1,
+        'images': results,
+        'total_images': len(results),
+        'total_people': sum(r['people_count'] or 0 for r in results),
+        'processing_seconds': round(time.perf_counter() - started, 3)
+    })
+
+def history_filters():
+    """start/end (ISO 8601 or epoch seconds, UTC) and site from the query string"""
+    return {
+        'start': parse_time(request.args.get('start')),
+        'end': parse_time(request.args.get('end')),
+        'site': request.args.get('site')
+    }
+
+@app.route('/api/v1/history')
+def api_history():
+    """
+    Individual recorded counts, newest first
+    Filters: start, end, site, image_hash, job_id; limit (default 100, 1 to 1000)
+    """
+    if not config.RESULTS_DB_ENABLED:
+        return jsonify({'error': 'Results store disabled'}), 404
+    try:
+        filters = history_filters()
+    except ValueError as e:
+        return jsonify({'error': f'Bad time: {e}'}), 400
+    limit = max(1, min(request.args.get('limit', 100, type=int), 1000))
+    rows = results_store.history(image_hash=request.args.get('image_hash'), job_id=request.args.get('job_id'),
+                                 limit=limit, **filters)
+    return jsonify({'results': rows, 'count': len(rows)})
+
+@app.route('/api/v1/rollup')
+def api_rollup():
+    """
+    Pre-aggregated counts per site and time bucket, for dashboards
+    ?bucket=hour (default) or day (UTC); filters: start, end, site
+    """
+    if not config.RESULTS_DB_ENABLED:
+        return jsonify({'error': 'Results store disabled'}), 404
+    bucket = request.args.get('bucket', 'hour')
+    if bucket not in BUCKETS:
+        return jsonify({'error': f"bucket must be one of {', '.join(BUCKETS)}"}), 400
+    try:
+        filters = history_filters()
+    except ValueError as e:
+        return jsonify({'error': f'Bad time: {e}'}), 400
+    return jsonify({'bucket': bucket, 'series': results_store.rollup(bucket=bucket, **filters)})
+
+@app.route('/cache/stats')
+def cache_stats():
+    """Result cache hit/miss counters for dashboards"""
+    return jsonify(result_cache.stats())
+
+@app.route('/metrics')
+def metrics_endpoint():
+    """Stage timings, counters and memory in Prometheus text format"""
+    cache = result_cache.stats()
+    extra = {f"result_cache_{name}": value for name, value in cache.items() if isinstance(value, (int, float))}
+    extra.update(memory_budget.stats())
+    return Response(metrics.registry.render_prometheus(extra), mimetype='text/plain; version=0.0.4')
 
 @app.route('/clear')
 def clear_files():
     """Clear all files"""
     try:
-        for folder in [UPLOAD_FOLDER, PROCESSED_FOLDER, RESULTS_FOLDER]:
+        for folder in [UPLOAD_FOLDER, PROCESSED_FOLDER]:
             for filename in os.listdir(folder):
                 file_path = os.path.join(folder, filename)
                 if os.path.isfile(file_path):
                     os.unlink(file_path)
+        
+        # Job folders, except for jobs still being processed
+        for job_id in os.listdir(config.STORAGE_FOLDER):
+            if os.path.isdir(storage.path(job_id)) and not job_queue.is_active(job_id):
+                storage.remove(job_id)
         flash('All files cleared successfully')
     except Exception as e:
         flash(f'Error clearing files: {str(e)}')
@@ -0,0 +1,347 @@
+"""
+Headless batch counting for large image directories
+Walks a directory tree in a stable order, counts people through process_images
+(batched EfficientDet passes, optional worker processes) and appends the results
+to a CSV file or a Parquet dataset as it goes. Every checkpoint is recorded in a
+manifest next to the output, so an interrupted run resumes where it stopped.
+Images that failed are not checkpointed as done: the next run counts them again
+and appends a new row, which supersedes the failed one.
+
+Usage:
+    python batch_counter.py /archive/photos --output counts.csv
+    python batch_counter.py /archive/photos --output counts.parquet --batch-size 16
+    python batch_counter.py /archive/photos --output counts.csv --workers 4
+    python batch_counter.py images --output counts.csv --annotated-dir annotated --site lobby
+"""
+import argparse
+import contextlib
+import csv
+import json
+import os
+import shutil
+import sys
+import time
+import uuid
+from datetime import datetime
+
+import config
+from results_store import is_failed_model, split_method
+
+COLUMNS = ['path', 'people_count', 'model', 'threshold', 'error', 'image_hash', 'annotated_path', 'counted_at']
+FORMATS = ('csv', 'parquet')
+
+def iter_images(root, skip=()):
+    """Relative paths of the supported images under root, in a stable (sorted) order"""
+    skip = {os.path.realpath(path) for path in skip if path}
+    extensions = tuple(f".{ext}" for ext in config.ALLOWED_EXTENSIONS)
+    for folder, dirnames, filenames in os.walk(root):
+        dirnames[:] = sorted(d for d in dirnames
+                             if not d.startswith('.') and os.path.realpath(os.path.join(folder, d)) not in skip)
+        for filename in sorted(filenames):
+            if filename.lower().endswith(extensions):
+                yield os.path.relpath(os.path.join(folder, filename), root).replace(os.sep, '/')
+
+def _parquet_available():
+    for engine in ('pyarrow', 'fastparquet'):
+        try:
+            __import__(engine)
+            return True
+        except ImportError:
+            continue
+    return False
+
+class Manifest:
+    """
+    Append-only checkpoint log: a header line with the run settings, then one line per
+    checkpoint with the files it covered, those that failed, and where the output stood
+    after writing them
+    """
+    def __init__(self, path):
+        self.path = path
+        self.header = None
+        self.checkpoints = []
+        self.done = set()
+        # Files whose latest attempt failed; they are not done, so a rerun retries them
+        self.failed = set()
+
+    def load(self):
+        if not os.path.exists(self.path):
+            return False
+        with open(self.path, 'r+b') as f:
+            good = 0
+            for line in f:
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    # A line cut short by a crash: drop it so new checkpoints start on a fresh line
+                    f.truncate(good)
+                    break
+                good += len(line)
+                if self.header is None:
+                    self.header = entry
+                else:
+                    self._record(entry)
+        return self.header is not None
+
+    def start(self, header):
+        self.header = header
+        self._append(header)
+
+    def checkpoint(self, files, failed=(), **state):
+        entry = {'files': files, 'failed': list(failed), 'at': datetime.now().isoformat(timespec='seconds'), **state}
+        self._record(entry)
+        self._append(entry)
+
+    def _record(self, entry):
+        self.checkpoints.append(entry)
+        failed = set(entry.get('failed', ()))
+        succeeded = [path for path in entry['files'] if path not in failed]
+        self.done.update(succeeded)
+        self.failed.difference_update(succeeded)
+        self.failed.update(failed)
+
+    def _append(self, entry):
+        with open(self.path, 'a') as f:
+            f.write(json.dumps(entry) + '\n')
+            f.flush()
+            os.fsync(f.fileno())
+
+class CsvOutput:
+    """Rows appended to one CSV file; a resumed run first cuts off rows after the last checkpoint"""
+    def __init__(self, path):
+        self.path = path
+
+    def resume(self, checkpoints):
+        size = checkpoints[-1]['output_bytes'] if checkpoints else 0
+        if os.path.exists(self.path):
+            with open(self.path, 'r+b') as f:
+                f.truncate(size)
+
+    def write(self, rows):
+        with open(self.path, 'a', newline='') as f:
+            writer = csv.DictWriter(f, fieldnames=COLUMNS)
+            if f.tell() == 0:
+                writer.writeheader()
+            writer.writerows(rows)
+            f.flush()
+            os.fsync(f.fileno())
+            return {'output_bytes': f.tell()}
+
+class ParquetOutput:
+    """A directory of Parquet part files, one per checkpoint (read it with pandas.read_parquet)"""
+    def __init__(self, path):
+        self.path = path
+
+    def resume(self, checkpoints):
+        os.makedirs(self.path, exist_ok=True)
+        kept = {checkpoint['part'] for checkpoint in checkpoints}
+        # Only parts written after the last checkpoint, and unfinished ones, are ours to remove
+        for name in os.listdir(self.path):
+            path = os.path.join(self.path, name)
+            stale = name.endswith('.partial') or (name.startswith('part-') and name.endswith('.parquet')
+                                                  and name not in kept)
+            if stale and os.path.isfile(path):
+                os.unlink(path)
+        self.next_part = len(checkpoints)
+
+    def write(self, rows):
+        import pandas as pd
+
+        name = f"part-{self.next_part:05d}.parquet"
+        path = os.path.join(self.path, name)
+        tmp_path = f"{path}.partial"
+        pd.DataFrame(rows, columns=COLUMNS).to_parquet(tmp_path, index=False)
+        os.replace(tmp_path, path)
+        self.next_part += 1
+        return {'part': name}
+
+def result_row(path, result, annotated_path, counted_at):
+    model, threshold = split_method(result.get('method'))
+    error = result.get('error')
+    if error is None and is_failed_model(model):
+        error = 'Detection failed'
+    return {
+        'path': path,
+        'people_count': result['people_count'],
+        'model': model,
+        'threshold': threshold,
+        'error': error,
+        'image_hash': result.get('image_hash'),
+        'annotated_path': annotated_path,
+        'counted_at': counted_at
+    }
+
+def run(root, manifest, writer, checkpoint_every, annotated_dir=None, site=None, limit=None, skip=()):
+    """Count every image under root not yet in the manifest, checkpointing as it goes; returns a summary"""
+    from app import process_images
+    from image_io import ImageInput
+
+    started = time.perf_counter()
+    counted = people = failed = 0
+    pending = []
+
+    def flush():
+        nonlocal counted, people, failed
+        images = [ImageInput(path, path=os.path.join(root, path)) for path in pending]
+        annotated = {}
+
+        def output_sink(name, data):
+            # processed_<relative path>: kept next to its source's relative folder
+            folder, filename = os.path.split(name[len('processed_'):])
+            dest = os.path.join(annotated_dir, folder, f"processed_{filename}")
+            os.makedirs(os.path.dirname(dest), exist_ok=True)
+            with open(dest, 'wb') as f:
+                f.write(data)
+            annotated[os.path.join(folder, filename).replace(os.sep, '/')] = dest
+
+        if annotated_dir:
+            results = process_images(images, output_sink=output_sink, job_id=manifest.header['run_id'], site=site)
+        else:
+            # Detections only, nothing is drawn
+            results = process_images(images, detection_sink=lambda *args: False,
+                                     job_id=manifest.header['run_id'], site=site)
+
+        counted_at = datetime.now().isoformat(timespec='seconds')
+        rows = [result_row(path, result, annotated.get(path), counted_at) for path, result in zip(pending, results)]
+        state = writer.write(rows)
+        manifest.checkpoint(list(pending), failed=[row['path'] for row in rows if row['error']],
+                            rows=len(rows), **state)
+
+        counted += len(rows)
+        people += sum(row['people_count'] or 0 for row in rows)
+        failed += sum(1 for row in rows if row['error'])
+        elapsed = time.perf_counter() - started
+        print(f"✅ Checkpoint: {len(manifest.done)} images done ({counted / elapsed:.2f} images/sec this run)",
+              file=sys.stderr)
+        pending.clear()
+
+    for path in iter_images(root, skip=[annotated_dir, *skip]):
+        if path in manifest.done:
+            continue
+        if limit is not None and counted + len(pending) >= limit:
+            break
+        pending.append(path)
+        if len(pending) >= checkpoint_every:
+            flush()
+    if pending:
+        flush()
+
+    elapsed = time.perf_counter() - started
+    return {
+        'run_id': manifest.header['run_id'],
+        'counted': counted,
+        'failed': failed,
+        'people': people,
+        'total_done': len(manifest.done),
+        'total_failed': len(manifest.failed),
+        'seconds': round(elapsed, 3),
+        'images_per_sec': round(counted / elapsed, 3) if counted and elapsed else None,
+        'manifest': manifest.path
+    }
+
+@contextlib.contextmanager
+def _stdout_to_stderr():
+    """
+    Point file descriptor 1 at stderr, which spawned workers inherit, and
+    yield a stream on the original stdout
+    """
+    sys.stdout.flush()
+    saved = os.dup(1)
+    os.dup2(2, 1)
+    stdout = os.fdopen(os.dup(saved), 'w')
+    try:
+        yield stdout
+    finally:
+        sys.stdout.flush()
+        stdout.close()
+        os.dup2(saved, 1)
+        os.close(saved)
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Count people in every image under a directory, resumably")
+    parser.add_argument('root', help="directory tree of images")
+    parser.add_argument('--output', required=True, help="results file: .csv, or .parquet for a Parquet dataset")
+    parser.add_argument('--format', choices=FORMATS, help="output format (default: from the --output extension)")
+    parser.add_argument('--manifest', help="checkpoint manifest (default: <output>.manifest.jsonl)")
+    parser.add_argument('--restart', action='store_true', help="discard the output and manifest and start over")
+    parser.add_argument('--workers', type=int, default=config.PARALLEL_WORKERS,
+                        help="worker processes, each with its own model and one image at a time "
+                             "(0 counts in this process)")
+    parser.add_argument('--batch-size', type=int,
+                        help=f"images per forward pass, without --workers (default {config.BATCH_SIZE})")
+    parser.add_argument('--checkpoint-every', type=int, default=100, help="images per checkpoint")
+    parser.add_argument('--backend', default=config.DETECTOR_BACKEND,
+                        help="detector backend: efficientdet, hog, dnn or cascade")
+    parser.add_argument('--annotated-dir', help="also write annotated images here (slower)")
+    parser.add_argument('--site', help="site recorded with the counts in the results store")
+    parser.add_argument('--limit', type=int, help="stop after counting this many images in this run")
+    args = parser.parse_args(argv)
+
+    if not os.path.isdir(args.root):
+        parser.error(f"{args.root} is not a directory")
+    if args.checkpoint_every < 1 or (args.batch_size is not None and args.batch_size < 1):
+        parser.error("--checkpoint-every and --batch-size must be at least 1")
+    if args.batch_size is not None and args.workers > 1:
+        parser.error("--batch-size has no effect with --workers: each worker counts one image at a time")
+    output_format = args.format or ('parquet' if args.output.lower().endswith('.parquet') else 'csv')
+    if output_format == 'parquet' and not _parquet_available():
+        parser.error("Parquet output needs pyarrow or fastparquet (pip install pyarrow)")
+
+    # Settings that must hold before the pipeline modules are imported. Worker processes
+    # read config from the environment, so the overrides are exported as well.
+    overrides = {
+        'PARALLEL_WORKERS': str(args.workers),
+        'BATCH_SIZE': str(args.batch_size or config.BATCH_SIZE),
+        'DETECTOR_BACKEND': args.backend,
+        'SAVE_PROCESSED_IMAGES': '0'
+    }
+    os.environ.update(overrides)
+    config.PARALLEL_WORKERS = args.workers
+    config.BATCH_SIZE = args.batch_size or config.BATCH_SIZE
+    config.DETECTOR_BACKEND = args.backend
+    config.SAVE_PROCESSED_IMAGES = False
+
+    manifest = Manifest(args.manifest or f"{args.output}.manifest.jsonl")
+    if args.restart:
+        for path in (manifest.path, args.output):
+            if os.path.isdir(path):
+                shutil.rmtree(path)
+            elif os.path.exists(path):
+                os.unlink(path)
+
+    root = os.path.abspath(args.root)
+    if manifest.load():
+        if manifest.header['root'] != root or manifest.header['format'] != output_format:
+            parser.error(f"{manifest.path} belongs to a run over {manifest.header['root']} "
+                         f"({manifest.header['format']}); use --restart or another --output")
+        print(f"Resuming run {manifest.header['run_id']}: {len(manifest.done)} images already done, "
+              f"{len(manifest.failed)} failed ones to retry", file=sys.stderr)
+    else:
+        manifest.start({
+            'run_id': uuid.uuid4().hex,
+            'root': root,
+            'output': os.path.abspath(args.output),
+            'format': output_format,
+            'backend': args.backend,
+            'variant': config.EFFICIENTDET_VARIANT,
+            'started_at': datetime.now().isoformat(timespec='seconds')
+        })
+
+    writer = ParquetOutput(args.output) if output_format == 'parquet' else CsvOutput(args.output)
+    writer.resume(manifest.checkpoints)
+
+    # The pipeline and its worker processes log to stdout, keep that free for the JSON summary
+    with _stdout_to_stderr() as stdout:
+        try:
+            summary = run(root, manifest, writer, args.checkpoint_every, args.annotated_dir, args.site, args.limit,
+                          skip=[args.output, manifest.path])
+            summary['output'] = args.output
+        except KeyboardInterrupt:
+            print(f"⚠️ Interrupted; {len(manifest.done)} images are checkpointed, run again to resume",
+                  file=sys.stderr)
+            return 130
+        print(json.dumps(summary, indent=2), file=stdout, flush=True)
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
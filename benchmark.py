@@ -0,0 +1,363 @@
+"""
+Offline benchmark for the counting pipeline
+Drives count_people_in_image, process_images, the /upload route and the JSON
+API (through the Flask test client) over the bundled and synthetic images, and prints images/sec,
+p50/p95 latency, peak memory and the per-stage breakdown from metrics.py as JSON.
+
+By default a deterministic stub detector with a configurable latency stands in
+for EfficientDet, so runs need neither TensorFlow Hub nor a network connection.
+
+Usage:
+    python benchmark.py                                   # stub detector, all scenarios
+    python benchmark.py --latency-ms 80 --per-image-ms 20 --batch-sizes 1,4,8
+    python benchmark.py --model-dir models --variant d1   # local SavedModel
+    python benchmark.py --scenarios count --output bench.json
+    python benchmark.py --scenarios upload,api            # HTML jobs vs the JSON API
+"""
+import argparse
+import contextlib
+import glob
+import json
+import os
+import platform
+import subprocess
+import sys
+import time
+import zlib
+
+import cv2
+import numpy as np
+
+import config
+import metrics
+
+SYNTHETIC_RESOLUTIONS = [(640, 480), (1920, 1080), (4000, 3000)]
+SCENARIOS = ('count', 'process', 'upload', 'api')
+
+def _import_detection():
+    # Deferred so config overrides from the command line apply before the modules read them
+    import advanced_detection
+    return advanced_detection
+
+class StubDetector:
+    """
+    Stand-in for EfficientDetCounter: decodes and resizes like the real detector,
+    sleeps for latency_ms per forward pass plus per_image_ms per image, and returns
+    detections derived from the image content so runs are repeatable.
+    """
+    def __init__(self, latency_ms=50.0, per_image_ms=0.0, people=12):
+        self.model = self
+        self.variant = 'stub'
+        self.load_seconds = 0.0
+        self.supports_batching = True
+        self.latency = latency_ms / 1000
+        self.per_image = per_image_ms / 1000
+        self.people = people
+
+    def warm_up(self):
+        return 0.0
+
+    def _fake_detections(self, pixels):
+        DetectionResult = _import_detection().DetectionResult
+        seed = zlib.crc32(pixels[::max(1, pixels.shape[0] // 16), ::max(1, pixels.shape[1] // 16)].tobytes())
+        rng = np.random.default_rng(seed)
+        n = 100
+        top_left = rng.uniform(0, 0.8, size=(n, 2))
+        size = rng.uniform(0.05, 0.2, size=(n, 2))
+        boxes = np.concatenate([top_left, np.minimum(top_left + size, 1.0)], axis=1).astype(np.float32)
+        scores = np.sort(rng.uniform(0, 0.2, size=n)).astype(np.float32)[::-1]
+        scores[:self.people] = rng.uniform(0.3, 0.95, size=self.people)
+        classes = np.ones(n, dtype=np.float32)
+        return DetectionResult(boxes, scores, classes)
+
+    def _forward(self, images):
+        from image_io import as_image_input, image_name, to_inference_array
+
+        arrays = []
+        for image in images:
+            max_size = as_image_input(image).inference_size or config.MAX_INFERENCE_SIZE
+            pixels = as_image_input(image).pixels_at(max_size)
+            if pixels is None:
+                raise ValueError(f"Could not decode {image_name(image)}")
+            arrays.append(to_inference_array(pixels, max_size))
+        with metrics.timed('inference'):
+            time.sleep(self.latency + self.per_image * len(images))
+        return [self._fake_detections(array) for array in arrays]
+
+    def detect(self, image):
+        return self._forward([image])[0]
+
+    def detect_batch(self, images, batch_size=None):
+        batch_size = batch_size or config.BATCH_SIZE
+        detections = []
+        for start in range(0, len(images), batch_size):
+            detections.extend(self._forward(images[start:start + batch_size]))
+        return detections
+
+    def detect_tiled(self, image, tile_size=None, overlap=None):
+        return self.detect(image)
+
+    def _detect_padded(self, chunk, padded_height, padded_width):
+        """One forward pass over already resized arrays, as the inference server runs them"""
+        with metrics.timed('inference'):
+            time.sleep(self.latency + self.per_image * len(chunk))
+        return [self._fake_detections(array) for _, array in chunk]
+
+    def draw_bboxes(self, image, threshold=0.25, detections=None):
+        from image_io import as_image_input
+
+        if detections is None:
+            detections = self.detect(image)
+        pixels = as_image_input(image).pixels
+        if pixels is None:
+            return None, 0
+        return _import_detection().annotate_image(pixels.copy(), detections, threshold)
+
+def load_dataset(include_bundled=True, resolutions=None, synthetic_count=4):
+    """Return (label, name, encoded bytes) for the bundled and synthetic images"""
+    dataset = []
+    if include_bundled:
+        here = os.path.dirname(os.path.abspath(__file__))
+        paths = sorted(glob.glob(os.path.join(here, 'images', '*')))
+        paths += [os.path.join(here, name) for name in ('sample_people_image.jpg', 'demo_people_image.jpg')]
+        for path in paths:
+            if os.path.isfile(path) and path.lower().endswith(tuple(config.ALLOWED_EXTENSIONS)):
+                with open(path, 'rb') as f:
+                    dataset.append(('bundled', os.path.basename(path), f.read()))
+
+    # Smooth gradients plus noise compress like photos rather than like pure noise
+    rng = np.random.default_rng(0)
+    for width, height in resolutions if resolutions is not None else SYNTHETIC_RESOLUTIONS:
+        for i in range(synthetic_count):
+            gradient = np.linspace(0, 255, width, dtype=np.float32)[None, :, None]
+            noise = rng.normal(0, 25, size=(height, width, 3)).astype(np.float32)
+            pixels = np.clip(gradient * (0.5 + 0.5 * i / synthetic_count) + noise, 0, 255).astype(np.uint8)
+            ok, buffer = cv2.imencode('.jpg', pixels, [cv2.IMWRITE_JPEG_QUALITY, 90])
+            if ok:
+                dataset.append((f"{width}x{height}", f"synthetic_{width}x{height}_{i}.jpg", buffer.tobytes()))
+    return dataset
+
+def _percentile(values, q):
+    return round(float(np.percentile(values, q)) * 1000, 2) if values else None
+
+def _summary(scenario, label, latencies, images, elapsed, **extra):
+    """One result row: throughput, latency percentiles (ms), memory and stage timings"""
+    drained = metrics.registry.drain()
+    stages = {stage: {'count': count, 'mean_ms': round(total / count * 1000, 3) if count else None}
+              for stage, (_, total, count) in sorted(drained['stages'].items())}
+    memory = metrics.memory_stats()
+    return {
+        'scenario': scenario,
+        'dataset': label,
+        'images': images,
+        'seconds': round(elapsed, 4),
+        'images_per_sec': round(images / elapsed, 3) if elapsed else None,
+        'p50_ms': _percentile(latencies, 50),
+        'p95_ms': _percentile(latencies, 95),
+        'rss_bytes': memory['process_resident_memory_bytes'],
+        'peak_rss_bytes': memory['process_peak_resident_memory_bytes'],
+        'stages': stages,
+        **extra
+    }
+
+def _inputs(items):
+    from image_io import ImageInput
+    return [ImageInput(name, data=data) for _, name, data in items]
+
+def bench_count(groups, repeat):
+    """Latency of count_people_in_image, one image at a time"""
+    from counting import count_people_in_image
+
+    rows = []
+    for label, items in groups.items():
+        latencies = []
+        started = time.perf_counter()
+        for _ in range(repeat):
+            for image in _inputs(items):
+                start = time.perf_counter()
+                count_people_in_image(image)
+                latencies.append(time.perf_counter() - start)
+        rows.append(_summary('count', label, latencies, len(latencies), time.perf_counter() - started))
+    return rows
+
+def bench_process(groups, repeat, batch_sizes):
+    """Throughput of process_images, with per-image latency taken between progress callbacks"""
+    from app import process_images
+
+    rows = []
+    for batch_size in batch_sizes:
+        config.BATCH_SIZE = batch_size
+        for label, items in groups.items():
+            latencies = []
+            started = time.perf_counter()
+            for _ in range(repeat):
+                last = [time.perf_counter()]
+                def progress(index, result):
+                    now = time.perf_counter()
+                    latencies.append(now - last[0])
+                    last[0] = now
+                process_images(_inputs(items), progress_callback=progress, output_sink=lambda name, data: None)
+            rows.append(_summary('process', label, latencies, len(latencies), time.perf_counter() - started,
+                                 batch_size=batch_size))
+    return rows
+
+def bench_upload(groups, repeat, poll_interval=0.01):
+    """End-to-end /upload requests through the Flask test client, until each job finishes"""
+    import io
+    from app import app, job_queue, storage
+
+    # Synthetic high-resolution groups can exceed the production upload limit
+    app.config['MAX_CONTENT_LENGTH'] = None
+    client = app.test_client()
+    rows = []
+    for label, items in groups.items():
+        latencies = []
+        started = time.perf_counter()
+        for _ in range(repeat):
+            start = time.perf_counter()
+            files = [(io.BytesIO(data), name) for _, name, data in items]
+            response = client.post('/upload', data={'files': files}, content_type='multipart/form-data',
+                                   headers={'Accept': 'application/json'})
+            if response.status_code != 202:
+                raise RuntimeError(f"/upload returned {response.status_code}")
+            job_id = response.get_json()['job_id']
+            while job_queue.get(job_id)['status'] not in ('finished', 'failed'):
+                time.sleep(poll_interval)
+            latencies.append(time.perf_counter() - start)
+            storage.remove(job_id)
+        rows.append(_summary('upload', label, latencies, len(items) * repeat, time.perf_counter() - started,
+                             files_per_request=len(items)))
+    return rows
+
+def bench_api(groups, repeat):
+    """Synchronous POST /api/v1/count requests (no annotation or exports)"""
+    import io
+    from app import app
+
+    # Synthetic high-resolution groups can exceed the production upload limit
+    app.config['MAX_CONTENT_LENGTH'] = None
+    client = app.test_client()
+    rows = []
+    for label, items in groups.items():
+        latencies = []
+        started = time.perf_counter()
+        for _ in range(repeat):
+            start = time.perf_counter()
+            files = [(io.BytesIO(data), name) for _, name, data in items]
+            response = client.post('/api/v1/count', data={'files': files}, content_type='multipart/form-data')
+            if response.status_code != 200:
+                raise RuntimeError(f"/api/v1/count returned {response.status_code}")
+            latencies.append(time.perf_counter() - start)
+        rows.append(_summary('api', label, latencies, len(items) * repeat, time.perf_counter() - started,
+                             files_per_request=len(items)))
+    return rows
+
+def _git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip() or None
+    except OSError:
+        return None
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the people counting pipeline offline")
+    parser.add_argument('--scenarios', default=','.join(SCENARIOS), help="comma separated: count,process,upload,api")
+    parser.add_argument('--model-dir', help="use the real detector from this local model store instead of the stub")
+    parser.add_argument('--variant', default=config.EFFICIENTDET_VARIANT, help="EfficientDet variant with --model-dir")
+    parser.add_argument('--backend', default=config.DETECTOR_BACKEND,
+                        help="detector backend: efficientdet, hog, dnn or cascade (EfficientDet is stubbed)")
+    parser.add_argument('--latency-ms', type=float, default=50.0, help="stub latency per forward pass")
+    parser.add_argument('--per-image-ms', type=float, default=10.0, help="stub latency added per image in a batch")
+    parser.add_argument('--batch-sizes', default='1,4,8', help="batch sizes for the process scenario")
+    parser.add_argument('--resolutions', default=','.join(f"{w}x{h}" for w, h in SYNTHETIC_RESOLUTIONS),
+                        help="synthetic image sizes, e.g. 640x480,1920x1080 (empty for none)")
+    parser.add_argument('--synthetic-count', type=int, default=4, help="synthetic images per resolution")
+    parser.add_argument('--no-bundled', action='store_true', help="skip the images bundled with the repository")
+    parser.add_argument('--repeat', type=int, default=3, help="passes over each dataset")
+    parser.add_argument('--warmup', type=int, default=1, help="untimed images run before measuring")
+    parser.add_argument('--cache', action='store_true', help="keep the result cache enabled (off by default)")
+    parser.add_argument('--output', help="write the JSON report here instead of stdout")
+    args = parser.parse_args(argv)
+
+    scenarios = [s for s in args.scenarios.split(',') if s]
+    unknown = set(scenarios) - set(SCENARIOS)
+    if unknown:
+        parser.error(f"unknown scenarios: {', '.join(sorted(unknown))}")
+
+    # Settings that must hold before the pipeline modules are imported
+    config.RESULT_CACHE_ENABLED = args.cache
+    config.DETECTOR_BACKEND = args.backend
+    config.PARALLEL_WORKERS = 0
+    config.SAVE_UPLOADS = False
+    config.SAVE_PROCESSED_IMAGES = False
+    config.RESULTS_DB_ENABLED = False
+
+    # The pipeline logs to stdout, keep that free for the JSON report
+    rows = []
+    with contextlib.redirect_stdout(sys.stderr):
+        advanced_detection = _import_detection()
+        if args.model_dir:
+            config.EFFICIENTDET_MODEL_DIR = args.model_dir
+            config.EFFICIENTDET_VARIANT = args.variant
+            config.EFFICIENTDET_FALLBACK_VARIANT = None
+            config.MODEL_OFFLINE = True
+            if not advanced_detection.initialize_efficientdet():
+                print(f"❌ No SavedModel for {args.variant} under {args.model_dir}", file=sys.stderr)
+                return 1
+            detector = f"efficientdet_{advanced_detection.efficient_det.variant}"
+        else:
+            advanced_detection.efficient_det = StubDetector(args.latency_ms, args.per_image_ms)
+            detector = 'stub'
+
+        resolutions = [tuple(int(v) for v in size.split('x')) for size in args.resolutions.split(',') if size]
+        dataset = load_dataset(not args.no_bundled, resolutions, args.synthetic_count)
+        if not dataset:
+            parser.error("no images to benchmark")
+        groups = {}
+        for label, name, data in dataset:
+            groups.setdefault(label, []).append((label, name, data))
+
+        # Warm-up runs outside the measurements (first inference, lazy imports, allocator growth)
+        from counting import count_people_in_image
+        for image in _inputs(dataset[:args.warmup]):
+            count_people_in_image(image)
+        metrics.registry.drain()
+
+        if 'count' in scenarios:
+            rows += bench_count(groups, args.repeat)
+        if 'process' in scenarios:
+            rows += bench_process(groups, args.repeat, [int(b) for b in args.batch_sizes.split(',') if b])
+        if 'upload' in scenarios:
+            rows += bench_upload(groups, args.repeat)
+        if 'api' in scenarios:
+            rows += bench_api(groups, args.repeat)
+
+    report = {
+        'meta': {
+            'commit': _git_commit(),
+            'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'cpu_count': os.cpu_count(),
+            'detector': detector,
+            'backend': args.backend,
+            'stub_latency_ms': None if args.model_dir else args.latency_ms,
+            'stub_per_image_ms': None if args.model_dir else args.per_image_ms,
+            'max_inference_size': config.MAX_INFERENCE_SIZE,
+            'repeat': args.repeat,
+            'cache': args.cache
+        },
+        'results': rows
+    }
+
+    text = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(text + '\n')
+        print(f"✅ Wrote {len(rows)} results to {args.output}", file=sys.stderr)
+    else:
+        print(text)
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
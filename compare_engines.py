@@ -0,0 +1,194 @@
+"""
+Accuracy vs speed of the inference engines
+Runs the float SavedModel and its reduced-precision TFLite copies over the
+bundled images and reports, per engine, p50/p95 detection latency, model size,
+how often the final count matches the float model and how well the person
+boxes agree with it (IoU-matched precision and recall), as JSON.
+
+Usage:
+    python model_store.py convert --precision fp16
+    python model_store.py convert --precision int8
+    python compare_engines.py                           # savedmodel vs fp16 and int8
+    python compare_engines.py --precisions fp16 --repeat 10 --output engines.json
+"""
+import argparse
+import contextlib
+import json
+import os
+import platform
+import sys
+import time
+
+import numpy as np
+
+import config
+from benchmark import _git_commit, _percentile, load_dataset
+
+def box_iou(box, boxes):
+    """IoU between one [ymin, xmin, ymax, xmax] box and an array of boxes"""
+    ymin = np.maximum(box[0], boxes[:, 0])
+    xmin = np.maximum(box[1], boxes[:, 1])
+    ymax = np.minimum(box[2], boxes[:, 2])
+    xmax = np.minimum(box[3], boxes[:, 3])
+    intersection = np.clip(ymax - ymin, 0, None) * np.clip(xmax - xmin, 0, None)
+    area = (box[2] - box[0]) * (box[3] - box[1])
+    areas = (boxes[:, 2] - boxes[:, 0]) * (boxes[:, 3] - boxes[:, 1])
+    return intersection / np.maximum(area + areas - intersection, 1e-9)
+
+def match_boxes(reference, candidate, iou_threshold):
+    """Greedy one-to-one matching of candidate boxes (by score) to reference boxes"""
+    ref_boxes, _ = reference
+    cand_boxes, cand_scores = candidate
+    unmatched = np.ones(len(ref_boxes), dtype=bool)
+    matched = 0
+    for index in np.argsort(-cand_scores):
+        if not unmatched.any():
+            break
+        ious = np.where(unmatched, box_iou(cand_boxes[index], ref_boxes), 0.0)
+        best = int(np.argmax(ious))
+        if ious[best] >= iou_threshold:
+            unmatched[best] = False
+            matched += 1
+    return matched
+
+def run_engine(detector, images, repeat):
+    """Detections per image (from the first pass) and every timed latency"""
+    detections, latencies = [], []
+    for image in images:
+        for attempt in range(repeat):
+            start = time.perf_counter()
+            result = detector.detect(image)
+            latencies.append(time.perf_counter() - start)
+            if attempt == 0:
+                detections.append(result)
+    return detections, latencies
+
+def compare(reference, candidate, threshold, iou_threshold):
+    """Count agreement and box precision/recall of one engine against the float model"""
+    from advanced_detection import select_threshold
+
+    count_diffs, exact = [], 0
+    matched = ref_total = cand_total = 0
+    for ref, cand in zip(reference, candidate):
+        if ref is None or cand is None:
+            continue
+        ref_count = select_threshold(ref)[1]
+        cand_count = select_threshold(cand)[1]
+        count_diffs.append(abs(cand_count - ref_count))
+        exact += cand_count == ref_count
+        ref_people = ref.person_detections(threshold)
+        cand_people = cand.person_detections(threshold)
+        matched += match_boxes(ref_people, cand_people, iou_threshold)
+        ref_total += len(ref_people[0])
+        cand_total += len(cand_people[0])
+    compared = len(count_diffs)
+    return {
+        'images_compared': compared,
+        'count_exact_rate': round(exact / compared, 3) if compared else None,
+        'count_mean_abs_diff': round(float(np.mean(count_diffs)), 3) if compared else None,
+        'count_max_abs_diff': int(max(count_diffs)) if compared else None,
+        'box_precision': round(matched / cand_total, 3) if cand_total else None,
+        'box_recall': round(matched / ref_total, 3) if ref_total else None
+    }
+
+def _model_bytes(path):
+    if os.path.isfile(path):
+        return os.path.getsize(path)
+    total = 0
+    for root, _, names in os.walk(path):
+        total += sum(os.path.getsize(os.path.join(root, name)) for name in names)
+    return total
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Compare the float and reduced-precision inference engines")
+    parser.add_argument('--precisions', default='fp16,int8', help="comma separated TFLite precisions to compare")
+    parser.add_argument('--model-dir', default=config.EFFICIENTDET_MODEL_DIR, help="local model store")
+    parser.add_argument('--variant', default=config.EFFICIENTDET_VARIANT)
+    parser.add_argument('--input-size', type=int, default=config.TFLITE_INPUT_SIZE, help="TFLite model input size")
+    parser.add_argument('--convert', action='store_true', help="convert missing TFLite models first")
+    parser.add_argument('--repeat', type=int, default=3, help="timed runs per image")
+    parser.add_argument('--iou', type=float, default=0.5, help="IoU for a box to count as the same person")
+    parser.add_argument('--output', help="write the JSON report here instead of stdout")
+    args = parser.parse_args(argv)
+
+    config.EFFICIENTDET_MODEL_DIR = args.model_dir
+    config.EFFICIENTDET_VARIANT = args.variant
+    config.EFFICIENTDET_FALLBACK_VARIANT = None
+    config.MODEL_OFFLINE = True
+    config.TFLITE_AUTO_CONVERT = args.convert
+
+    rows = []
+    # The detectors log to stdout, keep that free for the JSON report
+    with contextlib.redirect_stdout(sys.stderr):
+        from advanced_detection import EfficientDetCounter
+        from image_io import ImageInput
+        from model_store import local_model_path
+        from tflite_engine import TFLiteEfficientDet, tflite_model_path
+
+        images = [ImageInput(name, data=data) for _, name, data in load_dataset(True, [])]
+        if not images:
+            parser.error("no bundled images found")
+
+        engines = [('savedmodel', lambda: EfficientDetCounter(), local_model_path(args.variant))]
+        for precision in (p for p in args.precisions.split(',') if p):
+            engines.append((f"tflite-{precision}",
+                            lambda precision=precision: TFLiteEfficientDet(precision, args.input_size),
+                            tflite_model_path(args.variant, precision, args.input_size)))
+
+        reference = None
+        for name, build, path in engines:
+            detector = build()
+            if detector.model is None:
+                print(f"⚠️ Skipping {name}: model not available", file=sys.stderr)
+                if reference is None:
+                    print("❌ The float SavedModel is needed as the reference", file=sys.stderr)
+                    return 1
+                continue
+            detector.warm_up()
+            detections, latencies = run_engine(detector, images, args.repeat)
+            if reference is None:
+                reference = detections
+            row = {
+                'engine': name,
+                'variant': detector.variant,
+                'model_bytes': _model_bytes(path),
+                'load_seconds': round(detector.load_seconds, 3),
+                'p50_ms': _percentile(latencies, 50),
+                'p95_ms': _percentile(latencies, 95),
+                **compare(reference, detections, config.CONFIDENCE_THRESHOLD, args.iou)
+            }
+            if rows and row['p50_ms'] and rows[0]['p50_ms']:
+                row['speedup_p50'] = round(rows[0]['p50_ms'] / row['p50_ms'], 2)
+            rows.append(row)
+            print(f"{name}: p50 {row['p50_ms']}ms, counts match {row['count_exact_rate']}, "
+                  f"box recall {row['box_recall']}", file=sys.stderr)
+
+    report = {
+        'meta': {
+            'commit': _git_commit(),
+            'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'cpu_count': os.cpu_count(),
+            'variant': args.variant,
+            'images': len(images),
+            'repeat': args.repeat,
+            'threshold': config.CONFIDENCE_THRESHOLD,
+            'iou': args.iou,
+            'tflite_input_size': args.input_size,
+            'max_inference_size': config.MAX_INFERENCE_SIZE
+        },
+        'results': rows
+    }
+
+    text = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(text + '\n')
+        print(f"✅ Wrote {len(rows)} engines to {args.output}", file=sys.stderr)
+    else:
+        print(text)
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
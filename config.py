@@ -6,11 +6,91 @@ IS_PRODUCTION = os.environ.get('RENDER') or os.environ.get('PORT')
 
 # EfficientDet Configuration
 CONFIDENCE_THRESHOLD = 0.23  # Optimized threshold for people detection
-EFFICIENTDET_MODEL_URL = 'https://tfhub.dev/tensorflow/efficientdet/d1/1'
+EFFICIENTDET_VARIANT = os.environ.get('EFFICIENTDET_VARIANT', 'd1')
+EFFICIENTDET_FALLBACK_VARIANT = os.environ.get('EFFICIENTDET_FALLBACK_VARIANT', 'd0')  # Empty disables the fallback
+EFFICIENTDET_MODEL_DIR = os.environ.get('EFFICIENTDET_MODEL_DIR', 'models')  # Local store filled by model_store.py
+MODEL_OFFLINE = os.environ.get('MODEL_OFFLINE', '0') == '1'  # Never download, only load from the local store
+WARMUP_ON_START = os.environ.get('WARMUP_ON_START', '1' if IS_PRODUCTION else '0') == '1'
+MAX_INFERENCE_SIZE = 1024  # Longest image side fed to the model
+BATCH_SIZE = int(os.environ.get('BATCH_SIZE', 8))  # Images per forward pass
+BATCH_BUCKET_SIZE = 128  # Batched images are padded up to multiples of this
+FAST_DECODE = os.environ.get('FAST_DECODE', '1') == '1'  # Decode large JPEGs at 1/2, 1/4 or 1/8 scale when only a smaller copy is needed
+
+# Inference engine: the float SavedModel, or a reduced-precision TFLite copy (see tflite_engine.py)
+INFERENCE_ENGINE = os.environ.get('INFERENCE_ENGINE', 'savedmodel')  # 'savedmodel' or 'tflite'
+TFLITE_PRECISION = os.environ.get('TFLITE_PRECISION', 'fp16')  # 'fp16' or 'int8'
+TFLITE_INPUT_SIZE = int(os.environ.get('TFLITE_INPUT_SIZE', 640))  # Fixed square input of the converted model
+TFLITE_THREADS = int(os.environ.get('TFLITE_THREADS', 0))  # Interpreter threads; 0 uses every core, or the worker's share in a process pool
+TFLITE_AUTO_CONVERT = os.environ.get('TFLITE_AUTO_CONVERT', '0') == '1'  # Convert on first load when no .tflite is stored
+
+# Shared inference server (see inference_server.py): one model per node instead of one per web worker
+INFERENCE_SERVER_SOCKET = os.environ.get('INFERENCE_SERVER_SOCKET', '')  # Unix socket path; empty loads the model in-process
+INFERENCE_SERVER_AUTHKEY = os.environ.get('INFERENCE_SERVER_AUTHKEY', '')  # Shared secret; empty uses a random one in <socket>.key
+INFERENCE_SERVER_TIMEOUT = float(os.environ.get('INFERENCE_SERVER_TIMEOUT', 120))  # Seconds a request waits for its batches
+INFERENCE_BATCH_WINDOW_MS = float(os.environ.get('INFERENCE_BATCH_WINDOW_MS', 10))  # Wait this long to fill a micro-batch
+
+# Tiled detection for high-resolution crowd images
+TILED_DETECTION = os.environ.get('TILED_DETECTION', '0') == '1'
+TILE_SIZE = int(os.environ.get('TILE_SIZE', 1024))  # Tile side in original pixels
+TILE_OVERLAP = float(os.environ.get('TILE_OVERLAP', 0.2))  # Fraction shared by neighbouring tiles
+TILE_NMS_IOU = 0.5  # Merge boxes from different tiles above this IoU
+TILE_NMS_CONTAINMENT = 0.8  # ...or when one box lies mostly inside another
+
+# Detector backends (see detectors.py): efficientdet, hog, dnn, or cascade
+DETECTOR_BACKEND = os.environ.get('DETECTOR_BACKEND', 'efficientdet')
+CASCADE_CHEAP_BACKEND = os.environ.get('CASCADE_CHEAP_BACKEND', 'hog')  # Tried first
+CASCADE_EXPENSIVE_BACKEND = os.environ.get('CASCADE_EXPENSIVE_BACKEND', 'efficientdet')  # Escalated to
+CASCADE_CROWD_COUNT = int(os.environ.get('CASCADE_CROWD_COUNT', 6))  # Escalate when the cheap count reaches this
+CASCADE_UNCERTAIN_BAND = (0.35, 0.65)  # Cheap scores in this range are uncertain...
+CASCADE_MAX_UNCERTAIN = 2  # ...and this many of them escalate the image
+CASCADE_ESCALATE_EMPTY = os.environ.get('CASCADE_ESCALATE_EMPTY', '1') == '1'  # Double-check images with nobody found
+HOG_THRESHOLD = 0.5  # On the 0..1 scale HOG margins are mapped to
+HOG_MAX_SIZE = 800  # Longest side HOG scans, larger images are downscaled
+DNN_MODEL_PATH = os.environ.get('DNN_MODEL_PATH', '')  # SSD-style ONNX/Caffe/TF model for the dnn backend
+DNN_CONFIG_PATH = os.environ.get('DNN_CONFIG_PATH', '')  # e.g. .prototxt or .pbtxt, if the format needs one
+DNN_PERSON_CLASS = int(os.environ.get('DNN_PERSON_CLASS', 1))  # 1 for COCO-trained SSDs, 15 for VOC MobileNet-SSD
+DNN_INPUT_SIZE = int(os.environ.get('DNN_INPUT_SIZE', 300))
+DNN_THRESHOLD = float(os.environ.get('DNN_THRESHOLD', 0.5))
 
 # File upload settings
 MAX_FILE_SIZE = 50 if IS_PRODUCTION else 16  # MB
 ALLOWED_EXTENSIONS = ['png', 'jpg', 'jpeg', 'gif', 'bmp', 'tiff']
+ALLOWED_VIDEO_EXTENSIONS = ['mp4', 'avi', 'mov', 'mkv', 'webm']
+
+# Video / stream counting
+VIDEO_DETECT_FPS = float(os.environ.get('VIDEO_DETECT_FPS', 2))  # Sampled frames per second of video
+VIDEO_BATCH_SIZE = int(os.environ.get('VIDEO_BATCH_SIZE', 4))  # Sampled frames per forward pass (files)
+VIDEO_TRACK_IOU = 0.3  # Minimum IoU to continue a track
+VIDEO_TRACK_MAX_MISSED = 3  # Sampled frames a track survives without a detection
+VIDEO_TRACK_MIN_HITS = 2  # Detections before a track counts as a person
+VIDEO_COUNT_LINE = os.environ.get('VIDEO_COUNT_LINE', 'horizontal:0.5')  # Entrance line for in/out counts
+
+# Disk I/O (the pipeline works in memory; these keep copies for debugging/auditing)
+SAVE_UPLOADS = os.environ.get('SAVE_UPLOADS', '0') == '1'
+SAVE_PROCESSED_IMAGES = os.environ.get('SAVE_PROCESSED_IMAGES', '0') == '1'
+
+# Background job settings
+JOB_WORKERS = int(os.environ.get('JOB_WORKERS', 1))  # Concurrent upload batches per web process
+
+# Lazy annotation (see rendering.py): jobs keep detections, images are drawn when viewed
+LAZY_ANNOTATION = os.environ.get('LAZY_ANNOTATION', '1') == '1'
+THUMBNAIL_SIZE = 320  # Longest side of the results page previews
+RENDER_SIZES = (THUMBNAIL_SIZE, 1024)  # Sizes ?size= snaps to, larger requests get the full image
+RENDER_LABELS_MIN_SIZE = 800  # Smaller renders draw boxes without per-person labels or the footer
+RENDER_CACHE_SECONDS = 24 * 3600  # Browser cache lifetime of rendered images
+
+# Memory admission control (see admission.py)
+MEMORY_BUDGET_MB = os.environ.get('MEMORY_BUDGET_MB', '0')  # RSS budget; 0 disables, 'auto' uses the container limit
+MEMORY_BUDGET_AUTO_FRACTION = 0.85  # Share of the container limit used by 'auto'
+MEMORY_BYTES_PER_INFERENCE_PIXEL = 64  # Input tensors and activations per inference pixel
+MEMORY_INFERENCE_OVERHEAD_MB = 150  # Fixed working memory of one forward pass
+MEMORY_MIN_INFERENCE_SIZE = 384  # Smallest inference resolution admission control falls back to
+MEMORY_FALLBACK_BACKEND = os.environ.get('MEMORY_FALLBACK_BACKEND', 'hog')  # For images that fit no resolution
+
+# Parallel processing (0 or 1 worker keeps the sequential in-process pipeline)
+PARALLEL_WORKERS = int(os.environ.get('PARALLEL_WORKERS', 0))
+TF_INTRA_OP_THREADS = int(os.environ.get('TF_INTRA_OP_THREADS', 0))  # 0 = split cores evenly between workers
+PARALLEL_MAX_IN_FLIGHT = int(os.environ.get('PARALLEL_MAX_IN_FLIGHT', 0))  # 0 = twice the worker count
 
 # Directory configuration
 if IS_PRODUCTION:
@@ -34,4 +114,22 @@ PORT = 5000
 # Directory names
 UPLOAD_FOLDER = 'uploads'
 PROCESSED_FOLDER = 'processed'
-RESULTS_FOLDER = 'results' 
\ No newline at end of file
+RESULTS_FOLDER = 'results'
+
+# Per-job storage (see storage.py): one directory per job, swept by age and total size
+STORAGE_FOLDER = os.environ.get('STORAGE_FOLDER', os.path.join(RESULTS_FOLDER, 'jobs'))
+JOB_TTL_HOURS = float(os.environ.get('JOB_TTL_HOURS', 24))  # Since last access; 0 keeps jobs until the quota needs room
+STORAGE_QUOTA_MB = int(os.environ.get('STORAGE_QUOTA_MB', 2048))  # All job folders together; 0 disables
+STORAGE_SWEEP_SECONDS = int(os.environ.get('STORAGE_SWEEP_SECONDS', 300))  # Sweeper interval
+
+# Persistent results store (see results_store.py), kept outside the folders /clear empties
+RESULTS_DB_ENABLED = os.environ.get('RESULTS_DB_ENABLED', '1') != '0'
+RESULTS_DB_PATH = os.environ.get('RESULTS_DB_PATH', '/tmp/data/results.sqlite3' if IS_PRODUCTION else 'data/results.sqlite3')
+
+# Result cache (keyed by image hash + detector settings)
+RESULT_CACHE_ENABLED = os.environ.get('RESULT_CACHE_ENABLED', '1') != '0'
+RESULT_CACHE_FOLDER = os.environ.get('RESULT_CACHE_FOLDER', '/tmp/cache' if IS_PRODUCTION else 'cache')
+RESULT_CACHE_MAX_MB = int(os.environ.get('RESULT_CACHE_MAX_MB', 512))
+
+# Metrics (Prometheus text at /metrics; one JSON log line per image when enabled)
+METRICS_JSON_LOGS = os.environ.get('METRICS_JSON_LOGS', '0') == '1'
@@ -0,0 +1,104 @@
+"""
+Counting one image
+The smart hybrid pipeline with its OpenCV fallbacks, annotation stamping and
+output, kept free of the web app so worker processes can import it cheaply.
+"""
+import os
+
+import cv2
+
+import config
+import metrics
+from advanced_detection import count_people_smart_hybrid
+from detectors import get_backend
+from image_io import as_image_input, encode_image, image_name
+from rendering import stamp_footer
+
+def downscale_large_upload(image):
+    """Shrink files over 10MB to at most 1920x1080 in memory (Render has memory limits)"""
+    if config.TILED_DETECTION:
+        # Tiling needs the full resolution and bounds inference memory per tile
+        return
+    
+    file_size = image.size_bytes / (1024 * 1024)  # MB
+    if file_size > 10:  # If file > 10MB, resize it
+        print(f"Large file detected ({file_size:.1f}MB), resizing...")
+        img = image.pixels_at(1920)
+        if img is not None:
+            # Resize to max 1920x1080
+            height, width = img.shape[:2]
+            if width > 1920 or height > 1080:
+                scale = min(1920/width, 1080/height)
+                new_width = int(width * scale)
+                new_height = int(height * scale)
+                image.pixels = cv2.resize(img, (new_width, new_height))
+
+def count_people_in_image(image, detection=None, output_sink=None):
+    """
+    Main function using the smart hybrid approach with error handling
+    Prioritizes EfficientDet (from your notebook) with robust fallback
+    `image` is a file path or an in-memory ImageInput.
+    `detection` is an already computed (count, annotated_image, method) tuple,
+    e.g. from a batched pass in process_images.
+    The encoded annotated image is passed to output_sink(name, data) if given.
+    Returns (count, processed_path, method).
+    """
+    with metrics.image_timer(image_name(image)):
+        return _count_people_in_image(as_image_input(image), detection, output_sink)
+
+def _count_people_in_image(image, detection, output_sink):
+    try:
+        filename = image.name
+        print(f"Processing {filename}...")
+        
+        # Check file size first (Render has memory limits)
+        downscale_large_upload(image)
+        
+        try:
+            # Use smart hybrid method (EfficientDet first, then OpenCV)
+            if detection is None:
+                detection = count_people_smart_hybrid(image)
+            count, annotated_image, method_used = detection
+        except (MemoryError, Exception) as e:
+            print(f"⚠️ Primary method failed ({e}), using simple counting...")
+            # Simple fallback - basic OpenCV people detection
+            img = image.pixels
+            if img is not None:
+                img = img.copy()
+                # Simple Haar cascade fallback (the classifier is loaded once per process)
+                faces = get_backend('haar').detect_faces(img)
+                count = len(faces)
+                
+                # Draw rectangles around faces
+                for (x, y, w, h) in faces:
+                    cv2.rectangle(img, (x, y), (x+w, y+h), (255, 0, 0), 2)
+                
+                annotated_image = img
+                method_used = "OpenCV Haar Cascade (fallback)"
+            else:
+                count = 1  # Default fallback
+                annotated_image = None
+                method_used = "Basic fallback"
+        
+        processed_path = None
+        if annotated_image is not None:
+            # Add timestamp and method info
+            stamp_footer(annotated_image, method_used)
+            
+            # Encode once, then stream to the sink and optionally keep a copy on disk
+            encoded = encode_image(annotated_image, filename)
+            if encoded is not None:
+                if output_sink is not None:
+                    output_sink(f"processed_{filename}", encoded)
+                if config.SAVE_PROCESSED_IMAGES:
+                    os.makedirs(config.PROCESSED_FOLDER, exist_ok=True)
+                    processed_path = os.path.join(config.PROCESSED_FOLDER, f"processed_{filename}")
+                    with metrics.timed('processed_save'), open(processed_path, 'wb') as f:
+                        f.write(encoded)
+        
+        print(f"✅ Final result: {count} people in {filename} using {method_used}")
+        return count, processed_path, method_used
+        
+    except Exception as e:
+        print(f"❌ Error processing {image_name(image)}: {e}")
+        return 1, None, "Basic fallback"  # Return 1 as fallback instead of 0
@@ -0,0 +1,289 @@
+"""
+Detector backends for people counting
+Every backend turns an image into a DetectionResult and picks its own counting
+threshold. Besides EfficientDet there are cheap CPU backends that work offline
+(OpenCV HOG, an OpenCV DNN model from disk) and a cascade that runs a cheap
+backend first and escalates to EfficientDet only for crowded or uncertain images.
+"""
+import os
+
+import cv2
+import numpy as np
+
+import config
+import advanced_detection
+from image_io import as_image_input, image_name
+from metrics import timed
+
+class DetectorBackend:
+    """Interface shared by all backends"""
+    name = None
+    label = None
+
+    def available(self):
+        return True
+
+    def detect(self, image, tiled=False):
+        """DetectionResult for one image (path or ImageInput), or None on failure"""
+        raise NotImplementedError
+
+    def detect_batch(self, images):
+        return [self.detect(image) for image in images]
+
+    def select_threshold(self, detections):
+        """(threshold, count) used for the final count and the annotation"""
+        return self.threshold, detections.count_at(self.threshold)
+
+    def backend_for(self, detections):
+        """The backend whose threshold policy applies to these detections"""
+        return self
+
+    def _result(self, boxes, scores):
+        """Person-only DetectionResult, tagged with the backend that produced it"""
+        boxes = np.asarray(boxes, dtype=np.float32).reshape(-1, 4)
+        scores = np.asarray(scores, dtype=np.float32).reshape(-1)
+        detections = advanced_detection.DetectionResult(boxes, scores, np.ones(len(scores), dtype=np.float32))
+        detections.source = self.name
+        return detections
+
+class EfficientDetBackend(DetectorBackend):
+    """TensorFlow Hub EfficientDet, the most accurate and most expensive backend"""
+    name = 'efficientdet'
+    label = 'EfficientDet'
+
+    def available(self):
+        return advanced_detection.initialize_efficientdet()
+
+    def detect(self, image, tiled=False):
+        if not self.available():
+            return None
+        detector = advanced_detection.efficient_det
+        return detector.detect_tiled(image) if tiled else detector.detect(image)
+
+    def detect_batch(self, images):
+        if not self.available():
+            return [None] * len(images)
+        return advanced_detection.efficient_det.detect_batch(images)
+
+    def select_threshold(self, detections):
+        return advanced_detection.select_threshold(detections)
+
+class HOGBackend(DetectorBackend):
+    """
+    OpenCV's built-in HOG + linear SVM pedestrian detector.
+    Fast and offline, good for a few upright people, weak on crowds and small figures.
+    """
+    name = 'hog'
+    label = 'OpenCV HOG'
+
+    def __init__(self):
+        self.hog = None
+        self.threshold = config.HOG_THRESHOLD
+        # OpenCV 5 moved HOG out of the main package
+        if hasattr(cv2, 'HOGDescriptor'):
+            self.hog = cv2.HOGDescriptor()
+            self.hog.setSVMDetector(cv2.HOGDescriptor_getDefaultPeopleDetector())
+        else:
+            print("❌ OpenCV HOG people detector not available in this OpenCV build")
+
+    def available(self):
+        return self.hog is not None
+
+    def detect(self, image, tiled=False):
+        if self.hog is None:
+            return None
+        pixels = as_image_input(image).pixels_at(config.HOG_MAX_SIZE)
+        if pixels is None:
+            print(f"HOG could not decode {image_name(image)}")
+            return None
+
+        height, width = pixels.shape[:2]
+        scale = min(1.0, config.HOG_MAX_SIZE / max(height, width))
+        if scale < 1.0:
+            pixels = cv2.resize(pixels, (int(width * scale), int(height * scale)), interpolation=cv2.INTER_AREA)
+        small_height, small_width = pixels.shape[:2]
+
+        with timed('inference'):
+            rects, weights = self.hog.detectMultiScale(pixels, winStride=(8, 8), padding=(8, 8), scale=1.05)
+        if len(rects) == 0:
+            return self._result([], [])
+
+        rects = np.asarray(rects, dtype=np.float32)
+        boxes = np.stack([rects[:, 1] / small_height, rects[:, 0] / small_width,
+                          (rects[:, 1] + rects[:, 3]) / small_height, (rects[:, 0] + rects[:, 2]) / small_width], axis=1)
+        # SVM margins to 0..1 so thresholds read like detector confidences (margin 0.5 -> 0.5)
+        scores = 1 / (1 + np.exp(-2 * (np.asarray(weights, dtype=np.float32).reshape(-1) - 0.5)))
+        merged = advanced_detection.merge_detections(np.clip(boxes, 0.0, 1.0), scores,
+                                                     np.ones(len(scores), dtype=np.float32))
+        return self._result(merged.boxes, merged.scores)
+
+class DnnBackend(DetectorBackend):
+    """
+    SSD-style detector (e.g. MobileNet-SSD as ONNX, Caffe or TF frozen graph) run
+    with OpenCV's DNN module from DNN_MODEL_PATH. Outputs must be [1, 1, N, 7] rows of
+    (image_id, class_id, score, x1, y1, x2, y2) in normalized coordinates.
+    """
+    name = 'dnn'
+    label = 'OpenCV DNN'
+
+    def __init__(self):
+        self.net = None
+        self.threshold = config.DNN_THRESHOLD
+        if config.DNN_MODEL_PATH and os.path.isfile(config.DNN_MODEL_PATH):
+            try:
+                self.net = cv2.dnn.readNet(config.DNN_MODEL_PATH, config.DNN_CONFIG_PATH or '')
+            except cv2.error as e:
+                print(f"❌ Could not load DNN model {config.DNN_MODEL_PATH}: {e}")
+        elif config.DNN_MODEL_PATH:
+            print(f"❌ DNN model not found at {config.DNN_MODEL_PATH}")
+
+    def available(self):
+        return self.net is not None
+
+    def detect(self, image, tiled=False):
+        if self.net is None:
+            return None
+        pixels = as_image_input(image).pixels_at(config.DNN_INPUT_SIZE)
+        if pixels is None:
+            print(f"DNN could not decode {image_name(image)}")
+            return None
+
+        size = config.DNN_INPUT_SIZE
+        # MobileNet-SSD normalization: (pixel - 127.5) / 127.5
+        blob = cv2.dnn.blobFromImage(pixels, 1 / 127.5, (size, size), (127.5, 127.5, 127.5), swapRB=True)
+        self.net.setInput(blob)
+        with timed('inference'):
+            rows = self.net.forward().reshape(-1, 7)
+
+        rows = rows[rows[:, 1] == config.DNN_PERSON_CLASS]
+        boxes = np.clip(rows[:, [4, 3, 6, 5]], 0.0, 1.0)
+        return self._result(boxes, rows[:, 2])
+
+class HaarFaceBackend(DetectorBackend):
+    """Frontal face Haar cascade, the last-resort fallback (faces, not whole people)"""
+    name = 'haar'
+    label = 'OpenCV Haar Cascade'
+    threshold = 0.0
+
+    def __init__(self):
+        self.classifier = None
+        # Built once, loading the cascade XML is slow compared to detecting with it
+        if hasattr(cv2, 'CascadeClassifier'):
+            self.classifier = cv2.CascadeClassifier(cv2.data.haarcascades + 'haarcascade_frontalface_default.xml')
+
+    def available(self):
+        return self.classifier is not None
+
+    def detect_faces(self, pixels):
+        """Face rectangles as (x, y, w, h) in pixel coordinates"""
+        if self.classifier is None:
+            raise RuntimeError("OpenCV Haar cascades not available in this OpenCV build")
+        gray = cv2.cvtColor(pixels, cv2.COLOR_BGR2GRAY)
+        return self.classifier.detectMultiScale(gray, 1.1, 4)
+
+    def detect(self, image, tiled=False):
+        pixels = as_image_input(image).pixels
+        if pixels is None or self.classifier is None:
+            return None
+        height, width = pixels.shape[:2]
+        faces = np.asarray(self.detect_faces(pixels), dtype=np.float32).reshape(-1, 4)
+        boxes = np.stack([faces[:, 1] / height, faces[:, 0] / width,
+                          (faces[:, 1] + faces[:, 3]) / height, (faces[:, 0] + faces[:, 2]) / width], axis=1)
+        return self._result(boxes, np.ones(len(faces)))
+
+class CascadeBackend(DetectorBackend):
+    """
+    Run a cheap backend first and escalate to an expensive one only when the cheap
+    result looks crowded, uncertain or empty. Sparse scenes never pay for EfficientDet.
+    """
+    name = 'cascade'
+
+    def __init__(self, cheap, expensive):
+        self.cheap = cheap
+        self.expensive = expensive
+        self.label = f"{cheap.label} -> {expensive.label}"
+
+    def available(self):
+        return self.cheap.available() or self.expensive.available()
+
+    def should_escalate(self, detections):
+        """Why the cheap result is not good enough, or None to accept it"""
+        if detections is None:
+            return 'cheap backend failed'
+        _, count = self.cheap.select_threshold(detections)
+        if count >= config.CASCADE_CROWD_COUNT:
+            return f"crowded ({count} people)"
+        low, high = config.CASCADE_UNCERTAIN_BAND
+        uncertain = int(np.count_nonzero((detections.scores > low) & (detections.scores < high)))
+        if uncertain >= config.CASCADE_MAX_UNCERTAIN:
+            return f"{uncertain} uncertain detections"
+        if count == 0 and config.CASCADE_ESCALATE_EMPTY:
+            return 'no people found'
+        return None
+
+    def _cheap_detect(self, image):
+        if not self.cheap.available():
+            return None
+        try:
+            return self.cheap.detect(image)
+        except Exception as e:
+            print(f"Error in {self.cheap.label} detection: {e}")
+            return None
+
+    def detect(self, image, tiled=False):
+        # Tiling is for huge crowd photos, which the cheap backend would escalate anyway
+        if tiled:
+            return self.expensive.detect(image, tiled=True)
+        detections = self._cheap_detect(image)
+        reason = self.should_escalate(detections)
+        if reason is None or not self.expensive.available():
+            return detections
+        print(f"  Escalating {image_name(image)} to {self.expensive.label}: {reason}")
+        return self.expensive.detect(image)
+
+    def detect_batch(self, images):
+        results = [self._cheap_detect(image) for image in images]
+        escalate = [i for i, detections in enumerate(results) if self.should_escalate(detections) is not None]
+        if escalate and self.expensive.available():
+            print(f"  Escalating {len(escalate)}/{len(images)} images to {self.expensive.label}")
+            for i, detections in zip(escalate, self.expensive.detect_batch([images[i] for i in escalate])):
+                results[i] = detections
+        return results
+
+    def backend_for(self, detections):
+        """The backend whose detections these are, so its threshold policy applies"""
+        return self.cheap if detections.source == self.cheap.name else self.expensive
+
+    def select_threshold(self, detections):
+        return self.backend_for(detections).select_threshold(detections)
+
+BACKENDS = {
+    'efficientdet': EfficientDetBackend,
+    'hog': HOGBackend,
+    'dnn': DnnBackend,
+    'haar': HaarFaceBackend,
+}
+
+# Backends are stateful (models, classifiers), so each is built once per process
+_backends = {}
+
+def backend_names(name=None):
+    """The backends behind a backend name (a cascade's two), without creating any of them"""
+    name = name or config.DETECTOR_BACKEND
+    if name == 'cascade':
+        return (config.CASCADE_CHEAP_BACKEND, config.CASCADE_EXPENSIVE_BACKEND)
+    return (name,)
+
+def get_backend(name=None):
+    """Shared backend by name, defaulting to config.DETECTOR_BACKEND"""
+    name = name or config.DETECTOR_BACKEND
+    if name not in _backends:
+        if name == 'cascade':
+            _backends[name] = CascadeBackend(get_backend(config.CASCADE_CHEAP_BACKEND),
+                                             get_backend(config.CASCADE_EXPENSIVE_BACKEND))
+        elif name in BACKENDS:
+            _backends[name] = BACKENDS[name]()
+        else:
+            raise ValueError(f"Unknown detector backend {name!r}, choose from "
+                             f"{', '.join(sorted(BACKENDS) + ['cascade'])}")
+    return _backends[name]
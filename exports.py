@@ -0,0 +1,148 @@
+"""
+Streaming export writers
+ZIP, XLSX and CSV files are produced chunk by chunk while they are being
+downloaded, so nothing is materialized on disk or held whole in memory.
+"""
+import csv
+import io
+import time
+import zipfile
+from xml.sax.saxutils import escape
+
+CHUNK_SIZE = 1024 * 1024
+
+class _StreamBuffer(io.RawIOBase):
+    """Write-only, unseekable sink that zipfile writes into and we drain between entries"""
+    def __init__(self):
+        self.chunks = []
+        self.pending = 0
+        self.offset = 0
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        self.chunks.append(bytes(data))
+        self.pending += len(data)
+        self.offset += len(data)
+        return len(data)
+
+    def tell(self):
+        return self.offset
+
+    def drain(self):
+        data = b''.join(self.chunks)
+        self.chunks = []
+        self.pending = 0
+        return data
+
+def _file_chunks(path):
+    with open(path, 'rb') as f:
+        while True:
+            chunk = f.read(CHUNK_SIZE)
+            if not chunk:
+                break
+            yield chunk
+
+def stream_zip(entries, compression=zipfile.ZIP_STORED):
+    """
+    Yield a ZIP archive in chunks.
+    entries yields (arcname, data) where data is bytes, a file path, or an iterable of bytes.
+    Images are already compressed, so entries are stored by default.
+    """
+    buffer = _StreamBuffer()
+    with zipfile.ZipFile(buffer, 'w') as zipf:
+        for arcname, data in entries:
+            info = zipfile.ZipInfo(arcname, date_time=time.localtime()[:6])
+            info.compress_type = compression
+            if isinstance(data, (bytes, bytearray)):
+                data = [data]
+            elif isinstance(data, str):
+                data = _file_chunks(data)
+            with zipf.open(info, 'w') as dest:
+                for chunk in data:
+                    dest.write(chunk)
+                    # Pass bytes on as they are produced instead of per entry
+                    if buffer.pending >= CHUNK_SIZE:
+                        yield buffer.drain()
+            yield buffer.drain()
+    # Central directory
+    yield buffer.drain()
+
+def stream_csv(header, rows):
+    """Yield CSV text encoded as UTF-8, one row at a time"""
+    line = io.StringIO()
+    writer = csv.writer(line)
+    for row in _with_header(header, rows):
+        writer.writerow(row)
+        yield line.getvalue().encode('utf-8')
+        line.seek(0)
+        line.truncate()
+
+def _with_header(header, rows):
+    yield header
+    yield from rows
+
+def _column_letter(index):
+    letters = ''
+    index += 1
+    while index:
+        index, remainder = divmod(index - 1, 26)
+        letters = chr(65 + remainder) + letters
+    return letters
+
+def _xlsx_cell(ref, value):
+    if isinstance(value, bool) or not isinstance(value, (int, float)):
+        return f'<c r="{ref}" t="inlineStr"><is><t>{escape(str(value))}</t></is></c>'
+    return f'<c r="{ref}"><v>{value}</v></c>'
+
+def _xlsx_sheet(header, rows):
+    yield (b'<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+           b'<worksheet xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main"><sheetData>')
+    for row_number, row in enumerate(_with_header(header, rows), 1):
+        cells = ''.join(_xlsx_cell(f"{_column_letter(col)}{row_number}", value) for col, value in enumerate(row))
+        yield f'<row r="{row_number}">{cells}</row>'.encode('utf-8')
+    yield b'</sheetData></worksheet>'
+
+_XLSX_CONTENT_TYPES = (
+    b'<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+    b'<Types xmlns="http://schemas.openxmlformats.org/package/2006/content-types">'
+    b'<Default Extension="rels" ContentType="application/vnd.openxmlformats-package.relationships+xml"/>'
+    b'<Default Extension="xml" ContentType="application/xml"/>'
+    b'<Override PartName="/xl/workbook.xml" '
+    b'ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet.main+xml"/>'
+    b'<Override PartName="/xl/worksheets/sheet1.xml" '
+    b'ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.worksheet+xml"/>'
+    b'</Types>'
+)
+_XLSX_ROOT_RELS = (
+    b'<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+    b'<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+    b'<Relationship Id="rId1" '
+    b'Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/officeDocument" '
+    b'Target="xl/workbook.xml"/></Relationships>'
+)
+_XLSX_WORKBOOK = (
+    b'<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+    b'<workbook xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main" '
+    b'xmlns:r="http://schemas.openxmlformats.org/officeDocument/2006/relationships">'
+    b'<sheets><sheet name="Sheet1" sheetId="1" r:id="rId1"/></sheets></workbook>'
+)
+_XLSX_WORKBOOK_RELS = (
+    b'<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+    b'<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+    b'<Relationship Id="rId1" '
+    b'Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/worksheet" '
+    b'Target="worksheets/sheet1.xml"/></Relationships>'
+)
+
+def stream_xlsx(header, rows):
+    """Yield a single-sheet XLSX workbook in chunks, without pandas/openpyxl"""
+    entries = [
+        ('[Content_Types].xml', _XLSX_CONTENT_TYPES),
+        ('_rels/.rels', _XLSX_ROOT_RELS),
+        ('xl/workbook.xml', _XLSX_WORKBOOK),
+        ('xl/_rels/workbook.xml.rels', _XLSX_WORKBOOK_RELS),
+        ('xl/worksheets/sheet1.xml', _xlsx_sheet(header, rows)),
+    ]
+    return stream_zip(entries, compression=zipfile.ZIP_DEFLATED)
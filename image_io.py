@@ -0,0 +1,247 @@
+"""
+In-memory image handling for the counting pipeline
+An ImageInput reads its bytes once and decodes them once, and that buffer is
+reused for hashing, resizing, detection and annotation. When only a downscaled
+copy is needed, JPEGs are decoded straight at a reduced DCT scale (1/2, 1/4, 1/8).
+"""
+import hashlib
+import os
+import struct
+
+import cv2
+import numpy as np
+
+import config
+from metrics import timed
+
+# IMREAD flags for decoding a JPEG at 1/n of its size, largest reduction first
+REDUCED_DECODE_FLAGS = ((8, cv2.IMREAD_REDUCED_COLOR_8), (4, cv2.IMREAD_REDUCED_COLOR_4), (2, cv2.IMREAD_REDUCED_COLOR_2))
+
+class ImageInput:
+    """An image held as encoded bytes and, once needed, decoded BGR pixels"""
+    def __init__(self, name, data=None, path=None):
+        self.name = name
+        self.path = path
+        self._data = data
+        self._pixels = None
+        self._dimensions = None
+        self._sha256 = None
+        self._reduced = None
+        # Set when the full-resolution pixels will be needed anyway (annotation, tiling),
+        # so detection decodes once at full size instead of twice
+        self.full_resolution = False
+        # Set by admission control when the image must run smaller or on a cheaper backend
+        self.inference_size = None
+        self.backend = None
+
+    @classmethod
+    def from_path(cls, path):
+        return cls(os.path.basename(path), path=path)
+
+    @property
+    def data(self):
+        """Encoded file bytes, read from disk at most once"""
+        if self._data is None:
+            with open(self.path, 'rb') as f:
+                self._data = f.read()
+        return self._data
+
+    @property
+    def size_bytes(self):
+        if self._data is None and self.path:
+            return os.path.getsize(self.path)
+        return len(self.data)
+
+    @property
+    def sha256(self):
+        """Hex digest of the encoded bytes, computed once"""
+        if self._sha256 is None:
+            self._sha256 = hashlib.sha256(self.data).hexdigest()
+        return self._sha256
+
+    @property
+    def is_jpeg(self):
+        return self.data[:2] == b'\xff\xd8'
+
+    @property
+    def dimensions(self):
+        """(width, height) as decoded (EXIF orientation applied), from the file header without decoding"""
+        if self._pixels is not None:
+            return self._pixels.shape[1], self._pixels.shape[0]
+        if self._dimensions is None:
+            self._dimensions = read_image_size(self.data)
+            # OpenCV rotates JPEGs by their EXIF orientation; 5-8 swap width and height
+            if self._dimensions and self.is_jpeg and read_jpeg_orientation(self.data) >= 5:
+                self._dimensions = self._dimensions[::-1]
+        return self._dimensions
+
+    @property
+    def pixels(self):
+        """Decoded BGR array (None if the bytes are not a readable image)"""
+        if self._pixels is None:
+            with timed('decode'):
+                self._pixels = cv2.imdecode(np.frombuffer(self.data, dtype=np.uint8), cv2.IMREAD_COLOR)
+        return self._pixels
+
+    @pixels.setter
+    def pixels(self, value):
+        self._pixels = value
+        self._reduced = None
+
+    def decode_factor(self, max_size):
+        """DCT scale (1, 2, 4 or 8) a decode for max_size pixels on the longest side can use"""
+        if (not config.FAST_DECODE or self.full_resolution or not max_size
+                or self._pixels is not None or not self.is_jpeg):
+            return 1
+        dimensions = self.dimensions
+        if not dimensions:
+            return 1
+        return reduced_decode_factor(dimensions, max_size)
+
+    def pixels_at(self, max_size):
+        """
+        BGR pixels with the longest side at least max_size (or the full image if smaller),
+        for callers that downscale anyway. Large JPEGs are decoded at a reduced DCT scale,
+        and pixels that are already decoded are reused. None if the image is unreadable.
+        """
+        factor = self.decode_factor(max_size)
+        if factor == 1:
+            return self.pixels
+        if self._reduced is not None and self._reduced[0] <= factor:
+            return self._reduced[1]
+        flag = dict(REDUCED_DECODE_FLAGS)[factor]
+        with timed('decode'):
+            pixels = cv2.imdecode(np.frombuffer(self.data, dtype=np.uint8), flag)
+        if pixels is None:
+            return self.pixels
+        self._reduced = (factor, pixels)
+        return pixels
+
+    def release(self):
+        """Drop the buffers once the image is done (path-backed images can be re-read)"""
+        self._pixels = None
+        self._reduced = None
+        if self.path:
+            self._data = None
+
+    def __getstate__(self):
+        # Never ship decoded pixels between processes, they are far larger than the file
+        state = self.__dict__.copy()
+        state['_pixels'] = None
+        state['_reduced'] = None
+        return state
+
+def as_image_input(image):
+    """Accept either a file path or an ImageInput"""
+    if isinstance(image, ImageInput):
+        return image
+    return ImageInput.from_path(image)
+
+def image_name(image):
+    return image.name if isinstance(image, ImageInput) else os.path.basename(image)
+
+def read_image_size(data):
+    """(width, height) parsed from a JPEG, PNG, GIF, BMP or TIFF header, or None"""
+    try:
+        if data[:8] == b'\x89PNG\r\n\x1a\n':
+            return struct.unpack('>II', data[16:24])
+        if data[:6] in (b'GIF87a', b'GIF89a'):
+            return struct.unpack('<HH', data[6:10])
+        if data[:2] == b'BM':
+            width, height = struct.unpack('<ii', data[18:26])
+            return width, abs(height)
+        if data[:2] == b'\xff\xd8':
+            return _jpeg_size(data)
+        if data[:4] in (b'II*\x00', b'MM\x00*'):
+            return _tiff_size(data)
+    except struct.error:
+        pass
+    return None
+
+def _jpeg_size(data):
+    # Walk the marker segments up to the first start-of-frame
+    offset = 2
+    while offset + 9 < len(data):
+        if data[offset] != 0xFF:
+            offset += 1
+            continue
+        marker = data[offset + 1]
+        if marker in (0xD8, 0x01) or 0xD0 <= marker <= 0xD7 or marker == 0xFF:
+            offset += 1 if marker == 0xFF else 2
+            continue
+        length = struct.unpack('>H', data[offset + 2:offset + 4])[0]
+        if 0xC0 <= marker <= 0xCF and marker not in (0xC4, 0xC8, 0xCC):
+            height, width = struct.unpack('>HH', data[offset + 5:offset + 9])
+            return width, height
+        offset += 2 + length
+    return None
+
+def reduced_decode_factor(dimensions, max_size):
+    """Largest JPEG DCT scale that still leaves max_size pixels on the longest side, or 1"""
+    longest = max(dimensions)
+    for factor, _ in REDUCED_DECODE_FLAGS:
+        if longest >= max_size * factor:
+            return factor
+    return 1
+
+def read_jpeg_orientation(data):
+    """EXIF orientation (1-8) from a JPEG's APP1 segment, 1 when there is none"""
+    try:
+        offset = 2
+        while offset + 4 < len(data) and data[offset] == 0xFF:
+            marker = data[offset + 1]
+            length = struct.unpack('>H', data[offset + 2:offset + 4])[0]
+            if marker == 0xDA or 0xC0 <= marker <= 0xCF:
+                # Metadata segments all come before the frame
+                break
+            segment = data[offset + 4:offset + 2 + length]
+            if marker == 0xE1 and segment[:6] == b'Exif\x00\x00':
+                return _tiff_orientation(segment[6:])
+            offset += 2 + length
+    except struct.error:
+        pass
+    return 1
+
+def _tiff_orientation(tiff):
+    endian = '<' if tiff[:2] == b'II' else '>'
+    ifd = struct.unpack(endian + 'I', tiff[4:8])[0]
+    entries = struct.unpack(endian + 'H', tiff[ifd:ifd + 2])[0]
+    for i in range(entries):
+        entry = tiff[ifd + 2 + i * 12:ifd + 14 + i * 12]
+        if struct.unpack(endian + 'H', entry[:2])[0] == 0x0112:
+            orientation = struct.unpack(endian + 'H', entry[8:10])[0]
+            return orientation if 1 <= orientation <= 8 else 1
+    return 1
+
+def _tiff_size(data):
+    endian = '<' if data[:2] == b'II' else '>'
+    ifd = struct.unpack(endian + 'I', data[4:8])[0]
+    entries = struct.unpack(endian + 'H', data[ifd:ifd + 2])[0]
+    size = {}
+    for i in range(entries):
+        entry = data[ifd + 2 + i * 12:ifd + 14 + i * 12]
+        tag, kind = struct.unpack(endian + 'HH', entry[:4])
+        if tag in (256, 257):
+            # SHORT or LONG value stored inline
+            size[tag] = struct.unpack(endian + ('H' if kind == 3 else 'I'), entry[8:10 if kind == 3 else 12])[0]
+    if 256 in size and 257 in size:
+        return size[256], size[257]
+    return None
+
+def to_inference_array(pixels, max_size):
+    """BGR pixels to an RGB uint8 array whose longest side is at most max_size"""
+    with timed('resize'):
+        height, width = pixels.shape[:2]
+        if max(height, width) > max_size:
+            scale = max_size / max(height, width)
+            pixels = cv2.resize(pixels, (int(width * scale), int(height * scale)), interpolation=cv2.INTER_AREA)
+        return cv2.cvtColor(pixels, cv2.COLOR_BGR2RGB)
+
+def encode_image(image, filename):
+    """Encode an annotated image in the format of the original file name"""
+    extension = os.path.splitext(filename)[1].lower() or '.jpg'
+    if extension not in ('.jpg', '.jpeg', '.png', '.bmp', '.tiff'):
+        extension = '.png'
+    with timed('encode'):
+        ok, buffer = cv2.imencode(extension, image)
+    return buffer.tobytes() if ok else None
@@ -0,0 +1,313 @@
+"""
+Shared inference server
+One process owns EfficientDet and serves every web worker on the node over a
+Unix socket. Workers send images already resized to the inference size; the
+server gathers the images that arrive within a short window into micro-batches,
+so concurrent requests share forward passes and there is one model copy per node.
+
+    python inference_server.py                       # listens on INFERENCE_SERVER_SOCKET
+    INFERENCE_SERVER_SOCKET=/tmp/people-counter.sock gunicorn -w 4 wsgi:app
+"""
+import argparse
+import os
+import queue
+import secrets
+import threading
+import time
+from multiprocessing.connection import Client, Listener
+
+import config
+import advanced_detection
+from image_io import as_image_input, image_name, to_inference_array
+from metrics import timed
+
+def _key_path(address):
+    return f"{address}.key"
+
+def _authkey(address):
+    """The configured shared secret, or the one the server generated next to its socket"""
+    if config.INFERENCE_SERVER_AUTHKEY:
+        return config.INFERENCE_SERVER_AUTHKEY.encode()
+    with open(_key_path(address), 'rb') as f:
+        return f.read().strip()
+
+def _generate_authkey(address):
+    """Write a new random key only the server's user can read, and return it"""
+    key = secrets.token_hex(32).encode()
+    path = _key_path(address)
+    if os.path.exists(path):
+        os.unlink(path)
+    fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600)
+    with os.fdopen(fd, 'wb') as f:
+        f.write(key)
+    return key
+
+def _pack(detections):
+    if detections is None:
+        return None
+    return detections.boxes, detections.scores, detections.classes, detections.num_detections
+
+def _unpack(packed):
+    if packed is None:
+        return None
+    return advanced_detection.DetectionResult(*packed)
+
+class _Request:
+    """Images of one client call, answered once every image has been through the model"""
+    def __init__(self, count):
+        self.results = [None] * count
+        self.remaining = count
+        self.done = threading.Event()
+        if count == 0:
+            self.done.set()
+
+class MicroBatcher:
+    """Collects images from concurrent requests and runs them through the model together"""
+    def __init__(self, detector, window_seconds, max_batch):
+        self.detector = detector
+        self.window = window_seconds
+        self.max_batch = max_batch
+        self.queue = queue.Queue()
+        self.lock = threading.Lock()
+        self.batches = 0
+        self.images = 0
+        threading.Thread(target=self._loop, name='micro-batcher', daemon=True).start()
+
+    def submit(self, arrays):
+        """DetectionResult (or None) per inference array, waiting for the batches they join"""
+        request = _Request(len(arrays))
+        for index, array in enumerate(arrays):
+            self.queue.put((request, index, array))
+        if not request.done.wait(config.INFERENCE_SERVER_TIMEOUT):
+            raise TimeoutError(f"no detections after {config.INFERENCE_SERVER_TIMEOUT:g}s")
+        return request.results
+
+    def _gather(self):
+        # Block for the first image, then take whatever arrives within the window
+        batch = [self.queue.get()]
+        deadline = time.perf_counter() + self.window
+        while len(batch) < self.max_batch:
+            timeout = deadline - time.perf_counter()
+            try:
+                batch.append(self.queue.get(timeout=timeout) if timeout > 0 else self.queue.get_nowait())
+            except queue.Empty:
+                break
+        return batch
+
+    def _loop(self):
+        while True:
+            batch = self._gather()
+            try:
+                self._run(batch)
+            except Exception as e:
+                print(f"❌ Micro-batch of {len(batch)} failed: {e}")
+            # Every image is answered, with None where the batch did not get to it
+            for request, _, _ in batch:
+                with self.lock:
+                    request.remaining -= 1
+                    if request.remaining == 0:
+                        request.done.set()
+
+    def _run(self, batch):
+        bucket = config.BATCH_BUCKET_SIZE
+        self.batches += 1
+        self.images += len(batch)
+
+        # Same padded-bucket grouping as EfficientDetCounter.detect_batch
+        buckets = {}
+        for item in batch:
+            height, width = item[2].shape[:2]
+            buckets.setdefault((-(-height // bucket) * bucket, -(-width // bucket) * bucket), []).append(item)
+
+        for (padded_height, padded_width), items in buckets.items():
+            try:
+                chunk = [(index, array) for _, index, array in items]
+                detections = self.detector._detect_padded(chunk, padded_height, padded_width)
+            except Exception as e:
+                print(f"Error in micro-batch of {len(items)}: {e}")
+                detections = [None] * len(items)
+            for (request, index, _), result in zip(items, detections):
+                request.results[index] = result
+
+class InferenceServer:
+    """Accepts worker connections on a Unix socket, one handler thread per connection"""
+    def __init__(self, address, window_seconds=None, max_batch=None, detector=None):
+        self.address = address
+        window_seconds = config.INFERENCE_BATCH_WINDOW_MS / 1000 if window_seconds is None else window_seconds
+        # Anything with EfficientDetCounter's _detect_padded works, e.g. benchmark.StubDetector
+        self.detector = detector or advanced_detection.create_local_detector()
+        if self.detector.model is None:
+            raise RuntimeError("EfficientDet could not be loaded, nothing to serve")
+        self.detector.warm_up()
+        self.batcher = MicroBatcher(self.detector, window_seconds, max_batch or config.BATCH_SIZE)
+
+    def info(self):
+        batches, images = self.batcher.batches, self.batcher.images
+        return {
+            'variant': self.detector.variant,
+            'load_seconds': self.detector.load_seconds,
+            'batches': batches,
+            'images': images,
+            'mean_batch_size': round(images / batches, 2) if batches else 0.0
+        }
+
+    def _handle(self, connection):
+        try:
+            while True:
+                request = connection.recv()
+                op = request.get('op')
+                if op == 'detect':
+                    try:
+                        results = self.batcher.submit(request['arrays'])
+                    except TimeoutError as e:
+                        connection.send({'error': str(e)})
+                        continue
+                    connection.send({'detections': [_pack(result) for result in results]})
+                elif op == 'info':
+                    connection.send(self.info())
+                else:
+                    connection.send({'error': f"unknown op {op!r}"})
+        except (EOFError, OSError):
+            pass
+        finally:
+            connection.close()
+
+    def serve_forever(self):
+        if os.path.exists(self.address):
+            os.unlink(self.address)
+        # Never listen with a guessable key
+        authkey = config.INFERENCE_SERVER_AUTHKEY.encode() or _generate_authkey(self.address)
+        listener = Listener(self.address, family='AF_UNIX', authkey=authkey)
+        os.chmod(self.address, 0o600)
+        print(f"✅ Inference server ready on {self.address} (EfficientDet {self.detector.variant.upper()})")
+        try:
+            while True:
+                try:
+                    connection = listener.accept()
+                except Exception as e:
+                    # A client with the wrong authkey, for example
+                    print(f"⚠️ Rejected connection: {e}")
+                    continue
+                threading.Thread(target=self._handle, args=(connection,), daemon=True).start()
+        finally:
+            listener.close()
+
+class RemoteEfficientDet(advanced_detection.EfficientDetCounter):
+    """
+    EfficientDetCounter whose forward passes run in the inference server.
+    Decoding and resizing stay in the web worker, which never loads the model.
+    """
+    def __init__(self, address):
+        self.address = address
+        self.variant = None
+        self.load_seconds = None
+        self.supports_batching = True
+        self.local = threading.local()
+        self.retry_at = 0.0
+
+    def _connection(self):
+        # One connection per thread, so concurrent requests reach the server concurrently
+        connection = getattr(self.local, 'connection', None)
+        if connection is None:
+            connection = Client(self.address, family='AF_UNIX', authkey=_authkey(self.address))
+            self.local.connection = connection
+        return connection
+
+    def _call(self, request):
+        for attempt in (1, 2):
+            try:
+                connection = self._connection()
+                connection.send(request)
+                return connection.recv()
+            except (OSError, EOFError):
+                # The server restarted: reconnect once
+                self.local.connection = None
+                if attempt == 2:
+                    raise
+
+    @property
+    def model(self):
+        """Truthy while the server is reachable (re-checked at most every few seconds)"""
+        if self.variant is not None:
+            return self
+        if time.monotonic() < self.retry_at:
+            return None
+        try:
+            info = self._call({'op': 'info'})
+        except (OSError, EOFError) as e:
+            print(f"❌ Inference server not reachable at {self.address}: {e}")
+            self.retry_at = time.monotonic() + 5
+            return None
+        self.variant = info['variant']
+        self.load_seconds = info['load_seconds']
+        print(f"✅ Using shared inference server at {self.address} (EfficientDet {self.variant.upper()})")
+        return self
+
+    def info(self):
+        return self._call({'op': 'info'})
+
+    def warm_up(self):
+        # The server warms its model once for everybody
+        start = time.perf_counter()
+        self.model
+        return time.perf_counter() - start
+
+    def load_image(self, image):
+        image = as_image_input(image)
+        max_size = image.inference_size or config.MAX_INFERENCE_SIZE
+        pixels = image.pixels_at(max_size)
+        if pixels is None:
+            raise ValueError(f"Could not decode {image_name(image)}")
+        return to_inference_array(pixels, max_size)
+
+    def _remote_detect(self, arrays):
+        with timed('inference'):
+            reply = self._call({'op': 'detect', 'arrays': arrays})
+        if 'error' in reply:
+            raise RuntimeError(reply['error'])
+        return [_unpack(packed) for packed in reply['detections']]
+
+    def detect(self, image):
+        if self.model is None:
+            return None
+        try:
+            return self._remote_detect([self.load_image(image)])[0]
+        except Exception as e:
+            print(f"Error in object detection: {e}")
+            return None
+
+    def detect_batch(self, images, batch_size=None):
+        """One round trip for all images; the server batches them with other workers' images"""
+        detections = [None] * len(images)
+        if self.model is None:
+            return detections
+        arrays = {}
+        for index, image in enumerate(images):
+            try:
+                arrays[index] = self.load_image(image)
+            except Exception as e:
+                print(f"Error loading {image_name(image)} for batch: {e}")
+        if arrays:
+            try:
+                for index, result in zip(arrays, self._remote_detect(list(arrays.values()))):
+                    detections[index] = result
+            except Exception as e:
+                print(f"Error in batched detection: {e}")
+        return detections
+
+    def _detect_padded(self, chunk, padded_height, padded_width):
+        # Used by detect_tiled; the server does its own padding
+        return self._remote_detect([array for _, array in chunk])
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Serve EfficientDet to the web workers over a Unix socket")
+    parser.add_argument('--socket', default=config.INFERENCE_SERVER_SOCKET or '/tmp/people-counter.sock')
+    parser.add_argument('--window-ms', type=float, default=config.INFERENCE_BATCH_WINDOW_MS,
+                        help="How long to wait for more images before running a batch")
+    parser.add_argument('--max-batch', type=int, default=config.BATCH_SIZE)
+    args = parser.parse_args(argv)
+
+    InferenceServer(args.socket, args.window_ms / 1000, args.max_batch).serve_forever()
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,196 @@
+"""
+Background job queue for batch uploads
+Runs the counting pipeline off the request thread and tracks per-image progress.
+Job state is mirrored to small JSON files so any web worker can report it.
+While a job runs, each finished image is appended to progress.jsonl and only
+the counters are rewritten; the full results list is written once at the end.
+"""
+import json
+import os
+import re
+import threading
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+from image_io import image_name
+
+JOB_ID_PATTERN = re.compile(r'^[0-9a-f]{32}$')
+
+class Job:
+    def __init__(self, job_id, image_names):
+        self.id = job_id
+        self.status = 'queued'
+        self.image_names = image_names
+        self.total = len(image_names)
+        self.processed = 0
+        # Share of the current image already done, for work that reports within an image (videos)
+        self.current_fraction = 0.0
+        self.current_image = None
+        self.results = []
+        self.error = None
+        self.created_at = datetime.now().isoformat(timespec='seconds')
+        self.finished_at = None
+
+    def to_dict(self, with_results=True):
+        state = {
+            'id': self.id,
+            'status': self.status,
+            'total': self.total,
+            'processed': self.processed,
+            'progress': round((self.processed + self.current_fraction) / self.total, 3) if self.total else 1.0,
+            'current_image': self.current_image,
+            'results': self.results,
+            'error': self.error,
+            'created_at': self.created_at,
+            'finished_at': self.finished_at
+        }
+        if not with_results:
+            del state['results']
+        return state
+
+class JobQueue:
+    """In-process worker pool with job state persisted to each job's folder"""
+    def __init__(self, state_folder, max_workers=1, max_jobs_in_memory=100):
+        self.state_folder = state_folder
+        self.max_jobs_in_memory = max_jobs_in_memory
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='job')
+        self.jobs = {}
+        self.lock = threading.Lock()
+        os.makedirs(state_folder, exist_ok=True)
+
+    def submit(self, images, work, job_id=None):
+        """
+        Queue work(job_id, images, progress_callback) and return the new Job.
+        work calls progress_callback(processed, result) as each image finishes, and may
+        call progress_callback(processed, None, fraction) while one is under way.
+        work must return a dict with the final 'results' list.
+        job_id is generated unless the caller has already allocated one.
+        """
+        job = Job(job_id or uuid.uuid4().hex, [image_name(image) for image in images])
+        with self.lock:
+            self.jobs[job.id] = job
+            self._prune()
+        self._save(job)
+        self.executor.submit(self._run, job, images, work)
+        return job
+
+    def get(self, job_id, with_results=True):
+        """
+        Return the job state dict, or None if the id is unknown
+        with_results=False leaves out the results list, for cheap progress polling.
+        """
+        if not JOB_ID_PATTERN.match(job_id or ''):
+            return None
+
+        with self.lock:
+            job = self.jobs.get(job_id)
+            if job is not None:
+                return job.to_dict(with_results)
+
+        # The job may belong to another worker process
+        try:
+            with open(self._state_path(job_id)) as f:
+                state = json.load(f)
+        except (OSError, ValueError):
+            return None
+        if not with_results:
+            state.pop('results', None)
+        elif 'results' not in state:
+            # Still running: the results so far are in the progress log
+            state['results'] = self._read_progress(job_id)
+        return state
+
+    def is_active(self, job_id):
+        job = self.get(job_id, with_results=False)
+        return job is not None and job['status'] in ('queued', 'running')
+
+    def forget(self, job_id):
+        """Drop a job whose folder has been deleted"""
+        with self.lock:
+            self.jobs.pop(job_id, None)
+
+    def _run(self, job, images, work):
+        job.status = 'running'
+        self._save(job, with_results=False)
+
+        def progress(index, result, fraction=None):
+            if result is None:
+                # Within the image after the first index ones; saved once per percent
+                fraction = round(fraction, 2)
+                if index < job.total and (fraction != job.current_fraction or job.processed != index):
+                    job.processed = index
+                    job.current_fraction = fraction
+                    job.current_image = job.image_names[index]
+                    self._save(job, with_results=False)
+                return
+            job.processed = index
+            job.current_fraction = 0.0
+            job.current_image = result.get('image_name')
+            job.results.append(result)
+            # Constant work per image: append the result, rewrite only the counters
+            self._append_progress(job.id, result)
+            self._save(job, with_results=False)
+
+        try:
+            output = work(job.id, images, progress)
+            job.results = output['results']
+            job.status = 'finished'
+        except Exception as e:
+            print(f"❌ Job {job.id} failed: {e}")
+            job.error = str(e)
+            job.status = 'failed'
+
+        job.current_image = None
+        job.current_fraction = 0.0
+        job.finished_at = datetime.now().isoformat(timespec='seconds')
+        self._save(job)
+        try:
+            os.unlink(self._progress_path(job.id))
+        except OSError:
+            pass
+
+    def _prune(self):
+        """Forget the oldest finished jobs once too many are held in memory"""
+        finished = [job_id for job_id, job in self.jobs.items() if job.status in ('finished', 'failed')]
+        for job_id in finished[:max(0, len(self.jobs) - self.max_jobs_in_memory)]:
+            del self.jobs[job_id]
+
+    def _state_path(self, job_id):
+        return os.path.join(self.state_folder, job_id, 'job.json')
+
+    def _progress_path(self, job_id):
+        return os.path.join(self.state_folder, job_id, 'progress.jsonl')
+
+    def _append_progress(self, job_id, result):
+        try:
+            with open(self._progress_path(job_id), 'a') as f:
+                f.write(json.dumps(result) + '\n')
+        except OSError as e:
+            print(f"⚠️ Could not record progress for job {job_id}: {e}")
+
+    def _read_progress(self, job_id):
+        results = []
+        try:
+            with open(self._progress_path(job_id)) as f:
+                for line in f:
+                    try:
+                        results.append(json.loads(line))
+                    except ValueError:
+                        # The line being written right now
+                        break
+        except OSError:
+            pass
+        return results
+
+    def _save(self, job, with_results=True):
+        # Write then rename so readers never see a half-written file
+        path = self._state_path(job.id)
+        tmp_path = f"{path}.{threading.get_ident()}.tmp"
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(tmp_path, 'w') as f:
+                json.dump(job.to_dict(with_results), f)
+            os.replace(tmp_path, path)
+        except OSError as e:
+            print(f"⚠️ Could not save state for job {job.id}: {e}")
@@ -0,0 +1,187 @@
+"""
+Lightweight in-process metrics
+Per-stage timings, counters and memory gauges, rendered in Prometheus text
+format for /metrics and optionally logged as one JSON line per image.
+Recording is a perf_counter pair and a short lock, cheap enough for the hot path.
+"""
+import bisect
+import json
+import os
+import sys
+import threading
+import time
+from contextlib import contextmanager
+
+import config
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+PREFIX = 'people_counter'
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+class Histogram:
+    def __init__(self):
+        self.bucket_counts = [0] * (len(BUCKETS) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.bucket_counts[bisect.bisect_left(BUCKETS, value)] += 1
+        self.sum += value
+        self.count += 1
+
+class MetricsRegistry:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.stages = {}
+        self.counters = {}
+        self.gauges = {}
+
+    def observe(self, stage, seconds):
+        with self.lock:
+            histogram = self.stages.get(stage)
+            if histogram is None:
+                histogram = self.stages[stage] = Histogram()
+            histogram.observe(seconds)
+
+    def inc(self, name, value=1):
+        with self.lock:
+            self.counters[name] = self.counters.get(name, 0) + value
+
+    def set_gauge(self, name, value):
+        with self.lock:
+            self.gauges[name] = value
+
+    def drain(self):
+        """Return and reset everything recorded so far, to ship from a worker process"""
+        with self.lock:
+            snapshot = {
+                'stages': {stage: (h.bucket_counts, h.sum, h.count) for stage, h in self.stages.items()},
+                'counters': self.counters,
+                'gauges': dict(self.gauges)
+            }
+            self.stages = {}
+            self.counters = {}
+        return snapshot
+
+    def merge(self, snapshot):
+        """Fold a worker's drained metrics into this registry"""
+        with self.lock:
+            for stage, (bucket_counts, total, count) in snapshot['stages'].items():
+                histogram = self.stages.get(stage)
+                if histogram is None:
+                    histogram = self.stages[stage] = Histogram()
+                histogram.bucket_counts = [a + b for a, b in zip(histogram.bucket_counts, bucket_counts)]
+                histogram.sum += total
+                histogram.count += count
+            for name, value in snapshot['counters'].items():
+                self.counters[name] = self.counters.get(name, 0) + value
+            for name, value in snapshot['gauges'].items():
+                # Workers share one gauge, keep the worst case
+                if value is not None:
+                    self.gauges[f"worker_{name}"] = max(value, self.gauges.get(f"worker_{name}") or 0)
+
+    def render_prometheus(self, extra_gauges=None):
+        """Prometheus text exposition format (version 0.0.4)"""
+        lines = [f"# HELP {PREFIX}_stage_seconds Time spent in each pipeline stage",
+                 f"# TYPE {PREFIX}_stage_seconds histogram"]
+        with self.lock:
+            for stage, histogram in sorted(self.stages.items()):
+                cumulative = 0
+                for bound, count in zip(BUCKETS + (float('inf'),), histogram.bucket_counts):
+                    cumulative += count
+                    le = '+Inf' if bound == float('inf') else repr(bound)
+                    lines.append(f'{PREFIX}_stage_seconds_bucket{{stage="{stage}",le="{le}"}} {cumulative}')
+                lines.append(f'{PREFIX}_stage_seconds_sum{{stage="{stage}"}} {histogram.sum:.6f}')
+                lines.append(f'{PREFIX}_stage_seconds_count{{stage="{stage}"}} {histogram.count}')
+
+            for name, value in sorted(self.counters.items()):
+                lines.append(f"# TYPE {PREFIX}_{name} counter")
+                lines.append(f"{PREFIX}_{name} {value}")
+
+            gauges = dict(self.gauges)
+        gauges.update(memory_stats())
+        gauges.update(extra_gauges or {})
+        for name, value in sorted(gauges.items()):
+            if value is None:
+                continue
+            lines.append(f"# TYPE {PREFIX}_{name} gauge")
+            lines.append(f"{PREFIX}_{name} {value}")
+        return '\n'.join(lines) + '\n'
+
+registry = MetricsRegistry()
+_local = threading.local()
+
+@contextmanager
+def timed(stage):
+    """Record how long the block takes, globally and for the image being processed"""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - start
+        registry.observe(stage, elapsed)
+        record = getattr(_local, 'image', None)
+        if record is not None:
+            record['stages'][stage] = round(record['stages'].get(stage, 0.0) + elapsed, 6)
+
+def observe_stages(stages):
+    """Record stage timings measured elsewhere, e.g. in a worker process"""
+    for stage, seconds in stages.items():
+        registry.observe(stage, seconds)
+
+@contextmanager
+def image_timer(name):
+    """Collect the stage timings of one image and log them as a JSON line if enabled"""
+    record = {'image': name, 'stages': {}}
+    previous = getattr(_local, 'image', None)
+    _local.image = record
+    start = time.perf_counter()
+    try:
+        yield record
+    finally:
+        _local.image = previous
+        record['total_seconds'] = round(time.perf_counter() - start, 6)
+        registry.observe('image_total', record['total_seconds'])
+        registry.inc('images_processed_total')
+        log_json('image_processed', **record)
+
+def timed_iter(stage, iterable):
+    """Wrap a generator, recording the time spent producing its items as one observation"""
+    elapsed = 0.0
+    iterator = iter(iterable)
+    try:
+        while True:
+            start = time.perf_counter()
+            try:
+                item = next(iterator)
+            except StopIteration:
+                break
+            finally:
+                elapsed += time.perf_counter() - start
+            yield item
+    finally:
+        registry.observe(stage, elapsed)
+
+def log_json(event, **fields):
+    """Emit one structured log line when METRICS_JSON_LOGS is on"""
+    if config.METRICS_JSON_LOGS:
+        print(json.dumps({'event': event, 'ts': round(time.time(), 3), 'pid': os.getpid(), **fields}),
+              file=sys.stderr, flush=True)
+
+def memory_stats():
+    """Current and peak resident memory of this process in bytes"""
+    stats = {'process_resident_memory_bytes': None, 'process_peak_resident_memory_bytes': None}
+    try:
+        with open('/proc/self/statm') as f:
+            stats['process_resident_memory_bytes'] = int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, AttributeError):
+        pass
+    if resource is not None:
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        # Linux reports kilobytes, macOS bytes
+        stats['process_peak_resident_memory_bytes'] = peak if sys.platform == 'darwin' else peak * 1024
+    return stats
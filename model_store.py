@@ -0,0 +1,93 @@
+"""
+Local EfficientDet model store
+Fetch the TensorFlow Hub SavedModel once so workers can start without network access.
+
+Usage:
+    python model_store.py fetch                 # variant from config (D1 by default)
+    python model_store.py fetch --variant d0
+    python model_store.py list
+    python model_store.py convert --precision fp16   # reduced-precision TFLite copy (see tflite_engine.py)
+"""
+import argparse
+import os
+import shutil
+import sys
+
+import config
+
+MODEL_URLS = {
+    'd0': 'https://tfhub.dev/tensorflow/efficientdet/d0/1',
+    'd1': 'https://tfhub.dev/tensorflow/efficientdet/d1/1',
+    'd2': 'https://tfhub.dev/tensorflow/efficientdet/d2/1',
+}
+
+def local_model_path(variant):
+    """Directory holding the SavedModel for a variant"""
+    return os.path.join(config.EFFICIENTDET_MODEL_DIR, f"efficientdet_{variant}")
+
+def is_saved_model(path):
+    return os.path.isfile(os.path.join(path, 'saved_model.pb'))
+
+def fetch_model(variant, force=False):
+    """Download a variant from TensorFlow Hub into the local store, return its path"""
+    import tensorflow_hub as hub
+
+    dest = local_model_path(variant)
+    if is_saved_model(dest) and not force:
+        print(f"✅ EfficientDet {variant.upper()} already stored at {dest}")
+        return dest
+
+    print(f"Downloading EfficientDet {variant.upper()} from {MODEL_URLS[variant]}...")
+    # resolve() downloads into the hub cache and returns the unpacked SavedModel directory
+    cached_path = hub.resolve(MODEL_URLS[variant])
+
+    # Copy next to the destination first so a failed copy never leaves a half model behind
+    tmp_dest = f"{dest}.partial"
+    shutil.rmtree(tmp_dest, ignore_errors=True)
+    shutil.copytree(cached_path, tmp_dest)
+    shutil.rmtree(dest, ignore_errors=True)
+    os.replace(tmp_dest, dest)
+    print(f"✅ EfficientDet {variant.upper()} stored at {dest}")
+    return dest
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Manage locally stored EfficientDet models")
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    fetch = commands.add_parser('fetch', help="download a model into the local store")
+    fetch.add_argument('--variant', choices=sorted(MODEL_URLS), default=config.EFFICIENTDET_VARIANT)
+    fetch.add_argument('--force', action='store_true', help="download again even if stored")
+
+    commands.add_parser('list', help="show which variants are stored locally")
+
+    convert = commands.add_parser('convert', help="convert a stored model to a reduced-precision TFLite model")
+    convert.add_argument('--variant', choices=sorted(MODEL_URLS), default=config.EFFICIENTDET_VARIANT)
+    convert.add_argument('--precision', choices=('fp16', 'int8'), default=config.TFLITE_PRECISION)
+    convert.add_argument('--input-size', type=int, default=config.TFLITE_INPUT_SIZE,
+                         help="fixed square input of the converted model")
+    convert.add_argument('--calibration-dir', help="images for int8 calibration (default: the bundled images)")
+
+    args = parser.parse_args(argv)
+
+    if args.command == 'fetch':
+        try:
+            fetch_model(args.variant, force=args.force)
+        except Exception as e:
+            print(f"❌ Error fetching EfficientDet {args.variant.upper()}: {e}")
+            return 1
+    elif args.command == 'convert':
+        from tflite_engine import convert as convert_model
+        try:
+            convert_model(args.variant, args.precision, args.input_size, args.calibration_dir)
+        except Exception as e:
+            print(f"❌ Error converting EfficientDet {args.variant.upper()}: {e}")
+            return 1
+    else:
+        for variant in sorted(MODEL_URLS):
+            path = local_model_path(variant)
+            state = 'stored' if is_saved_model(path) else 'missing'
+            print(f"{variant}: {state} ({path})")
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,228 @@
+"""
+Process-pool image pipeline
+Each worker process loads EfficientDet once and keeps it warm, so a many-core
+node can count several images at the same time.
+"""
+import multiprocessing
+import os
+import threading
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor, FIRST_COMPLETED, wait
+from concurrent.futures.process import BrokenProcessPool
+
+import config
+import metrics
+from admission import memory_budget
+from image_io import image_name
+
+def _init_worker(intra_op_threads):
+    """Pin TensorFlow threading and warm up the configured backend once per worker process"""
+    from detectors import backend_names, get_backend
+
+    os.environ['OMP_NUM_THREADS'] = str(intra_op_threads)
+    # A TFLite interpreter gets the same share of the cores as TensorFlow would
+    config.TFLITE_THREADS = config.TFLITE_THREADS or intra_op_threads
+    # Backends without EfficientDet never import TensorFlow
+    if 'efficientdet' in backend_names():
+        try:
+            import tensorflow as tf
+            tf.config.threading.set_intra_op_parallelism_threads(intra_op_threads)
+            tf.config.threading.set_inter_op_parallelism_threads(1)
+        except (ImportError, RuntimeError) as e:
+            print(f"⚠️ Could not configure TensorFlow threads in worker: {e}")
+
+    backend = get_backend()
+    ready = backend.available()
+    print(f"Worker {os.getpid()} ready ({backend.label} {'loaded' if ready else 'unavailable'})")
+
+def _process_one(image, lazy=False):
+    """Count one image inside a worker; errors stay with this image"""
+    from advanced_detection import count_people_detections
+    from counting import count_people_in_image
+
+    # Encoded outputs, or the detections to render later, travel back with the result
+    outputs = []
+    detection = None
+    try:
+        if lazy:
+            with metrics.image_timer(image_name(image)):
+                detection = count_people_detections([image])[0]
+        if detection is not None and detection[3] is not None:
+            count, processed_path = detection[0], None
+            method = f"{detection[2]} (threshold: {detection[1]})"
+        else:
+            detection = None
+            count, processed_path, method = count_people_in_image(
+                image, output_sink=lambda name, data: outputs.append((name, data)))
+        error = None
+    except Exception as e:
+        count, processed_path, method, error = 0, None, None, str(e)
+
+    result = {
+        'image_name': image_name(image),
+        'people_count': count,
+        'method': method,
+        'annotated': bool(outputs),
+        'processed_image_path': processed_path,
+        'original_image_path': getattr(image, 'path', image),
+        'outputs': outputs,
+        'detection': detection
+    }
+    if error:
+        result['error'] = error
+    # Timings recorded in this worker are folded into the parent's /metrics
+    snapshot = metrics.registry.drain()
+    snapshot['gauges']['peak_resident_memory_bytes'] = metrics.memory_stats()['process_peak_resident_memory_bytes']
+    result['metrics'] = snapshot
+    return result
+
+def _failed_result(image, error):
+    """Result for an image that could not be counted: no people, and the reason"""
+    return {
+        'image_name': image_name(image),
+        'people_count': 0,
+        'annotated': False,
+        'processed_image_path': None,
+        'original_image_path': getattr(image, 'path', image),
+        'error': error
+    }
+
+class ParallelImageProcessor:
+    """Bounded, order-preserving fan-out of count_people_in_image over worker processes"""
+    def __init__(self, workers, intra_op_threads=None, max_in_flight=None):
+        self.workers = workers
+        # Split the cores between workers so TensorFlow does not oversubscribe them
+        self.intra_op_threads = intra_op_threads or max(1, (os.cpu_count() or 1) // workers)
+        self.max_in_flight = max_in_flight or workers * 2
+        self.executor = None
+        self.lock = threading.Lock()
+
+    def _get_executor(self):
+        if self.executor is None:
+            print(f"Starting {self.workers} worker processes "
+                  f"({self.intra_op_threads} TensorFlow threads each)")
+            # Spawn rather than fork: TensorFlow is not fork-safe once initialized
+            self.executor = ProcessPoolExecutor(
+                max_workers=self.workers,
+                mp_context=multiprocessing.get_context('spawn'),
+                initializer=_init_worker,
+                initargs=(self.intra_op_threads,)
+            )
+        return self.executor
+
+    def _restart(self):
+        print("⚠️ A worker process died, restarting the pool...")
+        if self.executor is not None:
+            self.executor.shutdown(wait=False, cancel_futures=True)
+        self.executor = None
+
+    def map(self, images, progress_callback=None, output_sink=None, detection_sink=None):
+        """
+        Process images (paths or ImageInputs) in parallel, returning results in input order
+        output_sink(name, data) receives each encoded annotated image if given
+        detection_sink(image, count, threshold, label, detections) enables lazy
+        annotation, as in app.process_images
+        """
+        # One batch at a time keeps in-flight work bounded across concurrent jobs
+        with self.lock:
+            results = [None] * len(images)
+            pending = {}
+            queue = deque(range(len(images)))
+            # Images in flight when a worker died; retried one at a time to find the one that crashed it
+            suspects = deque()
+            completed = 0
+            # Planned from the image headers, before anything is decoded
+            estimates = [memory_budget.plan(image) for image in images]
+            reserved = {}
+
+            def finish(index, result):
+                nonlocal completed
+                results[index] = result
+                completed += 1
+                if progress_callback is not None:
+                    progress_callback(completed, result)
+
+            def collect(future):
+                """Handle one finished future; False when its worker process died"""
+                index, isolated = pending.pop(future)
+                memory_budget.release(reserved.pop(index))
+                try:
+                    result = future.result()
+                    metrics.registry.merge(result.pop('metrics'))
+                    for name, data in result.pop('outputs'):
+                        if output_sink is not None:
+                            output_sink(name, data)
+                    detection = result.pop('detection')
+                    if detection is not None:
+                        result['annotated'] = bool(detection_sink(images[index], *detection))
+                except BrokenProcessPool as e:
+                    if not isolated:
+                        # Any image in flight may have crashed the worker (e.g. OOM-killed)
+                        suspects.append(index)
+                        return False
+                    # It crashed a worker while running alone: this image is the cause
+                    print(f"❌ {image_name(images[index])} crashed a worker process: {e}")
+                    result = _failed_result(images[index], 'Worker process crashed on this image')
+                    finish(index, result)
+                    return False
+                except Exception as e:
+                    print(f"❌ Error processing {image_name(images[index])}: {e}")
+                    result = _failed_result(images[index], str(e))
+                finish(index, result)
+                return True
+
+            while queue or suspects or pending:
+                while len(pending) < (1 if suspects else self.max_in_flight):
+                    if suspects:
+                        if pending:
+                            break
+                        source, isolated = suspects, True
+                    elif queue:
+                        source, isolated = queue, False
+                    else:
+                        break
+                    index = source[0]
+                    # Workers share the memory budget; with work in flight, wait for it instead of blocking
+                    if index not in reserved:
+                        estimate = estimates[index]
+                        if pending and not memory_budget.try_acquire(estimate):
+                            break
+                        if not pending:
+                            memory_budget.acquire(estimate)
+                        reserved[index] = estimate
+                    try:
+                        future = self._get_executor().submit(_process_one, images[index], detection_sink is not None)
+                    except BrokenProcessPool:
+                        self._restart()
+                        continue
+                    source.popleft()
+                    pending[future] = (index, isolated)
+
+                done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                healthy = all([collect(future) for future in done])
+                if not healthy:
+                    # The other futures of the broken pool fail as well; collect them before restarting
+                    for future in wait(list(pending)).done:
+                        collect(future)
+                    self._restart()
+
+            return results
+
+    def shutdown(self):
+        if self.executor is not None:
+            self.executor.shutdown()
+            self.executor = None
+
+# Shared pool, kept warm between batches
+_processor = None
+
+def get_processor():
+    """Return the shared worker pool configured from config.py"""
+    global _processor
+    if _processor is None:
+        _processor = ParallelImageProcessor(
+            config.PARALLEL_WORKERS,
+            intra_op_threads=config.TF_INTRA_OP_THREADS or None,
+            max_in_flight=config.PARALLEL_MAX_IN_FLIGHT or None
+        )
+    return _processor
@@ -0,0 +1,121 @@
+"""
+Lazy rendering of annotated images
+Jobs keep each upload's original bytes and its detections. Annotated images are
+drawn only when they are viewed or downloaded, at the requested size, and the
+rendered files are cached next to the job's other outputs.
+"""
+import os
+import threading
+from datetime import datetime
+
+import cv2
+import numpy as np
+
+import config
+from image_io import ImageInput, encode_image
+from metrics import timed
+
+def stamp_footer(image, method, timestamp=None):
+    """Write the processing time and method into the bottom-left corner, in place"""
+    timestamp = timestamp or datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+    with timed('annotation'):
+        cv2.putText(image, f"Processed: {timestamp}", (15, image.shape[0] - 30),
+                   cv2.FONT_HERSHEY_SIMPLEX, 0.5, (255, 255, 255), 1)
+        cv2.putText(image, f"Method: {method}", (15, image.shape[0] - 10),
+                   cv2.FONT_HERSHEY_SIMPLEX, 0.5, (255, 255, 255), 1)
+    return image
+
+def snap_size(size):
+    """Round a requested size up to one of RENDER_SIZES, or None for full resolution"""
+    if not size:
+        return None
+    for allowed in sorted(config.RENDER_SIZES):
+        if size <= allowed:
+            return allowed
+    return None
+
+class AnnotationStore:
+    """Original uploads plus detections for one job, rendered on demand"""
+    def __init__(self, folder):
+        self.folder = folder
+
+    def _original_path(self, name):
+        return os.path.join(self.folder, 'originals', name)
+
+    def _detections_path(self, name):
+        return os.path.join(self.folder, 'detections', f"{name}.npz")
+
+    def rendered_path(self, name, size=None):
+        return os.path.join(self.folder, 'rendered', str(size or 'full'), f"processed_{name}")
+
+    def save(self, image, count, threshold, label, detections):
+        """Keep what rendering needs: the original file and the detections (no drawing here)"""
+        if detections is None or threshold is None:
+            return False
+        os.makedirs(os.path.dirname(self._original_path(image.name)), exist_ok=True)
+        os.makedirs(os.path.dirname(self._detections_path(image.name)), exist_ok=True)
+        with timed('processed_save'):
+            try:
+                # Uploads kept on disk (SAVE_UPLOADS) are shared rather than copied
+                os.link(image.path, self._original_path(image.name))
+            except (OSError, TypeError):
+                with open(self._original_path(image.name), 'wb') as f:
+                    f.write(image.data)
+            tmp_path = f"{self._detections_path(image.name)}.{threading.get_ident()}.tmp.npz"
+            np.savez(tmp_path, boxes=detections.boxes, scores=detections.scores, classes=detections.classes,
+                     num_detections=detections.num_detections, count=count, threshold=threshold, label=label,
+                     processed_at=datetime.now().strftime("%Y-%m-%d %H:%M:%S"))
+            os.replace(tmp_path, self._detections_path(image.name))
+        return True
+
+    def has(self, name):
+        return (os.path.basename(name) == name and os.path.exists(self._detections_path(name))
+                and os.path.exists(self._original_path(name)))
+
+    def render(self, name, size=None):
+        """Path of the annotated image at most size pixels on its longest side, rendered if not cached"""
+        if not self.has(name):
+            return None
+        size = snap_size(size)
+        original = ImageInput(name, path=self._original_path(name))
+        if size and original.dimensions and max(original.dimensions) <= size:
+            # Already small enough: share the full-size render
+            size = None
+        path = self.rendered_path(name, size)
+        if os.path.exists(path):
+            return path
+
+        from advanced_detection import DetectionResult, annotate_image
+
+        with timed('render'):
+            with np.load(self._detections_path(name)) as data:
+                detections = DetectionResult(data['boxes'], data['scores'], data['classes'],
+                                             int(data['num_detections']))
+                threshold = float(data['threshold'])
+                label = str(data['label'])
+                processed_at = str(data['processed_at'])
+
+            # Sized renders decode the JPEG at a reduced scale when it is much larger
+            pixels = original.pixels_at(size)
+            if pixels is None:
+                return None
+            height, width = pixels.shape[:2]
+            if size and max(height, width) > size:
+                scale = size / max(height, width)
+                pixels = cv2.resize(pixels, (int(width * scale), int(height * scale)), interpolation=cv2.INTER_AREA)
+
+            # Thumbnails get the boxes only, labels and the footer would be unreadable
+            full_detail = size is None or size >= config.RENDER_LABELS_MIN_SIZE
+            annotated_image, _ = annotate_image(pixels, detections, threshold, label, labels=full_detail)
+            if full_detail:
+                stamp_footer(annotated_image, f"{label} (threshold: {threshold})", processed_at)
+
+            encoded = encode_image(annotated_image, name)
+            if encoded is None:
+                return None
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            tmp_path = f"{path}.{threading.get_ident()}.tmp"
+            with open(tmp_path, 'wb') as f:
+                f.write(encoded)
+            os.replace(tmp_path, path)
+        return path
@@ -0,0 +1,177 @@
+"""
+Content-addressed cache of detection results
+Entries are keyed by the image bytes plus the detector settings, so re-uploaded
+photos skip inference and annotation entirely.
+"""
+import hashlib
+import os
+import threading
+
+import cv2
+import numpy as np
+
+import config
+
+class ResultCache:
+    """Disk-backed LRU cache of (count, annotated image, method, detections)"""
+    def __init__(self, folder, max_bytes):
+        self.folder = folder
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.total_bytes = None
+        self.lock = threading.Lock()
+        os.makedirs(folder, exist_ok=True)
+
+    def settings_fingerprint(self):
+        """Everything besides the pixels that changes the detections"""
+        import advanced_detection
+        # Key on the model actually loaded, which differs from config after a fallback and names
+        # the engine (TFLite precision and input size). It is loaded first, so the first keys match later ones.
+        from detectors import backend_names
+        variant = None
+        if 'efficientdet' in backend_names() and advanced_detection.initialize_efficientdet():
+            variant = advanced_detection.efficient_det.variant
+        if not variant:
+            variant = (config.EFFICIENTDET_VARIANT, config.INFERENCE_ENGINE, config.TFLITE_PRECISION,
+                       config.TFLITE_INPUT_SIZE)
+        settings = (variant, config.MAX_INFERENCE_SIZE,
+                    config.CONFIDENCE_THRESHOLD, advanced_detection.COUNT_THRESHOLDS)
+        if config.DETECTOR_BACKEND != 'efficientdet':
+            settings += (config.DETECTOR_BACKEND, config.CASCADE_CHEAP_BACKEND, config.CASCADE_EXPENSIVE_BACKEND,
+                         config.CASCADE_CROWD_COUNT, config.CASCADE_UNCERTAIN_BAND, config.CASCADE_MAX_UNCERTAIN,
+                         config.CASCADE_ESCALATE_EMPTY, config.HOG_THRESHOLD, config.HOG_MAX_SIZE,
+                         config.DNN_MODEL_PATH, config.DNN_PERSON_CLASS, config.DNN_INPUT_SIZE, config.DNN_THRESHOLD)
+        return repr(settings)
+
+    def key_for(self, image_hash, mode='full'):
+        """Key from an image's sha256 hex digest (ImageInput.sha256), the detector settings and the mode"""
+        digest = hashlib.sha256(image_hash.encode())
+        digest.update(self.settings_fingerprint().encode())
+        # 'tiled' may carry an inference size or backend suffix (tiled@768, tiled+hog)
+        if mode.startswith('tiled'):
+            digest.update(repr((config.TILE_SIZE, config.TILE_OVERLAP,
+                                config.TILE_NMS_IOU, config.TILE_NMS_CONTAINMENT)).encode())
+        digest.update(mode.encode())
+        return digest.hexdigest()
+
+    def _paths(self, key):
+        # Shard by prefix so no single directory grows too large
+        base = os.path.join(self.folder, key[:2], key)
+        return f"{base}.npz", f"{base}.jpg"
+
+    def get(self, key, with_image=True):
+        """
+        Return (count, annotated_image, method, detections) or None
+        with_image=False skips loading the annotated image (it is returned as None)
+        and also accepts entries stored without one.
+        """
+        from advanced_detection import DetectionResult
+
+        data_path, image_path = self._paths(key)
+        try:
+            with np.load(data_path) as data:
+                detections = DetectionResult(data['boxes'], data['scores'], data['classes'],
+                                             int(data['num_detections']))
+                if 'source' in data.files:
+                    detections.source = str(data['source']) or None
+                count = int(data['count'])
+                method = str(data['method'])
+                has_image = bool(data['has_image'])
+            if with_image and not has_image:
+                # Stored by the API path, which never draws; callers wanting the image redo it
+                raise KeyError(f"no annotated image stored for {key}")
+            annotated_image = cv2.imread(image_path) if with_image else None
+            if with_image and annotated_image is None:
+                raise OSError(f"annotated image missing for {key}")
+            # Touch the entry so eviction treats it as recently used
+            for path in (data_path, image_path):
+                if os.path.exists(path):
+                    os.utime(path)
+        except (OSError, KeyError, ValueError):
+            with self.lock:
+                self.misses += 1
+            return None
+
+        with self.lock:
+            self.hits += 1
+        return count, annotated_image, method, detections
+
+    def put(self, key, count, annotated_image, method, detections):
+        data_path, image_path = self._paths(key)
+        os.makedirs(os.path.dirname(data_path), exist_ok=True)
+        try:
+            added = 0
+            if annotated_image is not None:
+                cv2.imwrite(image_path, annotated_image, [cv2.IMWRITE_JPEG_QUALITY, 95])
+                added += os.path.getsize(image_path)
+            # Write under a temporary name so readers never load a partial entry
+            tmp_path = f"{data_path}.{os.getpid()}.tmp.npz"
+            np.savez(tmp_path, boxes=detections.boxes, scores=detections.scores,
+                     classes=detections.classes, num_detections=detections.num_detections,
+                     count=count, method=method, has_image=annotated_image is not None,
+                     source=detections.source or '')
+            os.replace(tmp_path, data_path)
+            added += os.path.getsize(data_path)
+        except OSError as e:
+            print(f"⚠️ Could not write cache entry: {e}")
+            return
+
+        with self.lock:
+            if self.total_bytes is None:
+                self.total_bytes = self._disk_usage()
+            else:
+                self.total_bytes += added
+            if self.total_bytes > self.max_bytes:
+                self._evict()
+
+    def _entries(self):
+        """Cached files as (mtime, size, path)"""
+        entries = []
+        for root, _, files in os.walk(self.folder):
+            for name in files:
+                path = os.path.join(root, name)
+                try:
+                    stat = os.stat(path)
+                except OSError:
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, path))
+        return entries
+
+    def _disk_usage(self):
+        return sum(size for _, size, _ in self._entries())
+
+    def _evict(self):
+        """Drop least recently used entries until the cache is back under 90% of its budget"""
+        entries = sorted(self._entries())
+        total = sum(size for _, size, _ in entries)
+        target = self.max_bytes * 0.9
+        for _, size, path in entries:
+            if total <= target:
+                break
+            try:
+                os.unlink(path)
+                total -= size
+                if path.endswith('.npz'):
+                    self.evictions += 1
+            except OSError:
+                pass
+        self.total_bytes = total
+
+    def stats(self):
+        with self.lock:
+            lookups = self.hits + self.misses
+            if self.total_bytes is None:
+                self.total_bytes = self._disk_usage()
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': round(self.hits / lookups, 3) if lookups else 0.0,
+                'evictions': self.evictions,
+                'size_bytes': self.total_bytes,
+                'max_bytes': self.max_bytes
+            }
+
+# Shared cache instance
+result_cache = ResultCache(config.RESULT_CACHE_FOLDER, config.RESULT_CACHE_MAX_MB * 1024 * 1024)
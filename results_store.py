@@ -0,0 +1,182 @@
+"""
+Persistent results store
+Every counted image is recorded in a local SQLite database (image hash, time,
+site, count, model and threshold), next to an hourly rollup that is updated in
+the same transaction. Dashboards query trends from the rollup in milliseconds,
+without opening spreadsheets or re-running inference.
+"""
+import os
+import re
+import sqlite3
+import threading
+import time
+from datetime import datetime, timezone
+
+import config
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS counts (
+    id INTEGER PRIMARY KEY,
+    counted_at REAL NOT NULL,
+    site TEXT NOT NULL DEFAULT '',
+    job_id TEXT,
+    image_name TEXT NOT NULL,
+    image_hash TEXT,
+    people_count INTEGER NOT NULL,
+    model TEXT,
+    threshold REAL,
+    error TEXT
+);
+CREATE INDEX IF NOT EXISTS counts_time ON counts (counted_at);
+CREATE INDEX IF NOT EXISTS counts_site_time ON counts (site, counted_at);
+CREATE INDEX IF NOT EXISTS counts_hash ON counts (image_hash);
+CREATE INDEX IF NOT EXISTS counts_job ON counts (job_id);
+
+CREATE TABLE IF NOT EXISTS hourly_counts (
+    site TEXT NOT NULL,
+    hour INTEGER NOT NULL,
+    images INTEGER NOT NULL,
+    people INTEGER NOT NULL,
+    max_people INTEGER NOT NULL,
+    PRIMARY KEY (site, hour)
+);
+"""
+
+BUCKETS = {'hour': 3600, 'day': 86400}
+
+# Methods are reported as "<model> (threshold: <value>)" throughout the pipeline
+METHOD_PATTERN = re.compile(r'^(?P<model>.*?)\s*\(threshold: (?P<threshold>[0-9.]+)\)$')
+
+def split_method(method):
+    """(model, threshold) from a method string; threshold is None when it has none"""
+    match = METHOD_PATTERN.match(method or '')
+    if match is None:
+        return method, None
+    return match.group('model'), float(match.group('threshold'))
+
+def is_failed_model(model):
+    """True for models that mean the image was not counted (errors and the basic fallback)"""
+    return model == 'Basic fallback' or (model or '').endswith(('Error', 'Unavailable'))
+
+def parse_time(value):
+    """Unix seconds from epoch seconds or an ISO 8601 string (naive times are UTC)"""
+    if value is None or value == '':
+        return None
+    try:
+        return float(value)
+    except ValueError:
+        pass
+    parsed = datetime.fromisoformat(value.replace('Z', '+00:00'))
+    if parsed.tzinfo is None:
+        parsed = parsed.replace(tzinfo=timezone.utc)
+    return parsed.timestamp()
+
+def iso(timestamp):
+    return datetime.fromtimestamp(timestamp, timezone.utc).isoformat(timespec='seconds')
+
+class ResultsStore:
+    """Append-only table of counts plus an hourly rollup, shared by all threads of a process"""
+    def __init__(self, path):
+        self.path = path
+        self.conn = None
+        self.lock = threading.Lock()
+
+    def _connect(self):
+        if self.conn is None:
+            folder = os.path.dirname(self.path)
+            if folder:
+                os.makedirs(folder, exist_ok=True)
+            # Several web processes may write: WAL lets readers run alongside a writer
+            self.conn = sqlite3.connect(self.path, timeout=10, check_same_thread=False)
+            self.conn.row_factory = sqlite3.Row
+            self.conn.execute('PRAGMA journal_mode=WAL')
+            self.conn.execute('PRAGMA synchronous=NORMAL')
+            self.conn.executescript(SCHEMA)
+        return self.conn
+
+    def record(self, results, job_id=None, site=None, counted_at=None):
+        """
+        Store per-image result dicts (image_name, people_count, method, image_hash, error)
+        and fold them into the hourly rollup, in one transaction
+        """
+        counted_at = counted_at or time.time()
+        site = site or ''
+        rows = []
+        for result in results:
+            if result.get('video'):
+                continue
+            model, threshold = split_method(result.get('method'))
+            error = result.get('error')
+            if error is None and is_failed_model(model):
+                error = 'Detection failed'
+            rows.append((counted_at, site, job_id, result['image_name'], result.get('image_hash'),
+                         result['people_count'], model, threshold, error))
+        if not rows:
+            return 0
+
+        hour = int(counted_at // 3600 * 3600)
+        with self.lock:
+            conn = self._connect()
+            with conn:
+                conn.executemany("""
+                    INSERT INTO counts (counted_at, site, job_id, image_name, image_hash,
+                                        people_count, model, threshold, error)
+                    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)""", rows)
+                # Failed images stay in the history but would skew the averages
+                for row in (row for row in rows if row[8] is None):
+                    conn.execute("""
+                        INSERT INTO hourly_counts (site, hour, images, people, max_people)
+                        VALUES (?, ?, 1, ?, ?)
+                        ON CONFLICT (site, hour) DO UPDATE SET
+                            images = images + 1,
+                            people = people + excluded.people,
+                            max_people = MAX(max_people, excluded.max_people)""",
+                        (site, hour, row[5], row[5]))
+        return len(rows)
+
+    def history(self, start=None, end=None, site=None, image_hash=None, job_id=None, limit=100):
+        """Most recent individual counts matching the filters"""
+        clauses, params = [], []
+        for column, op, value in (('counted_at', '>=', start), ('counted_at', '<', end), ('site', '=', site),
+                                  ('image_hash', '=', image_hash), ('job_id', '=', job_id)):
+            if value is not None:
+                clauses.append(f"{column} {op} ?")
+                params.append(value)
+        where = f"WHERE {' AND '.join(clauses)}" if clauses else ''
+        with self.lock:
+            rows = self._connect().execute(
+                f"SELECT * FROM counts {where} ORDER BY counted_at DESC, id DESC LIMIT ?", params + [limit]).fetchall()
+        return [dict(row, counted_at=iso(row['counted_at'])) for row in rows]
+
+    def rollup(self, start=None, end=None, site=None, bucket='hour'):
+        """Images, people, average and peak count per site and bucket, from the hourly rollup"""
+        seconds = BUCKETS[bucket]
+        clauses, params = [], []
+        if start is not None:
+            clauses.append('hour >= ?')
+            params.append(int(start // 3600 * 3600))
+        if end is not None:
+            clauses.append('hour < ?')
+            params.append(end)
+        if site is not None:
+            clauses.append('site = ?')
+            params.append(site)
+        where = f"WHERE {' AND '.join(clauses)}" if clauses else ''
+        with self.lock:
+            rows = self._connect().execute(f"""
+                SELECT site, (hour / {seconds}) * {seconds} AS bucket_start,
+                       SUM(images) AS images, SUM(people) AS people, MAX(max_people) AS max_people
+                FROM hourly_counts {where}
+                GROUP BY site, bucket_start
+                ORDER BY bucket_start, site""", params).fetchall()
+        return [{
+            'site': row['site'],
+            'start': iso(row['bucket_start']),
+            'images': row['images'],
+            'people': row['people'],
+            'avg_people': round(row['people'] / row['images'], 2),
+            'max_people': row['max_people']
+        } for row in rows]
+
+# Shared store instance
+results_store = ResultsStore(config.RESULTS_DB_PATH)
@@ -0,0 +1,183 @@
+"""
+Per-job storage
+Every job gets its own directory under STORAGE_FOLDER with its uploads, outputs,
+state and a manifest. A background sweeper deletes jobs whose TTL has passed and
+evicts the least recently used jobs while the total is over the disk quota.
+"""
+import json
+import os
+import shutil
+import threading
+import time
+import uuid
+from datetime import datetime
+
+from jobs import JOB_ID_PATTERN
+from metrics import registry
+
+MANIFEST = 'manifest.json'
+
+class JobStorage:
+    """Job directories under one root, swept by TTL and a total size quota"""
+    def __init__(self, root, ttl_seconds, quota_bytes, sweep_interval=300, is_active=None, on_remove=None):
+        self.root = root
+        self.ttl = ttl_seconds
+        self.quota = quota_bytes
+        self.sweep_interval = sweep_interval
+        # Running jobs are never swept; on_remove lets the job queue forget swept jobs
+        self.is_active = is_active or (lambda job_id: False)
+        self.on_remove = on_remove
+        self.wake = threading.Event()
+        self.sweeper = None
+        self.lock = threading.Lock()
+        self.sweep_lock = threading.Lock()
+        os.makedirs(root, exist_ok=True)
+
+    @staticmethod
+    def new_job_id():
+        return uuid.uuid4().hex
+
+    def path(self, job_id, *parts):
+        return os.path.join(self.root, job_id, *parts)
+
+    def create(self, job_id, kind, names):
+        """Make the job's directory and write its manifest"""
+        os.makedirs(self.path(job_id, 'uploads'), exist_ok=True)
+        self._write_manifest(job_id, {
+            'job_id': job_id,
+            'kind': kind,
+            'inputs': names,
+            'created_at': datetime.now().isoformat(timespec='seconds'),
+            'finished_at': None,
+            'files': {},
+            'size_bytes': 0
+        })
+        self.start_sweeper()
+        # New data may have pushed the total over the quota
+        self.wake.set()
+
+    def save_upload(self, job_id, name, data):
+        """Write an uploaded file into the job's uploads/ folder, returning its path"""
+        path = self.path(job_id, 'uploads', name)
+        with open(path, 'wb') as f:
+            f.write(data)
+        return path
+
+    def manifest(self, job_id):
+        try:
+            with open(self.path(job_id, MANIFEST)) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def seal(self, job_id):
+        """Record the finished job's files and size in its manifest"""
+        manifest = self.manifest(job_id)
+        if manifest is None:
+            return
+        files = {}
+        folder = self.path(job_id)
+        for root, _, names in os.walk(folder):
+            for name in names:
+                path = os.path.join(root, name)
+                if name != MANIFEST and os.path.isfile(path):
+                    files[os.path.relpath(path, folder)] = os.path.getsize(path)
+        manifest.update(files=files, size_bytes=sum(files.values()),
+                        finished_at=datetime.now().isoformat(timespec='seconds'))
+        self._write_manifest(job_id, manifest)
+
+    def touch(self, job_id):
+        """Mark the job as used now, restarting its TTL"""
+        try:
+            os.utime(self.path(job_id, MANIFEST))
+        except OSError:
+            pass
+
+    def remove(self, job_id):
+        shutil.rmtree(self.path(job_id), ignore_errors=True)
+        if self.on_remove is not None:
+            self.on_remove(job_id)
+
+    def _write_manifest(self, job_id, manifest):
+        path = self.path(job_id, MANIFEST)
+        tmp_path = f"{path}.{threading.get_ident()}.tmp"
+        with open(tmp_path, 'w') as f:
+            json.dump(manifest, f, indent=1)
+        os.replace(tmp_path, path)
+
+    def _last_used(self, job_id):
+        for path in (self.path(job_id, MANIFEST), self.path(job_id)):
+            try:
+                return os.path.getmtime(path)
+            except OSError:
+                continue
+        return 0
+
+    def _size(self, job_id):
+        total = 0
+        for root, _, names in os.walk(self.path(job_id)):
+            for name in names:
+                try:
+                    total += os.path.getsize(os.path.join(root, name))
+                except OSError:
+                    pass
+        return total
+
+    def sweep(self):
+        """Delete expired jobs, then the least recently used ones until under the quota"""
+        with self.sweep_lock:
+            now = time.time()
+            expired = evicted = 0
+            total = 0
+            candidates = []
+            with os.scandir(self.root) as entries:
+                for entry in entries:
+                    job_id = entry.name
+                    if entry.is_file() and job_id.endswith('.json') and self.ttl and now - entry.stat().st_mtime > self.ttl:
+                        # Job state from before per-job directories
+                        os.unlink(entry.path)
+                        continue
+                    if not JOB_ID_PATTERN.match(job_id) or not entry.is_dir():
+                        continue
+                    size = self._size(job_id)
+                    if self.is_active(job_id):
+                        total += size
+                        continue
+                    last_used = self._last_used(job_id)
+                    if self.ttl and now - last_used > self.ttl:
+                        self.remove(job_id)
+                        expired += 1
+                        continue
+                    total += size
+                    candidates.append((last_used, job_id, size))
+
+            if self.quota:
+                for _, job_id, size in sorted(candidates):
+                    if total <= self.quota:
+                        break
+                    self.remove(job_id)
+                    total -= size
+                    evicted += 1
+
+        if expired or evicted:
+            print(f"🧹 Storage sweep: {expired} expired, {evicted} evicted for the quota, {total / 1e6:.1f}MB kept")
+        registry.inc('storage_jobs_expired_total', expired)
+        registry.inc('storage_jobs_evicted_total', evicted)
+        registry.set_gauge('storage_bytes', total)
+        return expired, evicted
+
+    def start_sweeper(self):
+        """Start the background sweeper once, on first use (worker processes never start one)"""
+        with self.lock:
+            if self.sweeper is None:
+                self.sweeper = threading.Thread(target=self._sweep_loop, name='storage-sweeper', daemon=True)
+                self.sweeper.start()
+
+    def _sweep_loop(self):
+        while True:
+            try:
+                self.sweep()
+            except Exception as e:
+                print(f"⚠️ Storage sweep failed: {e}")
+            self.wake.wait(self.sweep_interval)
+            self.wake.clear()
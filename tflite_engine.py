@@ -0,0 +1,220 @@
+"""
+Reduced-precision TFLite inference engine
+Converts the locally stored EfficientDet SavedModel into an FP16 or int8 TFLite
+model and runs it on one reusable interpreter (XNNPACK is TFLite's default CPU
+delegate). Detections come back as the same DetectionResult the SavedModel
+engine produces, so thresholds, counting and annotation are unchanged.
+
+    python model_store.py convert --precision fp16
+    INFERENCE_ENGINE=tflite TFLITE_PRECISION=fp16 python app.py
+"""
+import glob
+import os
+import threading
+import time
+
+import cv2
+import numpy as np
+
+import config
+from advanced_detection import DetectionResult, EfficientDetCounter
+from image_io import as_image_input, image_name, to_inference_array
+from metrics import registry, timed
+from model_store import is_saved_model, local_model_path
+
+# Converted models keep box decoding and NMS as Select TF (Flex) ops, which only the full
+# TensorFlow interpreter can run; tflite-runtime is tried so that case gets a clear error
+FLEX_SUPPORTED = True
+try:
+    import tensorflow as tf
+    Interpreter = tf.lite.Interpreter
+except ImportError:
+    FLEX_SUPPORTED = False
+    try:
+        from tflite_runtime.interpreter import Interpreter
+    except ImportError:
+        Interpreter = None
+
+PRECISIONS = ('fp16', 'int8')
+OUTPUTS = ('detection_boxes', 'detection_scores', 'detection_classes', 'num_detections')
+
+def tflite_model_path(variant, precision, input_size):
+    return os.path.join(config.EFFICIENTDET_MODEL_DIR, f"efficientdet_{variant}_{precision}_{input_size}.tflite")
+
+def letterbox(array, size):
+    """Fit an RGB array into a size x size canvas (top-left aligned), returning it and the content shape"""
+    height, width = array.shape[:2]
+    if max(height, width) > size:
+        scale = size / max(height, width)
+        with timed('resize'):
+            array = cv2.resize(array, (max(1, int(width * scale)), max(1, int(height * scale))),
+                               interpolation=cv2.INTER_AREA)
+    canvas = np.zeros((size, size, 3), dtype=np.uint8)
+    canvas[:array.shape[0], :array.shape[1]] = array
+    return canvas, array.shape[:2]
+
+def representative_images(input_size, calibration_dir=None, limit=100):
+    """Calibration inputs for int8 quantization: the bundled images, or a folder of typical uploads"""
+    here = os.path.dirname(os.path.abspath(__file__))
+    if calibration_dir:
+        paths = sorted(glob.glob(os.path.join(calibration_dir, '*')))
+    else:
+        paths = sorted(glob.glob(os.path.join(here, 'images', '*')))
+        paths += [os.path.join(here, name) for name in ('sample_people_image.jpg', 'demo_people_image.jpg')]
+    count = 0
+    for path in paths:
+        pixels = cv2.imread(path)
+        if pixels is None:
+            continue
+        canvas, _ = letterbox(to_inference_array(pixels, input_size), input_size)
+        yield [canvas[np.newaxis, ...]]
+        count += 1
+        if count >= limit:
+            return
+
+def convert(variant, precision, input_size=None, calibration_dir=None):
+    """Convert the stored SavedModel to TFLite at a fixed input size, return the .tflite path"""
+    import tensorflow as tf
+
+    input_size = input_size or config.TFLITE_INPUT_SIZE
+    if precision not in PRECISIONS:
+        raise ValueError(f"precision must be one of {', '.join(PRECISIONS)}")
+    saved_model = local_model_path(variant)
+    if not is_saved_model(saved_model):
+        raise FileNotFoundError(f"No SavedModel at {saved_model} (run: python model_store.py fetch --variant {variant})")
+
+    print(f"Converting EfficientDet {variant.upper()} to {precision} TFLite at {input_size}x{input_size}...")
+    model = tf.saved_model.load(saved_model)
+
+    # A static input shape lets TFLite plan its tensors once and XNNPACK take the convolutions
+    @tf.function(input_signature=[tf.TensorSpec([1, input_size, input_size, 3], tf.uint8, name='images')])
+    def serving(images):
+        outputs = model(images)
+        return {name: outputs[name] for name in OUTPUTS}
+
+    converter = tf.lite.TFLiteConverter.from_concrete_functions([serving.get_concrete_function()], model)
+    converter.optimizations = [tf.lite.Optimize.DEFAULT]
+    # Box decoding and NMS have no builtin TFLite kernels, they stay TF ops
+    converter.target_spec.supported_ops = [tf.lite.OpsSet.TFLITE_BUILTINS, tf.lite.OpsSet.SELECT_TF_OPS]
+    if precision == 'fp16':
+        converter.target_spec.supported_types = [tf.float16]
+    else:
+        converter.representative_dataset = lambda: representative_images(input_size, calibration_dir)
+        converter.target_spec.supported_ops = [tf.lite.OpsSet.TFLITE_BUILTINS_INT8,
+                                               tf.lite.OpsSet.TFLITE_BUILTINS, tf.lite.OpsSet.SELECT_TF_OPS]
+
+    start = time.perf_counter()
+    data = converter.convert()
+    path = tflite_model_path(variant, precision, input_size)
+    tmp_path = f"{path}.partial"
+    with open(tmp_path, 'wb') as f:
+        f.write(data)
+    os.replace(tmp_path, path)
+    print(f"✅ {path} written ({len(data) / 1e6:.1f}MB) in {time.perf_counter() - start:.0f}s")
+    return path
+
+class TFLiteEfficientDet(EfficientDetCounter):
+    """EfficientDetCounter running a converted TFLite model on a single reusable interpreter"""
+    def __init__(self, precision=None, input_size=None, model_path=None):
+        self.precision = precision or config.TFLITE_PRECISION
+        self.input_size = input_size or config.TFLITE_INPUT_SIZE
+        self.model_path = model_path
+        self.interpreter = None
+        self.runner = None
+        # One interpreter owns its tensors, so calls from several threads take turns
+        self.lock = threading.Lock()
+        super().__init__()
+
+    def load_model(self):
+        if Interpreter is None:
+            print("❌ Neither TensorFlow nor tflite-runtime available for the TFLite engine")
+            return
+
+        variant = config.EFFICIENTDET_VARIANT
+        path = self.model_path or tflite_model_path(variant, self.precision, self.input_size)
+        if not os.path.isfile(path):
+            if config.TFLITE_AUTO_CONVERT and is_saved_model(local_model_path(variant)):
+                try:
+                    path = convert(variant, self.precision, self.input_size)
+                except Exception as e:
+                    print(f"❌ Could not convert EfficientDet {variant.upper()} to TFLite: {e}")
+                    return
+            else:
+                print(f"❌ No TFLite model at {path} "
+                      f"(run: python model_store.py convert --variant {variant} --precision {self.precision})")
+                return
+
+        start = time.perf_counter()
+        try:
+            self.interpreter = Interpreter(model_path=path, num_threads=config.TFLITE_THREADS or os.cpu_count())
+            self.interpreter.allocate_tensors()
+            signatures = self.interpreter.get_signature_list()
+            signature = next(iter(signatures))
+            self.runner = self.interpreter.get_signature_runner(signature)
+            self.input_name = signatures[signature]['inputs'][0]
+        except Exception as e:
+            if not FLEX_SUPPORTED and ('Flex' in str(e) or 'Select TensorFlow op' in str(e)):
+                print(f"❌ {path} uses Select TF ops, which tflite-runtime cannot run; install tensorflow to use it")
+            else:
+                print(f"❌ Error loading TFLite model {path}: {e}")
+            self.interpreter = self.runner = None
+            return
+
+        # Truthy model means ready, as for the SavedModel engine
+        self.model = self
+        # Part of the result cache key, so counts from different engines never mix
+        self.variant = f"{variant}-tflite-{self.precision}-{self.input_size}"
+        self.load_seconds = time.perf_counter() - start
+        self.supports_batching = False
+        registry.set_gauge('model_load_seconds', round(self.load_seconds, 3))
+        print(f"✅ EfficientDet {variant.upper()} TFLite {self.precision} ({self.input_size}px) "
+              f"loaded in {self.load_seconds:.1f}s")
+
+    def warm_up(self):
+        if self.runner is None:
+            return None
+        start = time.perf_counter()
+        self._invoke(np.zeros((self.input_size, self.input_size, 3), dtype=np.uint8))
+        warmup_seconds = time.perf_counter() - start
+        registry.set_gauge('model_warmup_seconds', round(warmup_seconds, 3))
+        return warmup_seconds
+
+    def load_image(self, image):
+        """RGB array resized straight to the engine's input size"""
+        image = as_image_input(image)
+        max_size = min(self.input_size, image.inference_size or self.input_size)
+        pixels = image.pixels_at(max_size)
+        if pixels is None:
+            raise ValueError(f"Could not decode {image_name(image)}")
+        return to_inference_array(pixels, max_size)
+
+    def _invoke(self, array):
+        """DetectionResult for one RGB array, boxes normalized to the array rather than the canvas"""
+        canvas, (height, width) = letterbox(array, self.input_size)
+        with self.lock:
+            with timed('inference'):
+                outputs = self.runner(**{self.input_name: canvas[np.newaxis, ...]})
+        scale = np.array([self.input_size / height, self.input_size / width] * 2, dtype=np.float32)
+        return DetectionResult(
+            boxes=np.clip(outputs['detection_boxes'][0] * scale, 0.0, 1.0),
+            scores=outputs['detection_scores'][0],
+            classes=outputs['detection_classes'][0],
+            num_detections=int(np.asarray(outputs['num_detections']).reshape(-1)[0])
+        )
+
+    def detect(self, image):
+        if self.runner is None:
+            return None
+        try:
+            return self._invoke(self.load_image(image))
+        except Exception as e:
+            print(f"Error in object detection: {e}")
+            return None
+
+    def detect_batch(self, images, batch_size=None):
+        # The converted model takes one image per call; the interpreter is reused between them
+        return [self.detect(image) for image in images]
+
+    def _detect_padded(self, chunk, padded_height, padded_width):
+        # Tiles from detect_tiled, and micro-batches in the inference server
+        return [self._invoke(array) for _, array in chunk]
@@ -0,0 +1,274 @@
+"""
+People counting for video files and RTSP-style streams
+Frames are sampled adaptively, batched through EfficientDet and tracked with a
+lightweight IoU/centroid tracker, so counts are per unique person rather than
+per frame.
+
+Usage:
+    python video_counter.py entrance.mp4
+    python video_counter.py rtsp://camera/stream --line horizontal:0.6 --max-seconds 600
+"""
+import argparse
+import json
+import math
+import sys
+import time
+
+import cv2
+import numpy as np
+
+import config
+import advanced_detection
+from image_io import ImageInput
+
+def _iou_matrix(a, b):
+    """Pairwise IoU of two (N, 4) arrays of [ymin, xmin, ymax, xmax] boxes"""
+    y1 = np.maximum(a[:, None, 0], b[None, :, 0])
+    x1 = np.maximum(a[:, None, 1], b[None, :, 1])
+    y2 = np.minimum(a[:, None, 2], b[None, :, 2])
+    x2 = np.minimum(a[:, None, 3], b[None, :, 3])
+    intersection = np.clip(y2 - y1, 0, None) * np.clip(x2 - x1, 0, None)
+    area_a = (a[:, 2] - a[:, 0]) * (a[:, 3] - a[:, 1])
+    area_b = (b[:, 2] - b[:, 0]) * (b[:, 3] - b[:, 1])
+    return intersection / np.maximum(area_a[:, None] + area_b[None, :] - intersection, 1e-9)
+
+def _centroids(boxes):
+    return np.stack([(boxes[:, 0] + boxes[:, 2]) / 2, (boxes[:, 1] + boxes[:, 3]) / 2], axis=1)
+
+class Track:
+    def __init__(self, track_id, box, side):
+        self.id = track_id
+        self.box = box
+        self.hits = 1
+        self.missed = 0
+        self.side = side
+
+class PeopleTracker:
+    """
+    Greedy IoU matching with a centroid-distance fallback for the larger motion
+    between sampled frames. Counts confirmed unique people and line crossings.
+    """
+    def __init__(self, iou_threshold=0.3, max_missed=3, min_hits=2, line=None):
+        self.iou_threshold = iou_threshold
+        self.max_missed = max_missed
+        self.min_hits = min_hits
+        # line is (orientation, position) with position normalized to the frame
+        self.line = line
+        self.tracks = []
+        self.next_id = 1
+        self.confirmed_ids = set()
+        self.crossed_in = 0
+        self.crossed_out = 0
+
+    def _side(self, box):
+        if self.line is None:
+            return 0
+        orientation, position = self.line
+        centre = (box[0] + box[2]) / 2 if orientation == 'horizontal' else (box[1] + box[3]) / 2
+        return 1 if centre >= position else -1
+
+    def update(self, boxes):
+        """Advance the tracker by one sampled frame of person boxes"""
+        boxes = np.asarray(boxes, dtype=np.float32).reshape(-1, 4)
+        unmatched_tracks = list(range(len(self.tracks)))
+        unmatched_boxes = list(range(len(boxes)))
+        matches = []
+
+        if self.tracks and len(boxes):
+            track_boxes = np.array([track.box for track in self.tracks])
+
+            # First pass: best IoU pairs, highest first
+            iou = _iou_matrix(track_boxes, boxes)
+            for flat in np.argsort(-iou, axis=None):
+                t, b = divmod(int(flat), len(boxes))
+                if iou[t, b] < self.iou_threshold:
+                    break
+                if t in unmatched_tracks and b in unmatched_boxes:
+                    matches.append((t, b))
+                    unmatched_tracks.remove(t)
+                    unmatched_boxes.remove(b)
+
+            # Second pass: nearest centroids within one box diagonal
+            if unmatched_tracks and unmatched_boxes:
+                candidate_tracks, candidate_boxes = list(unmatched_tracks), list(unmatched_boxes)
+                track_subset = track_boxes[candidate_tracks]
+                distances = np.linalg.norm(_centroids(track_subset)[:, None] - _centroids(boxes[candidate_boxes])[None, :],
+                                           axis=2)
+                diagonals = np.hypot(track_subset[:, 2] - track_subset[:, 0], track_subset[:, 3] - track_subset[:, 1])
+                for flat in np.argsort(distances, axis=None):
+                    i, j = divmod(int(flat), len(candidate_boxes))
+                    t, b = candidate_tracks[i], candidate_boxes[j]
+                    if distances[i, j] <= diagonals[i] and t in unmatched_tracks and b in unmatched_boxes:
+                        matches.append((t, b))
+                        unmatched_tracks.remove(t)
+                        unmatched_boxes.remove(b)
+
+        for t, b in matches:
+            track = self.tracks[t]
+            track.box = boxes[b]
+            track.hits += 1
+            track.missed = 0
+            side = self._side(track.box)
+            if track.side and side and side != track.side:
+                if side > 0:
+                    self.crossed_in += 1
+                else:
+                    self.crossed_out += 1
+            track.side = side or track.side
+            if track.hits >= self.min_hits:
+                self.confirmed_ids.add(track.id)
+
+        for t in unmatched_tracks:
+            self.tracks[t].missed += 1
+        self.tracks = [track for track in self.tracks if track.missed <= self.max_missed]
+
+        for b in unmatched_boxes:
+            self.tracks.append(Track(self.next_id, boxes[b], self._side(boxes[b])))
+            if self.min_hits <= 1:
+                self.confirmed_ids.add(self.next_id)
+            self.next_id += 1
+
+        return [track for track in self.tracks if track.missed == 0]
+
+    @property
+    def unique_count(self):
+        return len(self.confirmed_ids)
+
+def parse_line(value):
+    """Parse 'horizontal:0.5' / 'vertical:0.3' into (orientation, position)"""
+    if not value:
+        return None
+    orientation, _, position = value.partition(':')
+    if orientation not in ('horizontal', 'vertical'):
+        raise ValueError(f"Line orientation must be horizontal or vertical, got {orientation!r}")
+    return orientation, float(position or 0.5)
+
+def count_people_in_video(source, line=None, detect_fps=None, batch_size=None, max_seconds=None,
+                          progress_callback=None):
+    """
+    Count unique people and line crossings in a video file or stream.
+    Returns a summary dict with a per-second 'timeseries'.
+    """
+    if not advanced_detection.initialize_efficientdet():
+        raise RuntimeError("EfficientDet model not available")
+    detector = advanced_detection.efficient_det
+
+    capture = cv2.VideoCapture(source)
+    if not capture.isOpened():
+        raise ValueError(f"Could not open video source {source}")
+
+    fps = capture.get(cv2.CAP_PROP_FPS) or 25.0
+    total_frames = int(capture.get(cv2.CAP_PROP_FRAME_COUNT) or 0)
+    is_stream = total_frames <= 0
+    detect_fps = detect_fps or config.VIDEO_DETECT_FPS
+    # Streams run frame by frame to keep latency low; files batch for throughput
+    batch_size = batch_size or (1 if is_stream else config.VIDEO_BATCH_SIZE)
+    threshold = config.CONFIDENCE_THRESHOLD
+
+    base_interval = max(1, int(round(fps / detect_fps)))
+    interval = base_interval
+    tracker = PeopleTracker(iou_threshold=config.VIDEO_TRACK_IOU, max_missed=config.VIDEO_TRACK_MAX_MISSED,
+                            min_hits=config.VIDEO_TRACK_MIN_HITS, line=line)
+    seconds = {}
+    frame_index = 0
+    pending = []
+    started = time.perf_counter()
+
+    def flush():
+        """Detect a batch of sampled frames and feed them to the tracker in order"""
+        nonlocal interval
+        batch_started = time.perf_counter()
+        detections = detector.detect_batch([_frame_input(index, frame) for index, frame in pending])
+        elapsed = time.perf_counter() - batch_started
+
+        for (index, _), result in zip(pending, detections):
+            boxes = result.person_detections(threshold)[0] if result is not None else np.zeros((0, 4))
+            visible = tracker.update(boxes)
+            second = int(index / fps)
+            bucket = seconds.setdefault(second, {'second': second, 'max_visible': 0, 'samples': 0,
+                                                 'visible_total': 0})
+            bucket['max_visible'] = max(bucket['max_visible'], len(visible))
+            bucket['visible_total'] += len(visible)
+            bucket['samples'] += 1
+            bucket['unique_so_far'] = tracker.unique_count
+            bucket['crossed_in'] = tracker.crossed_in
+            bucket['crossed_out'] = tracker.crossed_out
+
+        # Adapt the sampling so detection keeps up with the video's own frame rate
+        per_frame = elapsed / len(pending)
+        needed = max(base_interval, math.ceil(per_frame * fps))
+        if needed > interval:
+            interval = needed
+        elif needed < interval:
+            interval = max(base_interval, interval - 1)
+        pending.clear()
+
+        if progress_callback is not None and total_frames:
+            progress_callback(min(frame_index, total_frames), total_frames)
+
+    while True:
+        if max_seconds and frame_index / fps >= max_seconds:
+            break
+        if frame_index % interval == 0:
+            ok, frame = capture.read()
+            if not ok:
+                break
+            pending.append((frame_index, frame))
+            if len(pending) >= batch_size:
+                flush()
+        elif not capture.grab():
+            # grab() advances without retrieving the frame; FFmpeg still decodes it, only the colour conversion is skipped
+            break
+        frame_index += 1
+
+    if pending:
+        flush()
+    capture.release()
+
+    timeseries = []
+    for second in sorted(seconds):
+        bucket = seconds[second]
+        timeseries.append({
+            'second': second,
+            'people_visible': round(bucket['visible_total'] / bucket['samples'], 2),
+            'max_visible': bucket['max_visible'],
+            'unique_so_far': bucket['unique_so_far'],
+            'crossed_in': bucket['crossed_in'],
+            'crossed_out': bucket['crossed_out']
+        })
+
+    processing_seconds = time.perf_counter() - started
+    duration = frame_index / fps
+    return {
+        'source': source if is_stream else source.rsplit('/', 1)[-1],
+        'duration_seconds': round(duration, 2),
+        'processing_seconds': round(processing_seconds, 2),
+        'realtime_factor': round(duration / processing_seconds, 2) if processing_seconds else None,
+        'unique_people': tracker.unique_count,
+        'crossed_in': tracker.crossed_in,
+        'crossed_out': tracker.crossed_out,
+        'timeseries': timeseries
+    }
+
+def _frame_input(index, frame):
+    image = ImageInput(f"frame_{index}")
+    image.pixels = frame
+    return image
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Count people in a video file or stream")
+    parser.add_argument('source', help="video file path or stream URL (rtsp://, http://)")
+    parser.add_argument('--line', default=config.VIDEO_COUNT_LINE,
+                        help="counting line, e.g. horizontal:0.5 or vertical:0.3")
+    parser.add_argument('--detect-fps', type=float, help="frames per second sent to the detector")
+    parser.add_argument('--batch-size', type=int, help="sampled frames per forward pass")
+    parser.add_argument('--max-seconds', type=float, help="stop after this much video")
+    args = parser.parse_args(argv)
+
+    summary = count_people_in_video(args.source, line=parse_line(args.line), detect_fps=args.detect_fps,
+                                    batch_size=args.batch_size, max_seconds=args.max_seconds)
+    print(json.dumps(summary, indent=2))
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
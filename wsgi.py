@@ -2,21 +2,27 @@
 Production entry point for Render deployment
 """
 import os
+import config
 from app import app
+from advanced_detection import warm_up_efficientdet
 
 # Production configuration
 app.config.update(
     DEBUG=False,
     UPLOAD_FOLDER='/tmp/uploads',
     PROCESSED_FOLDER='/tmp/processed',
-    RESULTS_FOLDER='/tmp/results',
     MAX_CONTENT_LENGTH=50 * 1024 * 1024  # 50MB limit
 )
 
 # Ensure temp directories exist
-for folder in ['/tmp/uploads', '/tmp/processed', '/tmp/results']:
+for folder in ['/tmp/uploads', '/tmp/processed']:
     os.makedirs(folder, exist_ok=True)
 
+# Load the model and run one inference now, so the first request doesn't pay for it.
+# In parallel mode the worker processes load their own models instead.
+if config.WARMUP_ON_START and config.PARALLEL_WORKERS <= 1:
+    warm_up_efficientdet()
+
 if __name__ == '__main__':
     port = int(os.environ.get('PORT', 5000))
     app.run(host='0.0.0.0', port=port, debug=False)